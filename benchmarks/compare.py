@@ -0,0 +1,45 @@
+"""
+Compares two benchmark reports produced by benchmarks/run.py.
+
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+
+METRICS = (
+    ('throughput_rps', 'req/s', lambda result: result['throughput_rps']),
+    ('p50', 'ms', lambda result: result['latency_ms']['p50']),
+    ('p95', 'ms', lambda result: result['latency_ms']['p95']),
+    ('p99', 'ms', lambda result: result['latency_ms']['p99'])
+)
+
+
+def _change(before, after):
+    if not before:
+        return ''
+    return '{:+.1f}%'.format((after - before) / before * 100)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compares two benchmark reports')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+    with open(args.before) as before_file, open(args.after) as after_file:
+        before, after = json.load(before_file), json.load(after_file)
+
+    if before['dataset'] != after['dataset']:
+        print('Warning: the reports were produced with different datasets')
+    print('{:<18} {:<22} {:>12} {:>12} {:>9}'.format('scenario', 'metric', 'before', 'after', 'change'))
+    for name, result in after['scenarios'].items():
+        if name not in before['scenarios']:
+            continue
+        for metric, unit, value in METRICS:
+            old, new = value(before['scenarios'][name]), value(result)
+            print('{:<18} {:<22} {:>12.2f} {:>12.2f} {:>9}'.format(
+                name, metric + ' (' + unit + ')', old, new, _change(old, new)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Synthetic dataset for the benchmarks.
+Rows are generated by a seeded random generator, so that the same
+parameters always produce the same dataset, and inserted in bulk.
+"""
+
+import datetime
+import random
+import uuid
+
+from obar.models import db, Customer, Product, Purchase, PurchaseItem, Site
+from obar.apis.service.sales_service import rebuild_counters
+
+PIN = 12345
+ADMIN_MAIL_ADDRESS = 'admin@bench.obar'
+BATCH_SIZE = 5000
+
+
+def customer_mail_address(index):
+    return 'customer{}@bench.obar'.format(index)
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.bulk_insert_mappings(model, rows[start:start + BATCH_SIZE])
+
+
+def seed(customers=200, products=100, sites=5, months=6, purchases_per_day=50, seed=0):
+    """
+    Fills an empty database with a synthetic dataset and rebuilds the sales counters.
+    Every customer, the admin included, has the PIN `PIN`.
+    :param months: months of purchase history, ending now
+    :param purchases_per_day: average number of purchases per day, of 1 to 3 items each
+    :return: the codes of the products
+    """
+    generator = random.Random(seed)
+    # hashing is deliberately slow, every customer shares the same hash
+    pin_hash = Customer.hash_pin(str(PIN))
+
+    _insert(Site, [{'site_id': site_id,
+                    'site_address': 'Street {}'.format(site_id),
+                    'site_city': 'City'}
+                   for site_id in range(1, sites + 1)])
+
+    customer_rows = [{'customer_mail_address': customer_mail_address(index),
+                      'customer_pin_hash': pin_hash,
+                      'customer_first_name': 'First{}'.format(index),
+                      'customer_last_name': 'Last{}'.format(index),
+                      'customer_is_admin': False}
+                     for index in range(customers)]
+    customer_rows.append({'customer_mail_address': ADMIN_MAIL_ADDRESS,
+                          'customer_pin_hash': pin_hash,
+                          'customer_first_name': 'Admin',
+                          'customer_last_name': 'Admin',
+                          'customer_is_admin': True})
+    _insert(Customer, customer_rows)
+
+    product_rows = [{'product_code_uuid': uuid.UUID(int=generator.getrandbits(128)).hex,
+                     'product_name': 'Product {}'.format(index),
+                     'product_availability': True,
+                     'product_discount': generator.choice((0, 0, 0, 10, 25)),
+                     'product_price': generator.randint(50, 500) / 100,
+                     # large enough for the checkout benchmark never to run out of stock
+                     'product_quantity': 10 ** 9,
+                     'product_location_id': generator.randint(1, sites)}
+                    for index in range(products)]
+    _insert(Product, product_rows)
+
+    now = datetime.datetime.utcnow()
+    start = now - datetime.timedelta(days=30 * months)
+    purchase_count = 30 * months * purchases_per_day
+    purchase_rows = []
+    item_rows = []
+    for _ in range(purchase_count):
+        purchase_code = uuid.UUID(int=generator.getrandbits(128)).hex
+        purchase_rows.append({
+            'purchase_code_uuid': purchase_code,
+            'purchase_date': start + (now - start) * generator.random(),
+            'purchase_customer_mail_address': customer_mail_address(generator.randrange(customers)),
+            'purchase_gifted': False})
+        for product in generator.sample(product_rows, generator.randint(1, min(3, products))):
+            quantity = generator.randint(1, 3)
+            item_rows.append({
+                'purchase_item_uuid': uuid.UUID(int=generator.getrandbits(128)).hex,
+                'purchase_item_quantity': quantity,
+                'purchase_item_price': (1 - product['product_discount'] / 100) * product['product_price'] * quantity,
+                'purchase_item_product_code_uuid': product['product_code_uuid'],
+                'purchase_item_purchase_code_uuid': purchase_code})
+    _insert(Purchase, purchase_rows)
+    _insert(PurchaseItem, item_rows)
+    db.session.commit()
+    rebuild_counters()
+    return [product['product_code_uuid'] for product in product_rows]
@@ -0,0 +1,96 @@
+"""
+Benchmarks the login under each PIN hashing method.
+For each method it measures the PIN checks per second of a single core and
+the throughput and latency of the login endpoint, reported as JSON.
+
+    python -m benchmarks.pin_hashing --methods pbkdf2:sha256:150000,pbkdf2:sha256:20000
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from werkzeug.security import check_password_hash
+
+from obar import create_app
+from obar.models import db, Customer
+from .run import percentile
+
+DEFAULT_METHODS = ('pbkdf2:sha256:150000', 'pbkdf2:sha256:50000', 'pbkdf2:sha256:10000',
+                   'pbkdf2:sha256:1000', 'sha256')
+PIN = '12345'
+
+
+def measure(method, directory, requests):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(directory, 'pin_hashing.db'),
+        'PRODUCT_IMAGE_STORAGE_DIR': os.path.join(directory, 'images'),
+        'PIN_HASH_METHOD': method
+    })
+    app.logger.setLevel(logging.WARNING)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        customer = Customer('customer@bench.obar', PIN, 'First', 'Last')
+        pin_hash = customer.customer_pin_hash
+        db.session.add(customer)
+        db.session.commit()
+        db.session.remove()
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            check_password_hash(pin_hash, PIN)
+        checks = requests / (time.perf_counter() - started)
+
+        client = app.test_client()
+        latencies = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = client.post('/auth/login', json={'mail_address': 'customer@bench.obar', 'pin': int(PIN)})
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+    latencies.sort()
+    return {
+        'checks_per_second': round(checks, 1),
+        'login_throughput_rps': round(requests / sum(latencies), 2),
+        'login_latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3)
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--methods', default=','.join(DEFAULT_METHODS),
+                        help='comma separated werkzeug hashing methods')
+    parser.add_argument('--requests', type=int, default=50, help='measured logins per method')
+    parser.add_argument('--output', help='file to write the JSON report to, stdout by default')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp(prefix='obar-bench-')
+    results = dict()
+    try:
+        for method in args.methods.split(','):
+            results[method] = measure(method, directory, args.requests)
+            print('{:<24} {:>10.1f} checks/s  login {:>8.1f} req/s  p50 {:>8.2f} ms'.format(
+                method, results[method]['checks_per_second'], results[method]['login_throughput_rps'],
+                results[method]['login_latency_ms']['p50']))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+Benchmarks the hot paths of the API on a synthetic SQLite dataset.
+Each scenario sends sequential requests through the Flask test client and
+reports its throughput and latency percentiles as JSON, to be compared
+between releases with benchmarks/compare.py.
+
+    python -m benchmarks.run --customers 500 --months 12 --output before.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import flask
+import sqlalchemy
+
+from obar import create_app
+from obar.models import db
+from . import dataset
+
+STATEMENTS = re.compile(r'desc="(\d+) statements"')
+
+
+def _login(client, mail_address):
+    response = client.post('/auth/login', json={'mail_address': mail_address, 'pin': dataset.PIN})
+    return {'Authorization': response.json['Authorization']}
+
+
+def login(client, context, generator):
+    mail_address = dataset.customer_mail_address(generator.randrange(context['customers']))
+    return client.post('/auth/login', json={'mail_address': mail_address, 'pin': dataset.PIN})
+
+
+def product_list(client, context, generator):
+    return client.get('/product', headers=context['customer'])
+
+
+def checkout(client, context, generator):
+    products = generator.sample(context['products'], min(3, len(context['products'])))
+    details = [{'product_code': code, 'purchase_quantity': 1}
+               for code in products[:generator.randint(1, len(products))]]
+    return client.post('/operation/purchaseProducts', json={'purchase_details': details},
+                       headers=context['customer'])
+
+
+def leaderboard(client, context, generator):
+    return client.post('/operation/purchaseLeaderboard', headers=context['customer'])
+
+
+def best_products(client, context, generator):
+    return client.post('/operation/bestProducts', headers=context['customer'])
+
+
+def expenses(client, context, generator):
+    return client.post('/operation/produceExpensesReport', headers=context['admin'])
+
+
+def recent_purchases(client, context, generator):
+    return client.post('/operation/recentPurchase')
+
+
+SCENARIOS = {
+    'login': login,
+    'product_list': product_list,
+    'checkout': checkout,
+    'leaderboard': leaderboard,
+    'best_products': best_products,
+    'expenses': expenses,
+    'recent_purchases': recent_purchases
+}
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    rank = max(int(math.ceil(percent / 100 * len(sorted_values))), 1)
+    return sorted_values[rank - 1]
+
+
+def run_scenario(client, scenario, context, requests, warmup, generator):
+    for _ in range(warmup):
+        scenario(client, context, generator)
+    latencies = []
+    statements = []
+    errors = 0
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = scenario(client, context, generator)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            errors += 1
+        timing = STATEMENTS.search(response.headers.get('Server-Timing', ''))
+        if timing is not None:
+            statements.append(int(timing.group(1)))
+    latencies.sort()
+    result = {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / sum(latencies), 2),
+        'latency_ms': {
+            'mean': round(sum(latencies) / requests * 1000, 3),
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3)
+        }
+    }
+    if statements:
+        result['statements_per_request'] = round(sum(statements) / len(statements), 2)
+    return result
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--sites', type=int, default=5)
+    parser.add_argument('--months', type=int, default=6, help='months of purchase history')
+    parser.add_argument('--purchases-per-day', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated scenarios, run in this order')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database', help='SQLite file to use, a temporary one by default')
+    parser.add_argument('--sqlite-profile', default='default', help='SQLITE_PROFILE of the application')
+    parser.add_argument('--pin-hash-method', default='pbkdf2:sha256', help='PIN_HASH_METHOD of the application')
+    parser.add_argument('--instrument', action='store_true',
+                        help='enable the instrumentation to report the SQL statements per request')
+    parser.add_argument('--output', help='file to write the JSON report to, stdout by default')
+    args = parser.parse_args(argv)
+
+    scenarios = args.scenarios.split(',')
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error('unknown scenarios: ' + ', '.join(unknown))
+
+    directory = None
+    database = args.database
+    if database is None:
+        directory = tempfile.mkdtemp(prefix='obar-bench-')
+        database = os.path.join(directory, 'bench.db')
+    try:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.abspath(database),
+            'PRODUCT_IMAGE_STORAGE_DIR': os.path.join(directory or os.path.dirname(database), 'images'),
+            'SQLITE_PROFILE': args.sqlite_profile,
+            'PIN_HASH_METHOD': args.pin_hash_method,
+            'INSTRUMENTATION': args.instrument
+        })
+        app.logger.setLevel(logging.WARNING)
+        with app.app_context():
+            db.create_all()
+            started = time.perf_counter()
+            products = dataset.seed(customers=args.customers, products=args.products, sites=args.sites,
+                                    months=args.months, purchases_per_day=args.purchases_per_day,
+                                    seed=args.seed)
+            seeding = time.perf_counter() - started
+            db.session.remove()
+
+            client = app.test_client()
+            context = {
+                'customers': args.customers,
+                'products': products,
+                'customer': _login(client, dataset.customer_mail_address(0)),
+                'admin': _login(client, dataset.ADMIN_MAIL_ADDRESS)
+            }
+            generator = random.Random(args.seed)
+            results = dict()
+            for name in scenarios:
+                results[name] = run_scenario(client, SCENARIOS[name], context,
+                                             args.requests, args.warmup, generator)
+                print('{:<18} {:>9.1f} req/s  p50 {:>8.2f} ms  p95 {:>8.2f} ms  p99 {:>8.2f} ms'.format(
+                    name, results[name]['throughput_rps'], results[name]['latency_ms']['p50'],
+                    results[name]['latency_ms']['p95'], results[name]['latency_ms']['p99']), file=sys.stderr)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.utcnow().isoformat(),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'flask': flask.__version__,
+            'sqlalchemy': sqlalchemy.__version__,
+            'platform': platform.platform(),
+            'seeding_s': round(seeding, 3)
+        },
+        'dataset': {
+            'customers': args.customers,
+            'products': args.products,
+            'sites': args.sites,
+            'months': args.months,
+            'purchases_per_day': args.purchases_per_day,
+            'seed': args.seed,
+            'sqlite_profile': args.sqlite_profile,
+            'pin_hash_method': args.pin_hash_method
+        },
+        'scenarios': results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
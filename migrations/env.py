@@ -22,6 +22,7 @@ logger = logging.getLogger('alembic.env')
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
 from flask import current_app
+from obar.sqlite import apply_profile, migration_pragmas
 config.set_main_option(
     'sqlalchemy.url', current_app.config.get(
         'SQLALCHEMY_DATABASE_URI').replace('%', '%%'))
@@ -77,6 +78,8 @@ def run_migrations_online():
         prefix='sqlalchemy.',
         poolclass=pool.NullPool,
     )
+    # the migrations run with the performance pragmas of the application, without foreign key checks
+    apply_profile(connectable, migration_pragmas(current_app.config), logger)
 
     with connectable.connect() as connection:
         context.configure(
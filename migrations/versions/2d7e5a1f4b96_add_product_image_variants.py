@@ -0,0 +1,36 @@
+"""add the product image variant table
+
+Revision ID: 2d7e5a1f4b96
+Revises: 9b2d4f6a8c13
+Create Date: 2026-10-18 10:02:14.220931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2d7e5a1f4b96'
+down_revision = '9b2d4f6a8c13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the variants of the existing images are generated by `flask generate-image-variants`
+    op.create_table('product_image_variant',
+                    sa.Column('product_image_variant_product_code_uuid', sa.String(), nullable=False),
+                    sa.Column('product_image_variant_size', sa.String(), nullable=False),
+                    sa.Column('product_image_variant_digest', sa.String(length=64), nullable=True),
+                    sa.Column('product_image_variant_mimetype', sa.String(), nullable=True),
+                    sa.Column('product_image_variant_width', sa.Integer(), nullable=True),
+                    sa.Column('product_image_variant_height', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['product_image_variant_product_code_uuid'],
+                                            ['product.product_code_uuid']),
+                    sa.PrimaryKeyConstraint('product_image_variant_product_code_uuid',
+                                            'product_image_variant_size'))
+
+
+def downgrade():
+    # the files of the variants stay in the image storage
+    op.drop_table('product_image_variant')
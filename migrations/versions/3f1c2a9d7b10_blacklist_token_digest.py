@@ -0,0 +1,62 @@
+"""store blacklisted tokens as digest and expiry
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-17 09:12:44.318920
+
+"""
+import datetime
+import hashlib
+
+import jwt
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blacklist_token') as batch_op:
+        batch_op.add_column(sa.Column('token_digest', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('expires_on', sa.DateTime(), nullable=True))
+
+    # Tokens blacklisted so far carry no jti, so they are keyed by the digest of the whole token
+    connection = op.get_bind()
+    blacklist = sa.table('blacklist_token',
+                         sa.column('id', sa.Integer()),
+                         sa.column('token', sa.String()),
+                         sa.column('token_digest', sa.String()),
+                         sa.column('expires_on', sa.DateTime()))
+    for row in connection.execute(sa.select([blacklist.c.id, blacklist.c.token])).fetchall():
+        try:
+            expires_on = datetime.datetime.utcfromtimestamp(jwt.decode(row.token, verify=False)['exp'])
+        except (jwt.InvalidTokenError, KeyError):
+            expires_on = datetime.datetime.utcnow()
+        connection.execute(blacklist.update()
+                           .where(blacklist.c.id == row.id)
+                           .values(token_digest=hashlib.sha256(row.token.encode('utf-8')).hexdigest(),
+                                   expires_on=expires_on))
+
+    with op.batch_alter_table('blacklist_token') as batch_op:
+        batch_op.drop_column('token')
+        batch_op.alter_column('token_digest', existing_type=sa.String(length=64), nullable=False)
+        batch_op.alter_column('expires_on', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_unique_constraint('uq_blacklist_token_token_digest', ['token_digest'])
+        batch_op.create_index('ix_blacklist_token_expires_on', ['expires_on'], unique=False)
+
+
+def downgrade():
+    # Raw tokens cannot be recovered from their digest: the blacklist is emptied
+    op.execute('DELETE FROM blacklist_token')
+    with op.batch_alter_table('blacklist_token') as batch_op:
+        batch_op.drop_index('ix_blacklist_token_expires_on')
+        batch_op.drop_constraint('uq_blacklist_token_token_digest', type_='unique')
+        batch_op.drop_column('expires_on')
+        batch_op.drop_column('token_digest')
+        batch_op.add_column(sa.Column('token', sa.String(length=500), nullable=False))
+        batch_op.create_unique_constraint('uq_blacklist_token_token', ['token'])
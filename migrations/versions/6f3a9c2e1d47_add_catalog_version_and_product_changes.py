@@ -0,0 +1,43 @@
+"""add the catalog version and the product change log
+
+Revision ID: 6f3a9c2e1d47
+Revises: 2d7e5a1f4b96
+Create Date: 2026-10-18 10:41:05.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f3a9c2e1d47'
+down_revision = '2d7e5a1f4b96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    catalog_version = op.create_table(
+        'catalog_version',
+        sa.Column('catalog_version_id', sa.Integer(), nullable=False),
+        sa.Column('catalog_version_number', sa.Integer(), nullable=False),
+        sa.Column('catalog_version_purged_sequence', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('catalog_version_id'))
+    op.create_table('product_change',
+                    sa.Column('product_change_sequence', sa.Integer(), nullable=False),
+                    sa.Column('product_change_date', sa.DateTime(), nullable=False),
+                    sa.Column('product_change_product_code_uuid', sa.String(), nullable=False),
+                    sa.Column('product_change_operation', sa.String(), nullable=False),
+                    sa.Column('product_change_data', sa.Text(), nullable=True),
+                    sa.PrimaryKeyConstraint('product_change_sequence'),
+                    sqlite_autoincrement=True)
+
+    # the row locked by the transactions changing the products
+    op.bulk_insert(catalog_version, [{'catalog_version_id': 1,
+                                      'catalog_version_number': 0,
+                                      'catalog_version_purged_sequence': 0}])
+
+
+def downgrade():
+    op.drop_table('product_change')
+    op.drop_table('catalog_version')
@@ -0,0 +1,49 @@
+"""add digest and update date to product images
+
+Revision ID: 8a4e61c0d2f5
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-17 11:40:02.527113
+
+"""
+import datetime
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a4e61c0d2f5'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product_image') as batch_op:
+        batch_op.add_column(sa.Column('product_image_digest', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('product_image_updated_on', sa.DateTime(), nullable=True))
+
+    connection = op.get_bind()
+    product_image = sa.table('product_image',
+                             sa.column('product_image_filename', sa.String()),
+                             sa.column('product_image_binary', sa.LargeBinary()),
+                             sa.column('product_image_digest', sa.String()),
+                             sa.column('product_image_updated_on', sa.DateTime()))
+    updated_on = datetime.datetime.utcnow().replace(microsecond=0)
+    filenames = [row[0] for row in connection.execute(sa.select([product_image.c.product_image_filename]))]
+    # Images are read one at a time to avoid loading every blob in memory
+    for filename in filenames:
+        binary = connection.execute(
+            sa.select([product_image.c.product_image_binary])
+            .where(product_image.c.product_image_filename == filename)).scalar()
+        connection.execute(product_image.update()
+                           .where(product_image.c.product_image_filename == filename)
+                           .values(product_image_digest=hashlib.sha256(binary or b'').hexdigest(),
+                                   product_image_updated_on=updated_on))
+
+
+def downgrade():
+    with op.batch_alter_table('product_image') as batch_op:
+        batch_op.drop_column('product_image_updated_on')
+        batch_op.drop_column('product_image_digest')
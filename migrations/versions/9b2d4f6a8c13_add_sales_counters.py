@@ -0,0 +1,79 @@
+"""add the sales counter tables, filled from the purchase history
+
+Revision ID: 9b2d4f6a8c13
+Revises: e47d1b3a5c88
+Create Date: 2026-10-18 09:21:37.512064
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b2d4f6a8c13'
+down_revision = 'e47d1b3a5c88'
+branch_labels = None
+depends_on = None
+
+purchase = sa.table('purchase',
+                    sa.column('purchase_code_uuid', sa.String()),
+                    sa.column('purchase_date', sa.DateTime()),
+                    sa.column('purchase_customer_mail_address', sa.String()))
+
+purchase_item = sa.table('purchase_item',
+                         sa.column('purchase_item_uuid', sa.String()),
+                         sa.column('purchase_item_quantity', sa.Integer()),
+                         sa.column('purchase_item_price', sa.Float()),
+                         sa.column('purchase_item_product_code_uuid', sa.String()),
+                         sa.column('purchase_item_purchase_code_uuid', sa.String()))
+
+
+def upgrade():
+    customer_sales = op.create_table('customer_sales',
+                    sa.Column('customer_sales_mail_address', sa.String(), nullable=False),
+                    sa.Column('customer_sales_items', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('customer_sales_mail_address'))
+    product_sales = op.create_table('product_sales',
+                    sa.Column('product_sales_code_uuid', sa.String(), nullable=False),
+                    sa.Column('product_sales_units', sa.Integer(), nullable=False),
+                    sa.Column('product_sales_revenue', sa.Float(), nullable=False),
+                    sa.Column('product_sales_purchases', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('product_sales_code_uuid'))
+    daily_sales = op.create_table('daily_sales',
+                    sa.Column('daily_sales_day', sa.Date(), nullable=False),
+                    sa.Column('daily_sales_items', sa.Integer(), nullable=False),
+                    sa.Column('daily_sales_revenue', sa.Float(), nullable=False),
+                    sa.Column('daily_sales_purchases', sa.Integer(), nullable=False),
+                    sa.PrimaryKeyConstraint('daily_sales_day'))
+
+    # the leaderboard and the best-selling products are read from the counters only
+    items = purchase.join(purchase_item,
+                          purchase_item.c.purchase_item_purchase_code_uuid == purchase.c.purchase_code_uuid)
+    op.execute(customer_sales.insert().from_select(
+        ['customer_sales_mail_address', 'customer_sales_items'],
+        sa.select([purchase.c.purchase_customer_mail_address,
+                   sa.func.sum(purchase_item.c.purchase_item_quantity)])
+        .select_from(items)
+        .group_by(purchase.c.purchase_customer_mail_address)))
+    op.execute(product_sales.insert().from_select(
+        ['product_sales_code_uuid', 'product_sales_units', 'product_sales_revenue', 'product_sales_purchases'],
+        sa.select([purchase_item.c.purchase_item_product_code_uuid,
+                   sa.func.sum(purchase_item.c.purchase_item_quantity),
+                   sa.func.sum(purchase_item.c.purchase_item_price),
+                   sa.func.count(purchase_item.c.purchase_item_uuid)])
+        .group_by(purchase_item.c.purchase_item_product_code_uuid)))
+    day = sa.func.date(purchase.c.purchase_date)
+    op.execute(daily_sales.insert().from_select(
+        ['daily_sales_day', 'daily_sales_items', 'daily_sales_revenue', 'daily_sales_purchases'],
+        sa.select([day,
+                   sa.func.sum(purchase_item.c.purchase_item_quantity),
+                   sa.func.sum(purchase_item.c.purchase_item_price),
+                   sa.func.count(sa.func.distinct(purchase.c.purchase_code_uuid))])
+        .select_from(items)
+        .group_by(day)))
+
+
+def downgrade():
+    op.drop_table('daily_sales')
+    op.drop_table('product_sales')
+    op.drop_table('customer_sales')
@@ -0,0 +1,79 @@
+"""move product image binaries to the image storage
+
+Revision ID: c5b07e3f9a21
+Revises: 8a4e61c0d2f5
+Create Date: 2026-10-17 14:03:51.904417
+
+"""
+import hashlib
+import os
+import tempfile
+
+from alembic import op
+from flask import current_app
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5b07e3f9a21'
+down_revision = '8a4e61c0d2f5'
+branch_labels = None
+depends_on = None
+
+product_image = sa.table('product_image',
+                         sa.column('product_image_filename', sa.String()),
+                         sa.column('product_image_binary', sa.LargeBinary()),
+                         sa.column('product_image_digest', sa.String()))
+
+
+def _storage_path(digest):
+    # layout of the image storage: <root>/<first two characters of the digest>/<rest of the digest>
+    root = current_app.config.get('PRODUCT_IMAGE_STORAGE_DIR', os.path.join(os.getcwd(), 'persistent', 'images'))
+    return os.path.join(root, digest[:2], digest[2:])
+
+
+def _save(binary):
+    digest = hashlib.sha256(binary).hexdigest()
+    path = _storage_path(digest)
+    if not os.path.exists(path):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(binary)
+        os.replace(temp_path, path)
+    return digest
+
+
+def _read(digest):
+    with open(_storage_path(digest), 'rb') as image_file:
+        return image_file.read()
+
+
+def upgrade():
+    connection = op.get_bind()
+    filenames = [row[0] for row in connection.execute(sa.select([product_image.c.product_image_filename]))]
+    # Images are moved one at a time to avoid loading every blob in memory
+    for filename in filenames:
+        binary = connection.execute(
+            sa.select([product_image.c.product_image_binary])
+            .where(product_image.c.product_image_filename == filename)).scalar()
+        connection.execute(product_image.update()
+                           .where(product_image.c.product_image_filename == filename)
+                           .values(product_image_digest=_save(binary or b'')))
+
+    with op.batch_alter_table('product_image') as batch_op:
+        batch_op.drop_column('product_image_binary')
+
+
+def downgrade():
+    with op.batch_alter_table('product_image') as batch_op:
+        batch_op.add_column(sa.Column('product_image_binary', sa.LargeBinary(), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([product_image.c.product_image_filename,
+                                         product_image.c.product_image_digest])).fetchall()
+    for filename, digest in rows:
+        connection.execute(product_image.update()
+                           .where(product_image.c.product_image_filename == filename)
+                           .values(product_image_binary=_read(digest)))
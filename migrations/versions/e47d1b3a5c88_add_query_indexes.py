@@ -0,0 +1,33 @@
+"""add indexes on foreign keys and purchase dates
+
+Revision ID: e47d1b3a5c88
+Revises: c5b07e3f9a21
+Create Date: 2026-10-17 17:40:11.204871
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e47d1b3a5c88'
+down_revision = 'c5b07e3f9a21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_purchase_date', 'purchase',
+                    ['purchase_date', 'purchase_code_uuid'])
+    op.create_index('ix_purchase_customer_date', 'purchase',
+                    ['purchase_customer_mail_address', 'purchase_date', 'purchase_code_uuid'])
+    op.create_index('ix_purchase_item_purchase', 'purchase_item', ['purchase_item_purchase_code_uuid'])
+    op.create_index('ix_purchase_item_product', 'purchase_item', ['purchase_item_product_code_uuid'])
+    op.create_index('ix_product_location', 'product', ['product_location_id', 'product_code_uuid'])
+
+
+def downgrade():
+    op.drop_index('ix_product_location', table_name='product')
+    op.drop_index('ix_purchase_item_product', table_name='purchase_item')
+    op.drop_index('ix_purchase_item_purchase', table_name='purchase_item')
+    op.drop_index('ix_purchase_customer_date', table_name='purchase')
+    op.drop_index('ix_purchase_date', table_name='purchase')
@@ -1,57 +1,67 @@
 import os
 import logging
+from obar import cache, catalog, config, feed, instrumentation, sqlite, storage
+from obar.config import basedir
 from obar.models import db
 from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
 from flask_restplus import Api
 from flask.logging import default_handler
-from sqlalchemy import event
-from sqlite3 import Connection as SQLite3Connection
 from obar.apis import customer_namespace, product_namespace, purchase_namespace, \
     operation_namespace, auth_namespace, site_namespace
 
 migrate = Migrate()
-basedir = os.getcwd()
 
 
 def create_app(test_config=None):
     app = Flask(__name__)
     app.logger.info('Current working directory: %s', basedir)
-    src_dir = os.path.join(basedir, 'persistent')
 
-    app.config.from_mapping(
-        SECRET_KEY='developing',
-        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(src_dir, 'obar_database.db'),
-        SQLALCHEMY_TRACK_MODIFICATIONS=False
-    )
+    app.config.from_object(config.get_config(os.environ.get('OBAR_CONFIG')))
+    config.from_environment(app.config)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
+    config.check(app.config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = config.engine_options(app.config)
 
     app.logger.addHandler(default_handler)
     logging.getLogger('sqlalchemy').addHandler(default_handler)
 
-    # Adds an event listener for db connection.
-    # Allows to execute the PRAGMA foreign_keys=ON; instruction in order
-    # to enable the foreign key constraint check SQLite3
-    from sqlalchemy.engine import Engine
-
-    @event.listens_for(Engine, "connect")
-    def _set_sqlite_pragma(dbapi_connection, connection_record):
-        app.logger.info('Setting PRAGMA foreign_keys=ON;')
-        if isinstance(dbapi_connection, SQLite3Connection):
-            cursor = dbapi_connection.cursor()
-            cursor.execute("PRAGMA foreign_keys=ON;")
-            cursor.close()
-
     # Import models to allow SQLAlchemy to create tables
-    from obar.models import Customer, Purchase, PurchaseItem, Product, ProductImage, BlacklistToken, Site
+    from obar.models import Customer, Purchase, PurchaseItem, Product, ProductImage, ProductImageVariant, \
+        BlacklistToken, Site, CustomerSales, ProductSales, DailySales, CatalogVersion, ProductChange
 
     CORS(app)
     db.init_app(app)
     app.logger.info('Initialized database plug-in')
 
+    # Executes the PRAGMA instructions of the SQLite profile on each connection,
+    # among them foreign_keys=ON to enable the foreign key constraint check
+    sqlite.init_app(app)
+
     migrate.init_app(app, db)
     app.logger.info('Initialized migration plug-in')
 
+    cache.init_app(app)
+    app.logger.info('Initialized revocation cache')
+
+    storage.init_app(app, basedir)
+    app.logger.info('Initialized image storage')
+
+    feed.init_app(app)
+    app.logger.info('Initialized recent purchases feed')
+
+    catalog.init_app(app)
+    app.logger.info('Initialized catalog cache')
+
+    from obar import commands
+    app.cli.add_command(commands.rebuild_sales_counters_command)
+    app.cli.add_command(commands.purge_blacklist_command)
+    app.cli.add_command(commands.purge_product_changes_command)
+    app.cli.add_command(commands.generate_image_variants_command)
+    app.cli.add_command(commands.import_customers_command)
+
     api = Api(
         title='OBar',
         version='1.0',
@@ -68,6 +78,9 @@ def create_app(test_config=None):
     api.add_namespace(operation_namespace.operation_ns)
     api.add_namespace(auth_namespace.auth_ns)
     api.init_app(app)
+
+    if instrumentation.init_app(app, api) is not None:
+        app.logger.info('Initialized request instrumentation')
     # Ensure the instance folder exists, otherwise create it.
     try:
         os.makedirs(app.instance_path)
@@ -1,5 +1,5 @@
 from flask_restplus import Namespace, Resource
-from flask import request
+from flask import g, request
 from .service.auth_service import login_customer, logout_customer, register_admin_customer
 from .marshal.fields import customer_login_fields
 from .decorator import customer_token_required
@@ -32,10 +32,7 @@ class CustomerLogoutAPI(Resource):
     @customer_token_required
     @auth_ns.doc('customer_logout', security='JWT')
     def post(self):
-        # get auth token
-        auth_header = request.headers.get('Authorization')
-        print(auth_header)
-        return logout_customer(data=auth_header)
+        return logout_customer(g.identity)
 
 
 @auth_ns.route('/createAdminUser')
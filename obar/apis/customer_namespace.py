@@ -1,11 +1,16 @@
-from flask import request, current_app
-from flask_restplus import Namespace, Resource, fields
+import csv
+
+from flask import g, request, current_app
+from flask_restplus import Namespace, Resource, fields, marshal
 from sqlalchemy.exc import OperationalError, IntegrityError
-from werkzeug.exceptions import Conflict, InternalServerError, NotFound, UnprocessableEntity, Unauthorized, Forbidden
+from werkzeug.exceptions import BadRequest, Conflict, InternalServerError, NotFound, UnprocessableEntity, \
+    Unauthorized, Forbidden
 
 from obar import db
 from obar.models import Customer
 from .decorator import admin_token_required, customer_token_required
+from .pagination import pagination_parser, paginate, marshal_page
+from .service.customer_service import import_customers, parse_customer_csv
 
 authorizations = {
     "JWT": {
@@ -60,24 +65,39 @@ customer_put_model = customer_ns.model('Customer Update', {
                                attribute='customer_last_name')
 })
 
+customer_list_parser = pagination_parser(customer_ns)
+
+customer_import_result_model = customer_ns.model('Customer Import Result', {
+    'row': fields.Integer(description='Index of the row in the import'),
+    'mail_address': fields.String(description='Customer mail address'),
+    'status': fields.String(description='created, invalid or conflict'),
+    'message': fields.String(description='Reason why the customer was not created')
+})
+
+customer_import_model = customer_ns.model('Customer Import', {
+    'created': fields.Integer(description='Number of created customers'),
+    'results': fields.List(fields.Nested(customer_import_result_model, skip_none=True))
+})
+
 
 @customer_ns.route('')
 class CustomerListAPI(Resource):
 
     @customer_ns.doc('get_customer_list', security='JWT')
-    @customer_ns.response(200, 'Returns a list of customers')
+    @customer_ns.response(200, 'Returns a list of customers', [customer_output_model])
     @customer_ns.response(500, 'Internal server error')
-    @customer_ns.marshal_list_with(customer_output_model)
+    @customer_ns.expect(customer_list_parser)
     def get(self):
         """
         Returns a list of customers.
         """
-        customer_list = None
+        args = customer_list_parser.parse_args()
         try:
-            customer_list = Customer.query.all()
+            customer_list, next_cursor = paginate(Customer.query, [Customer.customer_mail_address],
+                                                  args['limit'], args['after'])
         except OperationalError:
             raise InternalServerError(description='Customer table does not exists.')
-        return customer_list, 200
+        return marshal_page(customer_list, customer_output_model, args['fields'], next_cursor)
 
     @admin_token_required
     @customer_ns.doc('post_customer', security='JWT')
@@ -109,6 +129,40 @@ class CustomerListAPI(Resource):
         return {'message': 'Resource created'}, 201
 
 
+@customer_ns.route('/import')
+class CustomerImportAPI(Resource):
+
+    @admin_token_required
+    @customer_ns.doc('import_customers', security='JWT')
+    @customer_ns.response(200, 'Import report', customer_import_model)
+    @customer_ns.response(400, 'The body is neither a JSON array nor a CSV file')
+    @customer_ns.response(500, 'Internal server error')
+    def post(self):
+        """
+        Creates customers in bulk, from a JSON array of customers or from a CSV file
+        with a mail_address,pin,first_name,last_name header, sent as the body or as
+        the 'file' field of a form. The rows that are invalid or conflict with an
+        existing customer are reported and skipped.
+        """
+        if request.is_json:
+            rows = request.get_json()
+            if not isinstance(rows, list):
+                raise BadRequest('The body must be a JSON array of customers')
+        else:
+            upload = request.files.get('file')
+            data = upload.read() if upload is not None else request.get_data()
+            try:
+                rows = parse_customer_csv(data.decode('utf-8-sig'))
+            except (UnicodeDecodeError, csv.Error, ValueError) as e:
+                raise BadRequest(str(e))
+        try:
+            report = import_customers(rows)
+        except OperationalError:
+            db.session.remove()
+            raise InternalServerError(description='Customer table does not exists.')
+        return marshal(report, customer_import_model), 200
+
+
 @customer_ns.route('/<string:mail_address>')
 class CustomerAPI(Resource):
 
@@ -121,9 +175,7 @@ class CustomerAPI(Resource):
         """
         Get customer data.
         """
-        token = request.headers['Authorization']
-        data = Customer.decode_auth_token(token)
-        if not data['admin'] and data['customer'] != mail_address:
+        if not g.identity.admin and g.identity.mail_address != mail_address:
             raise Unauthorized()
         customer = Customer.query.filter_by(customer_mail_address=mail_address).first()
         if customer is None:
@@ -154,9 +206,7 @@ class CustomerAPI(Resource):
         """
         Edit customer data.
         """
-        token = request.headers['Authorization']
-        data = Customer.decode_auth_token(token)
-        if data['customer'] != mail_address:
+        if g.identity.mail_address != mail_address:
             raise Forbidden()
         customer = Customer.query.filter_by(customer_mail_address=mail_address).first()
         if customer is None:
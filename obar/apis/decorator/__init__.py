@@ -1,2 +1,3 @@
 from .auth_decorator import admin_token_required
 from .auth_decorator import customer_token_required
+from .auth_decorator import Identity
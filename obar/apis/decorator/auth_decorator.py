@@ -1,20 +1,35 @@
 from obar.models import Customer
+from collections import namedtuple
 from functools import wraps
-from flask import request
+from flask import g, request
+
+# Identity of the customer authenticated by the request token,
+# stored on flask.g by the decorators for the handlers to consume
+Identity = namedtuple('Identity', ['mail_address', 'admin', 'token', 'token_digest', 'expires_on'])
+
+
+def _authenticate():
+    """
+    Decodes the request token once and stores the identity on flask.g
+    :return: an error response if the token is missing or invalid, None otherwise
+    """
+    if 'Authorization' not in request.headers or not request.headers['Authorization']:
+        return {'message': 'Token is missing'}, 401
+    token = request.headers['Authorization']
+    data = Customer.decode_auth_token(token)
+    if data['status'] == 'fail':
+        return data, 401
+    g.identity = Identity(mail_address=data['customer'], admin=data['admin'], token=token,
+                          token_digest=data['token_digest'], expires_on=data['expires_on'])
+    return None
 
 
 def customer_token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization']
-            data = Customer.decode_auth_token(token)
-            if data['status'] == 'fail':
-                return data, 401
-        if not token:
-            return {'message': 'Token is missing'}, 401
+        error = _authenticate()
+        if error is not None:
+            return error
         return f(*args, **kwargs)
     return decorated
 
@@ -22,16 +37,10 @@ def customer_token_required(f):
 def admin_token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization']
-            data = Customer.decode_auth_token(token)
-            if data['status'] == 'fail':
-                return data, 401
-            elif not data['admin']:
-                return {'message': 'Admin token required, please login with an admin account'}, 401
-        if not token:
-            return {'message': 'Token is missing'}, 401
+        error = _authenticate()
+        if error is not None:
+            return error
+        if not g.identity.admin:
+            return {'message': 'Admin token required, please login with an admin account'}, 401
         return f(*args, **kwargs)
     return decorated
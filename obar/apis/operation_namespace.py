@@ -1,7 +1,7 @@
 from datetime import datetime as dt
 
-from flask import request
-from flask_restplus import Resource, Namespace, fields
+from flask import Response, current_app, g, request, stream_with_context
+from flask_restplus import Resource, Namespace, fields, inputs, marshal
 from werkzeug.exceptions import NotFound, UnprocessableEntity, Forbidden, InternalServerError
 
 from obar.models import Customer, Purchase, PurchaseItem, Product
@@ -11,7 +11,11 @@ from .decorator.auth_decorator import customer_token_required, admin_token_requi
 from .marshal.fields import purchase_item_fields, operation_purchase_leaderboard_fields, operation_best_selling_fields, \
     operation_check_gift_fields
 from .service.operation_service import purchase_leaderboard, best_selling_product, \
-    produce_expenses, produce_purchase_list, recent_purchases, gift_purchase, undo_purchase
+    produce_expenses, produce_purchase_list, recent_purchases, gift_purchase, undo_purchase, withdraw_products, \
+    stream_expenses_ndjson, stream_expenses_csv, recent_purchase_entry, publish_purchase, stream_recent_purchases, \
+    check_purchase
+from .service.product_service import STOCK, record_product_changes
+from .service.sales_service import record_purchase
 
 authorizations = {
     "JWT": {
@@ -55,6 +59,26 @@ operation_purchase_leaderboard_model = operation_ns.model('Purchase Chart', oper
 operation_best_selling_model = operation_ns.model('Best Selling', operation_best_selling_fields)
 operation_check_gift_model = operation_ns.model('Check Gift', operation_check_gift_fields)
 
+leaderboard_parser = operation_ns.parser()
+leaderboard_parser.add_argument('limit', type=inputs.positive, location='args',
+                                help='Maximum number of customers returned')
+leaderboard_parser.add_argument('since', type=inputs.datetime_from_iso8601, location='args',
+                                help='Count only purchases performed from this date (ISO 8601)')
+leaderboard_parser.add_argument('until', type=inputs.datetime_from_iso8601, location='args',
+                                help='Count only purchases performed before this date (ISO 8601)')
+leaderboard_parser.add_argument('site_id', type=int, location='args',
+                                help='Count only products located in this site')
+
+expenses_parser = operation_ns.parser()
+expenses_parser.add_argument('format', type=str, location='args', default='json',
+                             choices=('json', 'ndjson', 'csv'),
+                             help='Report format, ndjson and csv are streamed')
+expenses_parser.add_argument('since', type=inputs.datetime_from_iso8601, location='args',
+                             help='Consider only purchases performed from this date (ISO 8601)')
+expenses_parser.add_argument('until', type=inputs.datetime_from_iso8601, location='args',
+                             help='Consider only purchases performed before this date (ISO 8601)')
+
+
 @operation_ns.route('/purchaseProducts')
 class OperationAPI(Resource):
 
@@ -69,15 +93,14 @@ class OperationAPI(Resource):
         """
         Performs a purchase operation
         """
-        data = Customer.decode_auth_token(request.headers['Authorization'])
         try:
-            customer = Customer.query.filter_by(customer_mail_address=data['customer']).first()
+            customer = Customer.query.filter_by(customer_mail_address=g.identity.mail_address).first()
         except OperationalError:
             raise InternalServerError('Customer table is missing')
+        if customer is None:
+            raise NotFound(description='Resource ' + g.identity.mail_address + ' is not found')
         purchase = Purchase(purchase_date=dt.utcnow(),
                             purchase_customer_mail_address=customer.customer_mail_address)
-        if customer is None:
-            raise NotFound(description='Resource ' + customer.__repr__() + ' is not found')
 
         # check if the product is requested more than once
         product_list = set()
@@ -94,11 +117,17 @@ class OperationAPI(Resource):
         if len(product_list) != len(request.json['purchase_details']):
             raise UnprocessableEntity('A product has been submitted twice')
 
-        # adds the purchase to session
-        db.session.add(purchase)
+        # loads every requested product with a single query, locking the rows
+        # (SELECT ... FOR UPDATE) on the backends that support it
+        products = Product.query \
+            .filter(Product.product_code_uuid.in_(product_list)) \
+            .with_for_update() \
+            .all()
+        products = {product.product_code_uuid: product for product in products}
         for details in request.json['purchase_details']:
-            product = Product.query.filter_by(product_code_uuid=details['product_code']).first()
+            product = products.get(details['product_code'])
             if product is None:
+                db.session.remove()
                 raise NotFound('Product ' + details['product_code'] + ' not found')
             if not product.product_availability:
                 db.session.remove()
@@ -109,15 +138,34 @@ class OperationAPI(Resource):
             if product.product_quantity < details['purchase_quantity']:
                 db.session.remove()
                 raise UnprocessableEntity('Too much quantity requested')
-            # update the product quantity
-            product.product_quantity = product.product_quantity - details['purchase_quantity']
+
+        # update the products quantity, the stock is checked again by the
+        # database to reject products sold out by concurrent purchases
+        if not withdraw_products({details['product_code']: details['purchase_quantity']
+                                  for details in request.json['purchase_details']}):
+            db.session.remove()
+            raise UnprocessableEntity('Product out of stock')
+
+        purchase_items = []
+        for details in request.json['purchase_details']:
+            product = products[details['product_code']]
             # create a new association object between a purchase and a product
-            purchase_item = PurchaseItem(purchase_item_product_code_uuid=product.product_code_uuid,
-                                         purchase_item_purchase_code_uuid=purchase.purchase_code_uuid,
-                                         purchase_item_quantity=details['purchase_quantity'])
-            db.session.add(purchase_item)
+            purchase_items.append(PurchaseItem(purchase_item_product_code_uuid=product.product_code_uuid,
+                                               purchase_item_purchase_code_uuid=purchase.purchase_code_uuid,
+                                               purchase_item_quantity=details['purchase_quantity'],
+                                               product=product))
+        # adds the purchase to session and flushes it, so that the purchase
+        # items can reference it when inserted in bulk
+        db.session.add(purchase)
+        db.session.flush()
+        db.session.bulk_save_objects(purchase_items)
+        # updates the sales counters in the same transaction of the purchase
+        record_purchase(purchase, purchase_items)
+        entry = recent_purchase_entry(purchase, customer, purchase_items, products)
+        record_product_changes([(STOCK, details['product_code']) for details in request.json['purchase_details']])
         db.session.commit()
-        return {'purchase_uuid': purchase.purchase_code_uuid}, 200
+        publish_purchase(entry)
+        return {'purchase_uuid': entry['code']}, 200
 
 
 @operation_ns.route('/purchaseLeaderboard')
@@ -125,6 +173,7 @@ class OperationPurchaseChartAPI(Resource):
 
     @customer_token_required
     @operation_ns.doc('post_purchase_chart', security='JWT')
+    @operation_ns.expect(leaderboard_parser)
     @operation_ns.marshal_list_with(operation_purchase_leaderboard_model)
     @operation_ns.response(200, description='Success')
     @operation_ns.response(500, description='Internal Server Error')
@@ -132,7 +181,11 @@ class OperationPurchaseChartAPI(Resource):
         """
         Returns a sorted list of purchases by customer
         """
-        return purchase_leaderboard(), 200
+        args = leaderboard_parser.parse_args()
+        return purchase_leaderboard(limit=args['limit'],
+                                    since=args['since'],
+                                    until=args['until'],
+                                    site_id=args['site_id']), 200
 
 
 @operation_ns.route('/bestProducts')
@@ -154,14 +207,23 @@ class OperationProduceExpenses(Resource):
 
     @admin_token_required
     @operation_ns.doc('post_produce_expense', security='JWT')
-    @operation_ns.response(200, description='Success')
+    @operation_ns.expect(expenses_parser)
+    @operation_ns.response(200, 'Success', [operation_produce_expenses_model])
     @operation_ns.response(500, description='Internal Server Error')
-    @operation_ns.marshal_list_with(operation_produce_expenses_model)
     def post(self):
         """
         Produce the expense bill
         """
-        return produce_expenses()
+        args = expenses_parser.parse_args()
+        if args['format'] == 'ndjson':
+            return Response(stream_with_context(stream_expenses_ndjson(args['since'], args['until'])),
+                            mimetype='application/x-ndjson')
+        if args['format'] == 'csv':
+            return Response(stream_with_context(stream_expenses_csv(args['since'], args['until'])),
+                            mimetype='text/csv',
+                            headers={'Content-Disposition': 'attachment; filename=expenses.csv'})
+        result, status = produce_expenses(args['since'], args['until'])
+        return marshal(result, operation_produce_expenses_model), status
 
 
 @operation_ns.route('/producePurchasesList/<string:mail_address>')
@@ -177,8 +239,7 @@ class OperationProducePurchaseList(Resource):
         """
         Produce the expense bill
         """
-        data = Customer.decode_auth_token(request.headers['Authorization'])
-        if data['customer'] != mail_address:
+        if g.identity.mail_address != mail_address:
             raise Forbidden("You don't have the permission to access the requested resource")
         return produce_purchase_list(mail_address)
 
@@ -196,6 +257,29 @@ class OperationRecentPurchase(Resource):
         return recent_purchases()
 
 
+@operation_ns.route('/recentPurchase/stream')
+class OperationRecentPurchaseStream(Resource):
+
+    @operation_ns.doc('get_recent_purchase_stream')
+    @operation_ns.response(200, description='Stream of server-sent events')
+    @operation_ns.header('Last-Event-ID', 'Id of the last event received, to resume the stream')
+    def get(self):
+        """
+        Streams the most recent purchases as server-sent events
+        """
+        try:
+            last_event_id = int(request.headers.get('Last-Event-ID'))
+        except (TypeError, ValueError):
+            last_event_id = None
+        events = stream_recent_purchases(last_event_id,
+                                         keepalive=current_app.config.get('RECENT_PURCHASES_KEEPALIVE', 15),
+                                         duration=current_app.config.get('RECENT_PURCHASES_STREAM_DURATION', 300))
+        # the database session is released before streaming, the feed is reloaded in a session of its own
+        db.session.remove()
+        return Response(events, mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @operation_ns.route('/giftPurchase/<string:purchase_uuid>')
 class OperationGiftPurchase(Resource):
 
@@ -205,8 +289,7 @@ class OperationGiftPurchase(Resource):
     @operation_ns.response(404, description='The resource may have been already gifted')
     @operation_ns.response(500, description='Internal Server Error')
     def post(self, purchase_uuid):
-        data = Customer.decode_auth_token(request.headers['Authorization'])
-        return gift_purchase(purchase_uuid, data['customer'])
+        return gift_purchase(purchase_uuid, g.identity.mail_address)
 
 
 @operation_ns.route('/undoPurchase/<string:purchase_uuid>')
@@ -218,8 +301,7 @@ class OperationUndoPurchase(Resource):
     @operation_ns.response(404, description='The resource may have been already gifted')
     @operation_ns.response(500, description='Internal Server Error')
     def post(self, purchase_uuid):
-        data = Customer.decode_auth_token(request.headers['Authorization'])
-        return undo_purchase(purchase_uuid, data['customer']), 204
+        return undo_purchase(purchase_uuid, g.identity.mail_address), 204
 
 
 @operation_ns.route('/checkPurchase/<string:purchase_uuid>')
@@ -232,18 +314,6 @@ class OperationCheckPurchase(Resource):
     @operation_ns.response(500, 'Something strange happened internally')
     @operation_ns.marshal_with(operation_check_gift_model)
     def get(self, purchase_uuid):
-        purchase = Purchase.query.filter_by(purchase_code_uuid=purchase_uuid).first()
-        if purchase is None:
-            raise NotFound('purchase_uuid not found')
-        customer = Customer.query.filter_by(customer_mail_address=purchase.purchase_customer_mail_address).first()
-        if customer is None:
-            raise InternalServerError('customer not found in db')
-        response = {
-            'purchase_gifted': purchase.purchase_gifted,
-            'purchase_date': purchase.purchase_date,
-            'customer_first_name': customer.customer_first_name,
-            'customer_last_name': customer.customer_last_name
-        }
-        return response, 200
+        return check_purchase(purchase_uuid), 200
 
 
@@ -0,0 +1,124 @@
+"""
+Keyset pagination and sparse field selection shared by the list endpoints.
+Pages are ordered by a set of columns identifying each row; the cursor of
+the next page encodes the values of those columns for the last row returned,
+so that fetching any page costs the same regardless of its position.
+"""
+
+import base64
+import datetime
+import json
+
+from flask import current_app, request
+from flask_restplus import inputs, marshal
+from flask_restplus.mask import MaskError
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import sqltypes
+from werkzeug.exceptions import BadRequest
+from werkzeug.urls import url_encode
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def pagination_parser(namespace):
+    """
+    Returns a request parser holding the pagination and field selection arguments
+    """
+    parser = namespace.parser()
+    parser.add_argument('limit', type=inputs.positive, location='args',
+                        help='Maximum number of items returned')
+    parser.add_argument('after', type=str, location='args',
+                        help='Cursor of the page to return, as sent in the X-Next-Cursor header')
+    parser.add_argument('fields', type=str, location='args',
+                        help='Comma separated list of the fields to return')
+    return parser
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_FORMAT)
+    return value
+
+
+def _decode_value(column, value):
+    if isinstance(column.type, sqltypes.DateTime):
+        return datetime.datetime.strptime(value, DATETIME_FORMAT)
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError()
+        return [_decode_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise BadRequest('Invalid cursor')
+
+
+def paginate(query, columns, limit=None, after=None):
+    """
+    Applies keyset pagination to a query.
+    Requests without limit nor cursor keep getting every item, as before pagination.
+    :param columns: model attributes ordering the items, identifying each row
+    :param limit: maximum number of items, PAGINATION_DEFAULT_LIMIT if None
+    :param after: cursor of the page to return
+    :return: the items of the page and the cursor of the next one, None if it is the last page
+    """
+    if limit is None and after is None:
+        return query.order_by(*columns).all(), None
+    max_limit = current_app.config.get('PAGINATION_MAX_LIMIT', 1000)
+    limit = min(limit or current_app.config.get('PAGINATION_DEFAULT_LIMIT', max_limit), max_limit)
+    if after is not None:
+        values = decode_cursor(after, columns)
+        # (c1, c2, ...) > (v1, v2, ...) expanded for the backends without row values
+        condition = None
+        for column, value in reversed(list(zip(columns, values))):
+            term = column > value
+            if condition is not None:
+                term = or_(term, and_(column == value, condition))
+            condition = term
+        query = query.filter(condition)
+    items = query.order_by(*columns).limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], column.key) for column in columns])
+
+
+def marshal_page(items, model, fields=None, next_cursor=None):
+    """
+    Marshals a page of items keeping only the requested fields, given either
+    as query argument or through the mask header, and links the next page.
+    :return: the response body, status and headers
+    """
+    try:
+        body = marshal(items, model, mask=page_mask(fields))
+    except MaskError as e:
+        raise BadRequest('Invalid fields: ' + str(e))
+    return body, 200, page_headers(next_cursor)
+
+
+def page_mask(fields=None):
+    """
+    Returns the requested fields, given either as query argument or through the mask header
+    """
+    return fields or request.headers.get(current_app.config['RESTPLUS_MASK_HEADER'])
+
+
+def page_headers(next_cursor=None):
+    """
+    Returns the headers linking the next page of the current request
+    """
+    headers = dict()
+    if next_cursor is not None:
+        args = request.args.copy()
+        args['after'] = next_cursor
+        headers['X-Next-Cursor'] = next_cursor
+        headers['Link'] = '<{}?{}>; rel="next"'.format(request.base_url, url_encode(args))
+    return headers
@@ -1,13 +1,22 @@
 import base64
+import json
+import mimetypes
 
-from flask import request
-from flask_restplus import Namespace, Resource, fields
+from flask import Response, current_app, request, send_file
+from flask_restplus import Namespace, Resource, fields, inputs
 from sqlalchemy.exc import OperationalError, IntegrityError
 from werkzeug.exceptions import InternalServerError, NotFound, BadRequest, Conflict, UnprocessableEntity
+from werkzeug.http import is_resource_modified
 
 from obar import db
-from obar.models import Product, ProductImage
+from obar.catalog import get_catalog_cache
+from obar.models import Product, ProductImage, ProductImageVariant
+from obar.storage import get_image_storage
 from .decorator import admin_token_required, customer_token_required
+from .pagination import pagination_parser, paginate, marshal_page, page_headers, page_mask
+from .service.image_service import commit_images, generate_variants, delete_variants, image_variants
+from .service.product_service import CREATE, DELETE, UPDATE, apply_product_batch, product_changes, \
+    record_product_changes
 from .marshal.fields import product_image_fields, product_put_fields, product_post_fields
 
 authorizations = {
@@ -31,26 +40,114 @@ product_output_model = product_ns.inherit('Product Output', product_model, {
 
 product_put_model = product_ns.model('Product Update', product_put_fields)
 
+product_operation_model = product_ns.inherit('Product Operation', product_put_model, {
+    'op': fields.String(required=True,
+                        description='create, update or restock',
+                        enum=['create', 'update', 'restock']),
+    'code': fields.String(description='Product identifier, not given to create'),
+    'quantity': fields.Integer(description='Product quantity, added to the stock by restock')
+})
+
+product_operation_result_model = product_ns.model('Product Operation Result', {
+    'index': fields.Integer(description='Index of the operation in the batch'),
+    'op': fields.String(description='Operation'),
+    'code': fields.String(description='Product identifier'),
+    'status': fields.String(description='created, updated, restocked, invalid, not_found or conflict'),
+    'message': fields.String(description='Reason why the operation was not applied')
+})
+
+product_list_parser = pagination_parser(product_ns)
+product_list_parser.add_argument('location_id', type=int, location='args',
+                                 help='Return only the products of this site')
+product_list_parser.add_argument('availability', type=inputs.boolean, location='args',
+                                 help='Return only the products with this availability')
+
 product_image_model = product_ns.model('Product Image', product_image_fields)
 
+product_changes_parser = product_ns.parser()
+product_changes_parser.add_argument('since', type=int, location='args',
+                                    help='Sequence number of the last change applied, '
+                                         'omitted to get the current sequence number')
+product_changes_parser.add_argument('limit', type=inputs.positive, location='args',
+                                    help='Maximum number of changes returned')
+
+product_change_model = product_ns.model('Product Change', {
+    'sequence': fields.Integer(description='Sequence number of the change'),
+    'date': fields.DateTime(description='Date of the change'),
+    'code': fields.String(description='Product identifier'),
+    'operation': fields.String(description='create, update, delete or stock'),
+    'product': fields.Raw(description='Product fields after the change, only the quantity for stock')
+})
+
+product_changes_model = product_ns.model('Product Changes', {
+    'sequence': fields.Integer(description='Sequence number of the last change returned'),
+    'changes': fields.List(fields.Nested(product_change_model)),
+    'more': fields.Boolean(description='True if more changes follow')
+})
+
+image_parser = product_ns.parser()
+image_parser.add_argument('size', type=str, location='args',
+                          help='Name of a resized variant of the image (e.g. small, medium)')
+
+
+def _image_version(image, size):
+    """
+    Returns digest and mimetype of the requested size of an image,
+    falling back to the original when the image has no such variant
+    """
+    if size is not None and size != 'original':
+        if size not in image_variants():
+            raise BadRequest('Unknown image size ' + size)
+        variant = ProductImageVariant.query.get((image.product_image_product_code_uuid, size))
+        if variant is not None:
+            return variant.product_image_variant_digest, variant.product_image_variant_mimetype
+    mimetype = mimetypes.guess_type(image.product_image_filename)[0] or 'application/octet-stream'
+    return image.product_image_digest, mimetype
+
 
 @product_ns.route('')
 class ProductListAPI(Resource):
 
     @customer_token_required
-    @product_ns.response(200, 'Return a list of products')
+    @product_ns.response(200, 'Return a list of products', [product_output_model])
+    @product_ns.response(304, 'The list did not change since the ETag given in If-None-Match')
     @product_ns.response(500, 'Internal server error')
     @product_ns.doc('get_product_list', security='JWT')
-    @product_ns.marshal_list_with(product_output_model)
+    @product_ns.expect(product_list_parser)
     def get(self):
         """
         Returns a list of Product
         """
+        args = product_list_parser.parse_args()
+        catalog_cache = get_catalog_cache()
+        key = (args['location_id'], args['availability'], args['limit'], args['after'], page_mask(args['fields']))
         try:
-            product_list = Product.query.all()
+            version = catalog_cache.version()
         except OperationalError:
-            raise InternalServerError(description='Product table does not exists.')
-        return product_list, 200
+            raise InternalServerError(description='Product change table does not exists.')
+        # unchanged pages are neither queried nor marshalled again
+        etag = catalog_cache.etag(version, key)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            page = catalog_cache.get(version, key)
+            if page is None:
+                query = Product.query
+                if args['location_id'] is not None:
+                    query = query.filter(Product.product_location_id == args['location_id'])
+                if args['availability'] is not None:
+                    query = query.filter(Product.product_availability == args['availability'])
+                try:
+                    product_list, next_cursor = paginate(query, [Product.product_code_uuid],
+                                                         args['limit'], args['after'])
+                except OperationalError:
+                    raise InternalServerError(description='Product table does not exists.')
+                body, _, _ = marshal_page(product_list, product_output_model, args['fields'])
+                page = (json.dumps(body, **current_app.config.get('RESTPLUS_JSON', {})) + '\n', next_cursor)
+                catalog_cache.set(version, key, page)
+            response = Response(page[0], mimetype='application/json', headers=page_headers(page[1]))
+        response.set_etag(etag)
+        return response
 
     @admin_token_required
     @product_ns.doc('post_product', security='JWT')
@@ -72,6 +169,7 @@ class ProductListAPI(Resource):
                               product_location_id=request.json['location_id'])
         db.session.add(new_product)
         try:
+            record_product_changes([(CREATE, new_product.product_code_uuid)])
             db.session.commit()
         except OperationalError:
             raise InternalServerError(description='Product table does not exists.')
@@ -83,6 +181,58 @@ class ProductListAPI(Resource):
         return {'product_code': new_product.product_code_uuid}, 201
 
 
+@product_ns.route('/changes')
+class ProductChangesAPI(Resource):
+
+    @customer_token_required
+    @product_ns.doc('get_product_changes', security='JWT')
+    @product_ns.expect(product_changes_parser)
+    @product_ns.marshal_with(product_changes_model)
+    @product_ns.response(200, 'Success')
+    @product_ns.response(410, 'The changes were purged, the products must be reloaded')
+    def get(self):
+        """
+        Returns the changes of the products following a sequence number.
+        A client gets the current sequence number, loads the products, then applies
+        the changes following that number; applying a change twice is harmless.
+        """
+        args = product_changes_parser.parse_args()
+        try:
+            return product_changes(args['since'], args['limit']), 200
+        except OperationalError:
+            raise InternalServerError(description='Product change table does not exists.')
+
+
+@product_ns.route('/batch')
+class ProductBatchAPI(Resource):
+
+    @admin_token_required
+    @product_ns.doc('post_product_batch', security='JWT')
+    @product_ns.response(200, 'Result of each operation', [product_operation_result_model])
+    @product_ns.response(400, 'The body is not a JSON array of operations')
+    @product_ns.response(409, 'Conflict in product resources')
+    @product_ns.response(413, 'Too many operations')
+    @product_ns.expect([product_operation_model])
+    def post(self):
+        """
+        Creates, updates and restocks many products in a single transaction.
+        Restock adds the given quantity to the stock of the product.
+        """
+        operations = request.get_json(silent=True)
+        if not isinstance(operations, list):
+            raise BadRequest('The body must be a JSON array of operations')
+        try:
+            results = apply_product_batch(operations)
+        except OperationalError:
+            db.session.rollback()
+            raise InternalServerError(description='Product table does not exists.')
+        except IntegrityError:
+            # products changed concurrently since they were looked up
+            db.session.rollback()
+            raise Conflict('Causes may be: name not unique, non existent location ID')
+        return [{key: value for key, value in result.items() if value is not None} for result in results], 200
+
+
 @product_ns.route('/<string:code>')
 class ProductAPI(Resource):
 
@@ -112,6 +262,7 @@ class ProductAPI(Resource):
         if product is None:
             raise NotFound()
         db.session.delete(product)
+        record_product_changes([(DELETE, code)])
         db.session.commit()
         return '', 204
 
@@ -142,6 +293,7 @@ class ProductAPI(Resource):
         if 'location_id' in request.json.keys():
             product.product_location_id = request.json['location_id']
         try:
+            record_product_changes([(UPDATE, code)])
             db.session.commit()
         except IntegrityError:
             raise BadRequest('Causes may be: name not unique, non existent location ID')
@@ -156,6 +308,7 @@ class ProductImageAPI(Resource):
     @product_ns.response(200, 'Success')
     @product_ns.response(404, 'Product not Found')
     @product_ns.response(404, 'Image not Found')
+    @product_ns.expect(image_parser)
     @product_ns.marshal_with(product_image_model)
     def get(self, code):
         """
@@ -167,9 +320,10 @@ class ProductImageAPI(Resource):
         image = product.productImage
         if image is None:
             raise NotFound('Image not found')
+        digest, _ = _image_version(image, image_parser.parse_args()['size'])
         response = {
             'filename': image.product_image_filename,
-            'file_base64': base64.b64encode(image.product_image_binary).decode('ascii')
+            'file_base64': base64.b64encode(get_image_storage().read(digest)).decode('ascii')
         }
         return response, 200
 
@@ -184,14 +338,17 @@ class ProductImageAPI(Resource):
         product = Product.query.filter_by(product_code_uuid=code).first()
         if product is None:
             raise NotFound()
+        binary = base64.b64decode(request.json['file_base64'])
+        # the variants flush the session, the image is added afterwards so that
+        # a duplicate filename fails on commit
+        released = generate_variants(code, binary)
         image = ProductImage(product_image_product_code_uuid=code,
-                             product_image_filename=request.json['filename'],
-                             product_image_binary=base64.b64decode(request.json['file_base64']))
+                             product_image_filename=request.json['filename'])
+        image.set_binary(binary)
         db.session.add(image)
         try:
-            db.session.commit()
+            commit_images(released)
         except IntegrityError:
-            db.session.remove()
             raise Conflict('filename must be unique')
 
         return '', 201
@@ -215,10 +372,14 @@ class ProductImageAPI(Resource):
 
         if 'filename' in request.json:
             image.product_image_filename = request.json['filename']
+        released = []
         if 'file_base64' in request.json:
-            image.product_image_binary = base64.b64decode(request.json['file_base64'])
+            binary = base64.b64decode(request.json['file_base64'])
+            released.append(image.product_image_digest)
+            image.set_binary(binary)
+            released.extend(generate_variants(code, binary))
 
-        db.session.commit()
+        commit_images(released)
         return '', 204
 
     @admin_token_required
@@ -237,7 +398,50 @@ class ProductImageAPI(Resource):
         if image is None:
             raise NotFound('%s not found')
 
+        released = [image.product_image_digest] + delete_variants(code)
         db.session.delete(image)
-        db.session.commit()
+        commit_images(released)
 
         return '', 204
+
+
+@product_ns.route('/<string:code>/img/raw')
+class ProductImageRawAPI(Resource):
+
+    @customer_token_required
+    @product_ns.doc('get_product_image_raw', security='JWT')
+    @product_ns.response(200, 'Success')
+    @product_ns.response(304, 'Not modified')
+    @product_ns.response(404, 'Product not Found')
+    @product_ns.response(404, 'Image not Found')
+    @product_ns.expect(image_parser)
+    def get(self, code):
+        """
+        Get product image as binary stream, supporting conditional requests
+        """
+        image = ProductImage.query.filter_by(product_image_product_code_uuid=code).first()
+        if image is None:
+            if Product.query.filter_by(product_code_uuid=code).first() is None:
+                raise NotFound('Product not found')
+            raise NotFound('Image not found')
+
+        digest, mimetype = _image_version(image, image_parser.parse_args()['size'])
+        if not is_resource_modified(request.environ,
+                                    etag=digest,
+                                    last_modified=image.product_image_updated_on):
+            response = Response(status=304)
+        else:
+            storage = get_image_storage()
+            path = storage.path(digest)
+            if path is not None:
+                # Streams the file from disk, using the server sendfile support when available
+                response = send_file(path, mimetype=mimetype, add_etags=False, conditional=False)
+                response.expires = None
+            else:
+                response = Response(storage.read(digest), mimetype=mimetype)
+        response.set_etag(digest)
+        response.last_modified = image.product_image_updated_on
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = current_app.config.get('PRODUCT_IMAGE_MAX_AGE', 300)
+        return response
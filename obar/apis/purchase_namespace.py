@@ -1,9 +1,10 @@
-from flask_restplus import Namespace, Resource, fields
+from flask_restplus import Namespace, Resource, fields, inputs
 from sqlalchemy.exc import OperationalError
 from werkzeug.exceptions import InternalServerError, NotFound
 
 from obar.models import Purchase
 from .decorator import admin_token_required, customer_token_required
+from .pagination import pagination_parser, paginate, marshal_page
 
 authorizations = {
     "JWT": {
@@ -33,24 +34,41 @@ purchase_output_model = purchase_ns.inherit('Purchase Output', purchase_model, {
                           attribute='purchase_code_uuid')
 })
 
+purchase_list_parser = pagination_parser(purchase_ns)
+purchase_list_parser.add_argument('customer', type=str, location='args',
+                                  help='Return only the purchases of this customer')
+purchase_list_parser.add_argument('since', type=inputs.datetime_from_iso8601, location='args',
+                                  help='Return only the purchases performed from this date (ISO 8601)')
+purchase_list_parser.add_argument('until', type=inputs.datetime_from_iso8601, location='args',
+                                  help='Return only the purchases performed before this date (ISO 8601)')
+
 
 @purchase_ns.route('')
 class PurchaseListAPI(Resource):
 
     @admin_token_required
-    @purchase_ns.marshal_list_with(purchase_output_model)
-    @purchase_ns.response(200, 'Return a list of purchases')
+    @purchase_ns.expect(purchase_list_parser)
+    @purchase_ns.response(200, 'Return a list of purchases', [purchase_output_model])
     @purchase_ns.response(500, 'Internal server error')
     @purchase_ns.doc('get_purchase_list', security='JWT')
     def get(self):
         """
-        Returns a list of Purchases
+        Returns a list of Purchases, sorted by date
         """
+        args = purchase_list_parser.parse_args()
+        query = Purchase.query
+        if args['customer'] is not None:
+            query = query.filter(Purchase.purchase_customer_mail_address == args['customer'])
+        if args['since'] is not None:
+            query = query.filter(Purchase.purchase_date >= args['since'])
+        if args['until'] is not None:
+            query = query.filter(Purchase.purchase_date < args['until'])
         try:
-            purchase_list = Purchase.query.all()
+            purchase_list, next_cursor = paginate(query, [Purchase.purchase_date, Purchase.purchase_code_uuid],
+                                                  args['limit'], args['after'])
         except OperationalError:
             raise InternalServerError(description='Purchase table does not exists')
-        return purchase_list, 200
+        return marshal_page(purchase_list, purchase_output_model, args['fields'], next_cursor)
 
 
 @purchase_ns.route('/<string:purchase_uuid>')
@@ -8,6 +8,11 @@ def login_customer(data):
     try:
         customer = Customer.query.filter_by(customer_mail_address=data['mail_address']).first()
         if customer and customer.check_password(pin=str(data['pin'])):
+            # upgrades (or downgrades) the hash to the configured method
+            # while the PIN is known
+            if customer.needs_rehash():
+                customer.set_password(str(data['pin']))
+                db.session.commit()
             auth_token = customer.encode_auth_token()
             if auth_token:
                 response_object = {
@@ -31,21 +36,12 @@ def login_customer(data):
         return response_object, 500
 
 
-def logout_customer(data):
-    auth_token = data
-    if auth_token:
-        resp = Customer.decode_auth_token(auth_token)
-        if resp['status'] == 'success':
-            # mark the token as blacklisted
-            return save_token(token=auth_token)
-        else:
-            return resp, 401
-    else:
-        response_object = {
-            'status': 'fail',
-            'message': 'Provide a valid auth token'
-        }
-        return response_object, 403
+def logout_customer(identity):
+    """
+    Blacklists the token of an identity already authenticated by the auth decorators
+    """
+    # mark the token as blacklisted
+    return save_token(token_digest=identity.token_digest, expires_on=identity.expires_on)
 
 
 def register_admin_customer():
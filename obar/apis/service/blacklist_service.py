@@ -1,11 +1,15 @@
+from obar.cache import get_revocation_cache
 from obar.models import db, BlacklistToken
 
 
-def save_token(token):
-    blacklist_token = BlacklistToken(token=token)
+def save_token(token_digest, expires_on):
+    blacklist_token = BlacklistToken(token_digest=token_digest, expires_on=expires_on)
     try:
+        # expired entries are purged on every logout to keep the table small
+        BlacklistToken.purge_expired()
         db.session.add(blacklist_token)
         db.session.commit()
+        get_revocation_cache().set(token_digest, True)
         response_object = {
             'status': 'success',
             'message': 'Succesfully logged out'
@@ -17,3 +21,13 @@ def save_token(token):
             'message': e
         }
         return response_object
+
+
+def purge_blacklist():
+    """
+    Deletes the blacklist entries of expired tokens
+    :return: the number of deleted entries
+    """
+    purged = BlacklistToken.purge_expired()
+    db.session.commit()
+    return purged
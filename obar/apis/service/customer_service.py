@@ -0,0 +1,182 @@
+import csv
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import generate_password_hash
+
+from obar.models import db, Customer
+
+CSV_FIELDS = ('mail_address', 'pin', 'first_name', 'last_name')
+# Below this number of PINs the hashes are computed in the calling process,
+# starting the worker processes would take longer
+PARALLEL_HASHING_THRESHOLD = 50
+# Keeps the IN queries below the SQLite limit of 999 parameters
+LOOKUP_CHUNK_SIZE = 500
+
+
+def parse_customer_csv(text):
+    """
+    Reads the customers of a CSV file with a mail_address,pin,first_name,last_name header
+    :param text: content of the file
+    :return: list of dicts, one per row
+    """
+    reader = csv.DictReader(io.StringIO(text))
+    if reader.fieldnames is None or not set(CSV_FIELDS) <= set(reader.fieldnames):
+        raise ValueError('The CSV header must contain ' + ','.join(CSV_FIELDS))
+    return [{field: row[field] for field in CSV_FIELDS} for row in reader]
+
+
+def _validate(row):
+    """
+    Returns the customer mapping of an imported row and None, or None and the reason
+    why the row is invalid
+    """
+    if not isinstance(row, dict):
+        return None, 'The row must be an object'
+    mail_address = row.get('mail_address')
+    if not isinstance(mail_address, str) or '@' not in mail_address.strip():
+        return None, 'Invalid mail address'
+    pin = row.get('pin')
+    if isinstance(pin, str):
+        # CSV files give the PINs as text, leading zeros included
+        if not re.fullmatch('[0-9]{5}', pin):
+            return None, 'The PIN must be of 5 digits'
+        pin = int(pin)
+    elif not isinstance(pin, int) or isinstance(pin, bool):
+        return None, 'The PIN must be a number'
+    if not (0 <= pin <= 99999):
+        return None, 'The PIN must be of 5 digits'
+    names = []
+    for field in ('first_name', 'last_name'):
+        name = row.get(field)
+        if not isinstance(name, str) or not name.strip():
+            return None, 'Missing ' + field
+        names.append(name.strip())
+    return {'customer_mail_address': mail_address.strip(),
+            # hashed as the PIN given to CustomerListAPI.post
+            'customer_pin_hash': str(pin),
+            'customer_first_name': names[0],
+            'customer_last_name': names[1],
+            'customer_is_admin': False}, None
+
+
+def _hash_pin(pin, method):
+    # module level, so that the worker processes can unpickle it
+    return generate_password_hash(pin, method=method)
+
+
+def hash_pins(pins, workers=None):
+    """
+    Hashes the PINs with the configured method, in a pool of worker processes
+    :param workers: number of processes, the number of CPUs if None
+    :return: list of the hashes, in the order of the PINs
+    """
+    method = Customer.pin_hash_method()
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(pins) < PARALLEL_HASHING_THRESHOLD:
+        return [_hash_pin(pin, method) for pin in pins]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_hash_pin, pins, repeat(method),
+                                 chunksize=max(1, len(pins) // (workers * 4))))
+
+
+def _existing_mail_addresses(mail_addresses):
+    existing = set()
+    for start in range(0, len(mail_addresses), LOOKUP_CHUNK_SIZE):
+        chunk = mail_addresses[start:start + LOOKUP_CHUNK_SIZE]
+        existing.update(row[0] for row in db.session.query(Customer.customer_mail_address)
+                        .filter(Customer.customer_mail_address.in_(chunk)))
+    return existing
+
+
+def import_customers(rows, batch_size=None, workers=None):
+    """
+    Creates the customers of an import. Every row is validated and checked for
+    conflicts before any PIN is hashed, then the customers are inserted in
+    batches, each committed in its own transaction.
+    :param rows: list of dicts with the mail_address, pin, first_name and last_name of the customers
+    :param batch_size: customers per transaction, CUSTOMER_IMPORT_BATCH_SIZE if None
+    :param workers: processes hashing the PINs, CUSTOMER_IMPORT_WORKERS if None
+    :return: the number of created customers and the result of each row
+    """
+    batch_size = batch_size or current_app.config.get('CUSTOMER_IMPORT_BATCH_SIZE', 1000)
+    workers = workers or current_app.config.get('CUSTOMER_IMPORT_WORKERS')
+
+    results = []
+    customers = []
+    seen = dict()
+    for index, row in enumerate(rows):
+        customer, error = _validate(row)
+        mail_address = row.get('mail_address') if isinstance(row, dict) else None
+        result = {'row': index, 'mail_address': mail_address, 'status': 'created'}
+        results.append(result)
+        if error is not None:
+            result.update(status='invalid', message=error)
+        elif customer['customer_mail_address'] in seen:
+            result.update(status='conflict',
+                          message='Duplicate of row {}'.format(seen[customer['customer_mail_address']]))
+        else:
+            seen[customer['customer_mail_address']] = index
+            customers.append((result, customer))
+
+    existing = _existing_mail_addresses(list(seen))
+    for result, customer in customers:
+        if customer['customer_mail_address'] in existing:
+            result.update(status='conflict', message='The customer already exists')
+    customers = [(result, customer) for result, customer in customers
+                 if customer['customer_mail_address'] not in existing]
+
+    pin_hashes = hash_pins([customer['customer_pin_hash'] for _, customer in customers], workers)
+    for (_, customer), pin_hash in zip(customers, pin_hashes):
+        customer['customer_pin_hash'] = pin_hash
+
+    created = 0
+    for start in range(0, len(customers), batch_size):
+        created += _insert_batch(customers[start:start + batch_size])
+    current_app.logger.info('{} customers imported.'.format(created))
+    return {'created': created, 'results': results}
+
+
+def _insert_batch(batch):
+    """
+    Inserts a batch of customers in one transaction. The customers created
+    since the lookup are reported as conflicts and the rest of the batch is
+    retried until it is inserted; if the database rejects the batch for
+    another reason, its customers are inserted one at a time.
+    :param batch: list of (result, customer mapping)
+    :return: the number of created customers
+    """
+    while batch:
+        try:
+            db.session.bulk_insert_mappings(Customer, [customer for _, customer in batch])
+            db.session.commit()
+            return len(batch)
+        except IntegrityError:
+            db.session.rollback()
+        existing = _existing_mail_addresses([customer['customer_mail_address'] for _, customer in batch])
+        if not existing:
+            return _insert_rows(batch)
+        for result, customer in batch:
+            if customer['customer_mail_address'] in existing:
+                result.update(status='conflict', message='The customer already exists')
+        batch = [(result, customer) for result, customer in batch
+                 if customer['customer_mail_address'] not in existing]
+    return 0
+
+
+def _insert_rows(batch):
+    created = 0
+    for result, customer in batch:
+        try:
+            db.session.bulk_insert_mappings(Customer, [customer])
+            db.session.commit()
+            created += 1
+        except IntegrityError as e:
+            db.session.rollback()
+            result.update(status='conflict', message='Rejected by the database: {}'.format(e.orig))
+    return created
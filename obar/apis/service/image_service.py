@@ -0,0 +1,126 @@
+import io
+
+from flask import current_app
+
+from obar.models import db, ProductImage, ProductImageVariant
+from obar.storage import get_image_storage
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Longest side, in pixels, of each resized variant
+DEFAULT_VARIANTS = {
+    'small': 128,
+    'medium': 512
+}
+
+
+def image_variants():
+    """
+    Returns the variant sizes configured by PRODUCT_IMAGE_VARIANTS
+    """
+    return current_app.config.get('PRODUCT_IMAGE_VARIANTS', DEFAULT_VARIANTS)
+
+
+def _resize(original, size):
+    image = original.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    output = io.BytesIO()
+    # Images with transparency stay PNG, everything else is recompressed as JPEG
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image.save(output, format='PNG', optimize=True)
+        mimetype = 'image/png'
+    else:
+        image.convert('RGB').save(output, format='JPEG',
+                                  quality=current_app.config.get('PRODUCT_IMAGE_VARIANT_QUALITY', 80),
+                                  optimize=True)
+        mimetype = 'image/jpeg'
+    return output.getvalue(), mimetype, image.size
+
+
+def generate_variants(product_code, binary):
+    """
+    Replaces the resized variants of the image of a product.
+    Variants are generated only for the sizes smaller than the original;
+    nothing is generated if Pillow is not installed or the image cannot be read.
+    The caller must commit and then release the returned digests.
+    :return: the digests of the replaced variants
+    """
+    released = delete_variants(product_code)
+    if Image is None:
+        current_app.logger.warning('Pillow is not installed: product image variants are not generated')
+        return released
+    try:
+        original = Image.open(io.BytesIO(binary))
+        original.load()
+    except (IOError, SyntaxError):
+        current_app.logger.warning('Unable to read the image of product %s: variants are not generated',
+                                   product_code)
+        return released
+
+    for name, size in image_variants().items():
+        if max(original.size) <= size:
+            continue
+        data, mimetype, (width, height) = _resize(original, size)
+        db.session.add(ProductImageVariant(product_image_variant_product_code_uuid=product_code,
+                                           product_image_variant_size=name,
+                                           product_image_variant_digest=ProductImage.save_binary(data),
+                                           product_image_variant_mimetype=mimetype,
+                                           product_image_variant_width=width,
+                                           product_image_variant_height=height))
+    return released
+
+
+def delete_variants(product_code):
+    """
+    Deletes the resized variants of the image of a product.
+    The caller must commit and then release the returned digests.
+    :return: the digests of the deleted variants
+    """
+    variants = ProductImageVariant.query.filter_by(product_image_variant_product_code_uuid=product_code).all()
+    for variant in variants:
+        db.session.delete(variant)
+    # Deletes the variants before new ones with the same key are added
+    db.session.flush()
+    return [variant.product_image_variant_digest for variant in variants]
+
+
+def generate_missing_variants(regenerate=False):
+    """
+    Generates the resized variants of the stored images, one image per
+    transaction, e.g. after the variant sizes are changed
+    :param regenerate: also replace the variants of the images having some
+    :return: the number of images processed
+    """
+    query = db.session.query(ProductImage.product_image_product_code_uuid, ProductImage.product_image_digest) \
+        .filter(ProductImage.product_image_product_code_uuid.isnot(None))
+    if not regenerate:
+        query = query.filter(~ProductImageVariant.query.filter(
+            ProductImageVariant.product_image_variant_product_code_uuid ==
+            ProductImage.product_image_product_code_uuid).exists())
+    images = query.all()
+    for code, digest in images:
+        released = generate_variants(code, get_image_storage().read(digest))
+        commit_images(released)
+    return len(images)
+
+
+def commit_images(released=()):
+    """
+    Commits the session, then releases the binaries no longer referenced.
+    If the commit fails, the binaries saved in the transaction are released
+    instead, so that the image storage keeps no orphaned files.
+    :param released: digests of the binaries the transaction stops referencing
+    """
+    saved = db.session.info.pop('saved_image_digests', set())
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for digest in saved:
+            ProductImage.release_binary(digest)
+        raise
+    for digest in released:
+        ProductImage.release_binary(digest)
@@ -1,83 +1,209 @@
+import csv
+import io
+import json
+import time
 from datetime import datetime as dt
 from datetime import timedelta as td
 
+from flask import current_app
+from sqlalchemy import bindparam, func
 from sqlalchemy.exc import OperationalError
 from werkzeug.exceptions import InternalServerError, NotFound, PreconditionFailed
 
-from obar.models import db, Product, Customer, Purchase, PurchaseItem
+from obar.feed import get_purchase_feed, PURCHASE, REMOVE
+from obar.models import db, Product, Customer, Purchase, PurchaseItem, CustomerSales, ProductSales
+from .product_service import STOCK, record_product_changes
+from .sales_service import revert_purchase, transfer_purchase
 
 
-def purchase_leaderboard():
-    per_user_purchase = dict()
-    leaderboard = []
+def purchase_leaderboard(limit=None, since=None, until=None, site_id=None):
+    """
+    Returns the customers sorted by number of purchased items.
+    Without filters the item count is read from the sales counters,
+    otherwise it is computed by a single grouped query; the optional
+    filters only restrict which purchases are counted, customers without
+    matching purchases are still listed with 0 items.
+    :param limit: maximum number of customers returned
+    :param since: count only purchases performed from this date
+    :param until: count only purchases performed before this date
+    :param site_id: count only products located in this site
+    """
+    if since is None and until is None and site_id is None:
+        items = db.session.query(
+            CustomerSales.customer_sales_mail_address.label('customer'),
+            CustomerSales.customer_sales_items.label('purchases')) \
+            .subquery()
+    else:
+        items = db.session.query(
+            Purchase.purchase_customer_mail_address.label('customer'),
+            func.sum(PurchaseItem.purchase_item_quantity).label('purchases')) \
+            .join(PurchaseItem, PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid)
+        items = _in_period(items, since, until)
+        if site_id is not None:
+            items = items \
+                .join(Product, Product.product_code_uuid == PurchaseItem.purchase_item_product_code_uuid) \
+                .filter(Product.product_location_id == site_id)
+        items = items.group_by(Purchase.purchase_customer_mail_address).subquery()
+
+    purchases = func.coalesce(items.c.purchases, 0)
+    query = db.session.query(Customer.customer_mail_address,
+                             Customer.customer_first_name,
+                             Customer.customer_last_name,
+                             purchases.label('purchases')) \
+        .outerjoin(items, items.c.customer == Customer.customer_mail_address) \
+        .order_by(purchases.desc(), Customer.customer_mail_address)
+    if limit is not None:
+        query = query.limit(limit)
     try:
-        customers = db.session.query(Customer).all()
+        rows = query.all()
     except OperationalError:
         raise InternalServerError('Customer table does not exists')
-    for customer in customers:
-        per_user_purchase['customer'] = customer.customer_mail_address
-        per_user_purchase['first_name'] = customer.customer_first_name
-        per_user_purchase['last_name'] = customer.customer_last_name
-        count = 0
-        for purchase in customer.purchase:
-            items = db.session.query(PurchaseItem).filter(
-                purchase.purchase_code_uuid == PurchaseItem.purchase_item_purchase_code_uuid
-            ).all()
-            for item in items:
-                count += item.purchase_item_quantity
-        per_user_purchase['purchases'] = count
-        leaderboard.append(per_user_purchase.copy())
-    return sorted(leaderboard, key=lambda x: x['purchases'], reverse=True)
+    return [{
+        'customer': row.customer_mail_address,
+        'first_name': row.customer_first_name,
+        'last_name': row.customer_last_name,
+        'purchases': row.purchases}
+        for row in rows]
 
 
 def best_selling_product():
+    """
+    Returns the products sorted by number of purchases, read from the sales counters
+    """
     try:
-        products = db.session.query(Product).all()
+        rows = db.session.query(Product, ProductSales.product_sales_purchases) \
+            .join(ProductSales, ProductSales.product_sales_code_uuid == Product.product_code_uuid) \
+            .filter(ProductSales.product_sales_purchases > 0) \
+            .order_by(ProductSales.product_sales_purchases.desc(), Product.product_code_uuid) \
+            .all()
     except OperationalError:
         raise InternalServerError('Product table does not exists')
-    result = sorted(
-        [{
-            'product_code_uuid': product.product_code_uuid,
-            'product_name': product.product_name,
-            'product_availability': product.product_availability,
-            'product_quantity': product.product_quantity,
-            'product_price': product.product_price,
-            'product_discount': product.product_discount,
-            'product_location_id': product.product_location_id,
-            'purchases': len(product.purchaseItem)}
-            for product in products if len(product.purchaseItem) is not 0]
-        , key=lambda x: x['purchases'], reverse=True)
+    result = [{
+        'product_code_uuid': product.product_code_uuid,
+        'product_name': product.product_name,
+        'product_availability': product.product_availability,
+        'product_quantity': product.product_quantity,
+        'product_price': product.product_price,
+        'product_discount': product.product_discount,
+        'product_location_id': product.product_location_id,
+        'purchases': purchases}
+        for product, purchases in rows]
     return result, 200
 
 
-def produce_expenses():
-    result = []
+def produce_expenses(since=None, until=None):
+    """
+    Produces the expense report of every customer with two aggregate
+    queries: the total per customer and the cost per purchase
+    :param since: consider only purchases performed from this date
+    :param until: consider only purchases performed before this date
+    """
+    totals = db.session.query(
+        Purchase.purchase_customer_mail_address.label('customer'),
+        func.sum(PurchaseItem.purchase_item_price).label('total')) \
+        .join(PurchaseItem, PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid)
+    totals = _in_period(totals, since, until) \
+        .group_by(Purchase.purchase_customer_mail_address) \
+        .subquery()
+    query = db.session.query(Customer.customer_mail_address, func.coalesce(totals.c.total, 0)) \
+        .outerjoin(totals, totals.c.customer == Customer.customer_mail_address) \
+        .order_by(Customer.customer_mail_address)
     try:
-        customers = db.session.query(Customer).all()
+        customers = query.all()
     except OperationalError:
         raise InternalServerError('Customer table does not exists')
-    for customer in customers:
-        total_expense = 0
-        purchases = []
-        for purchase in customer.purchase:
-            single_expense = 0
-            for item in purchase.purchase_item:
-                single_expense += item.purchase_item_price
-                total_expense += item.purchase_item_price
-            purchases.append(
-                {
-                    'date': purchase.purchase_date,
-                    'code': purchase.purchase_code_uuid,
-                    'cost': single_expense
-                })
-        customer_review = {
-            'customer': customer.customer_mail_address,
+
+    result = []
+    reviews = dict()
+    for mail_address, total_expense in customers:
+        reviews[mail_address] = {
+            'customer': mail_address,
             'total_expenses': total_expense,
-            'purchases': purchases}
-        result.append(customer_review)
+            'purchases': []}
+        result.append(reviews[mail_address])
+    for row in iter_purchase_costs(since, until):
+        reviews[row.customer]['purchases'].append(
+            {
+                'date': row.date,
+                'code': row.code,
+                'cost': row.cost
+            })
     return result, 200
 
 
+def _in_period(query, since=None, until=None):
+    """
+    Restricts a query to the purchases performed between since (included) and until (excluded)
+    """
+    if since is not None:
+        query = query.filter(Purchase.purchase_date >= since)
+    if until is not None:
+        query = query.filter(Purchase.purchase_date < until)
+    return query
+
+
+def iter_purchase_costs(since=None, until=None):
+    """
+    Yields customer, code, date and cost of every purchase, ordered by
+    customer and date. The costs are computed by a single aggregate query
+    whose rows are fetched in batches, so the whole history is never in memory.
+    :param since: consider only purchases performed from this date
+    :param until: consider only purchases performed before this date
+    """
+    query = db.session.query(
+        Purchase.purchase_customer_mail_address.label('customer'),
+        Purchase.purchase_code_uuid.label('code'),
+        Purchase.purchase_date.label('date'),
+        func.coalesce(func.sum(PurchaseItem.purchase_item_price), 0).label('cost')) \
+        .outerjoin(PurchaseItem, PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid)
+    query = _in_period(query, since, until) \
+        .group_by(Purchase.purchase_customer_mail_address, Purchase.purchase_date, Purchase.purchase_code_uuid) \
+        .order_by(Purchase.purchase_customer_mail_address, Purchase.purchase_date, Purchase.purchase_code_uuid) \
+        .yield_per(1000)
+    try:
+        for row in query:
+            yield row
+    except OperationalError:
+        raise InternalServerError('Purchase table does not exists')
+
+
+def _format_date(date):
+    return date.date().isoformat() if date is not None else None
+
+
+def stream_expenses_ndjson(since=None, until=None):
+    """
+    Yields the expense report as newline delimited JSON, one line per
+    customer with at least a purchase in the given period
+    """
+    review = None
+    for row in iter_purchase_costs(since, until):
+        if review is None or review['customer'] != row.customer:
+            if review is not None:
+                yield json.dumps(review) + '\n'
+            review = {'customer': row.customer, 'total_expenses': 0, 'purchases': []}
+        review['total_expenses'] += row.cost
+        review['purchases'].append({'date': _format_date(row.date), 'code': row.code, 'cost': row.cost})
+    if review is not None:
+        yield json.dumps(review) + '\n'
+
+
+def stream_expenses_csv(since=None, until=None):
+    """
+    Yields the expense report as CSV, one line per purchase
+    """
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(['customer', 'code', 'date', 'cost'])
+    for row in iter_purchase_costs(since, until):
+        writer.writerow([row.customer, row.code, _format_date(row.date), row.cost])
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate(0)
+    if line.tell():
+        yield line.getvalue()
+
+
 def produce_purchase_list(mail_address):
     try:
         customer = db.session.query(Customer).filter_by(customer_mail_address=mail_address).first()
@@ -97,33 +223,158 @@ def produce_purchase_list(mail_address):
 
 def recent_purchases():
     """
-    Shows the most recent purchases within X minutes
+    Shows the most recent purchases within X minutes, served from the recent purchases feed
     """
-    result = db.session.query(Purchase, Product, PurchaseItem) \
-        .filter(Purchase.purchase_date > dt.utcnow() - td(minutes=2)) \
+    feed = get_purchase_feed()
+    feed.load(_load_recent_purchases)
+    _, purchases = feed.snapshot()
+    recent_purchases_dict = dict()
+    for purchase in purchases:
+        recent_purchases_dict[purchase['code']] = {
+            'product': purchase['product'],
+            'first_name': purchase['first_name'],
+            'last_name': purchase['last_name']
+        }
+    return recent_purchases_dict
+
+
+def _load_recent_purchases(since):
+    """
+    Loads from the database the purchases, not gifted, performed after the given date,
+    with a single query joining their items, products and customers
+    """
+    result = db.session.query(Purchase.purchase_code_uuid,
+                              Purchase.purchase_date,
+                              Customer.customer_first_name,
+                              Customer.customer_last_name,
+                              Product.product_name,
+                              PurchaseItem.purchase_item_quantity,
+                              PurchaseItem.purchase_item_price) \
+        .join(Customer, Customer.customer_mail_address == Purchase.purchase_customer_mail_address) \
+        .join(PurchaseItem, PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid) \
+        .join(Product, Product.product_code_uuid == PurchaseItem.purchase_item_product_code_uuid) \
+        .filter(Purchase.purchase_date > since) \
         .filter(Purchase.purchase_gifted == False) \
-        .filter(PurchaseItem.purchase_item_product_code_uuid == Product.product_code_uuid) \
-        .filter(PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid) \
+        .order_by(Purchase.purchase_date, Purchase.purchase_code_uuid) \
         .all()
     recent_purchases_dict = dict()
-    for entry in result:
+    for row in result:
         recent_product = {
-            "product": entry[1].product_name,
-            "quantity": entry[2].purchase_item_quantity,
-            "price": entry[2].purchase_item_price
+            "product": row.product_name,
+            "quantity": row.purchase_item_quantity,
+            "price": row.purchase_item_price
         }
-        if entry[0].purchase_code_uuid not in recent_purchases_dict.keys():
-            customer = db.session.query(Customer) \
-                .filter(Customer.customer_mail_address == entry[0].purchase_customer_mail_address) \
-                .first()
-            recent_purchases_dict[entry[0].purchase_code_uuid] = {
+        if row.purchase_code_uuid not in recent_purchases_dict:
+            recent_purchases_dict[row.purchase_code_uuid] = {
+                'code': row.purchase_code_uuid,
+                'date': row.purchase_date,
                 'product': [recent_product],
-                'first_name': customer.customer_first_name,
-                'last_name': customer.customer_last_name
+                'first_name': row.customer_first_name,
+                'last_name': row.customer_last_name
             }
         else:
-            recent_purchases_dict[entry[0].purchase_code_uuid]['product'].append(recent_product)
-    return recent_purchases_dict
+            recent_purchases_dict[row.purchase_code_uuid]['product'].append(recent_product)
+    return list(recent_purchases_dict.values())
+
+
+def check_purchase(purchase_uuid):
+    """
+    Returns the date, the gift state and the name of the owner of a purchase
+    """
+    result = db.session.query(Purchase.purchase_gifted,
+                              Purchase.purchase_date,
+                              Customer.customer_mail_address,
+                              Customer.customer_first_name,
+                              Customer.customer_last_name) \
+        .outerjoin(Customer, Customer.customer_mail_address == Purchase.purchase_customer_mail_address) \
+        .filter(Purchase.purchase_code_uuid == purchase_uuid) \
+        .first()
+    if result is None:
+        raise NotFound('purchase_uuid not found')
+    if result.customer_mail_address is None:
+        raise InternalServerError('customer not found in db')
+    return {
+        'purchase_gifted': result.purchase_gifted,
+        'purchase_date': result.purchase_date,
+        'customer_first_name': result.customer_first_name,
+        'customer_last_name': result.customer_last_name
+    }
+
+
+def recent_purchase_entry(purchase, customer, items, products):
+    """
+    Describes a purchase as published on the recent purchases feed
+    :param products: dict mapping the code of each purchased product to the product
+    """
+    return {
+        'code': purchase.purchase_code_uuid,
+        'date': purchase.purchase_date,
+        'product': [{
+            'product': products[item.purchase_item_product_code_uuid].product_name,
+            'quantity': item.purchase_item_quantity,
+            'price': item.purchase_item_price
+        } for item in items],
+        'first_name': customer.customer_first_name,
+        'last_name': customer.customer_last_name
+    }
+
+
+def publish_purchase(entry):
+    """
+    Publishes a committed purchase on the recent purchases feed
+    :param entry: the purchase, as described by recent_purchase_entry
+    """
+    get_purchase_feed().publish(PURCHASE, entry)
+
+
+def _server_sent_event(event, sequence, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(
+        sequence, event, json.dumps(data, default=lambda date: date.isoformat()))
+
+
+def stream_recent_purchases(last_event_id=None, keepalive=15, duration=300):
+    """
+    Yields the recent purchases feed as server-sent events.
+    The stream starts with a snapshot event holding the purchases in the
+    window, unless the client resumes from an event still buffered, then
+    sends a purchase or remove event for each change. The stream ends after
+    `duration` seconds, clients reconnect sending the last event id.
+    It must be called within the request; the generator only uses the
+    database, in an application context of its own, to reload the feed.
+    """
+    app = current_app._get_current_object()
+    feed = get_purchase_feed()
+    feed.load(_load_recent_purchases)
+
+    def load(since):
+        with app.app_context():
+            return _load_recent_purchases(since)
+
+    def generate():
+        sent = time.monotonic()
+        deadline = sent + duration
+        after = last_event_id
+        events = feed.wait(after, 0) if after is not None else None
+        while True:
+            if events is None:
+                after, purchases = feed.snapshot()
+                yield _server_sent_event('snapshot', after, purchases)
+                sent = time.monotonic()
+            for sequence, event, data in events or ():
+                yield _server_sent_event(event, sequence, data)
+                after = sequence
+                sent = time.monotonic()
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if now - sent >= keepalive:
+                yield ': keepalive\n\n'
+                sent = now
+            # the changes of the other workers are picked up by the reloads
+            feed.load(load)
+            events = feed.wait(after, min(keepalive - (now - sent), deadline - now, feed.ttl))
+
+    return generate()
 
 
 def gift_purchase(purchase_uuid, customer_mail_address):
@@ -138,9 +389,12 @@ def gift_purchase(purchase_uuid, customer_mail_address):
     if result is not None:
         if result.purchase_customer_mail_address == customer_mail_address:
             raise PreconditionFailed('Customer is trying to gift his own purchase')
+        transfer_purchase(result, customer_mail_address)
         result.purchase_customer_mail_address = customer_mail_address
         result.purchase_gifted = True
         db.session.commit()
+        # gifted purchases are not shown among the recent ones
+        get_purchase_feed().publish(REMOVE, {'code': purchase_uuid})
         return "", 204
     else:
         raise NotFound()
@@ -158,18 +412,55 @@ def undo_purchase(purchase_uuid, customer_mail_address):
             .filter(Purchase.purchase_customer_mail_address == customer_mail_address) \
             .first()
         if result is not None:
-            print(result.purchase_item)
+            revert_purchase(result)
+            quantities = {item.purchase_item_product_code_uuid: item.purchase_item_quantity
+                          for item in result.purchase_item}
+            restock_products(quantities)
             for item in result.purchase_item:
-                product = db.session.query(Product) \
-                    .filter(Product.product_code_uuid == item.purchase_item_product_code_uuid) \
-                    .first()
-                print('before: ' + str(product.product_quantity))
-                product.product_quantity += item.purchase_item_quantity
-                print('after: ' + str(product.product_quantity))
                 db.session.delete(item)
             db.session.delete(result)
+            record_product_changes([(STOCK, code) for code in quantities])
             db.session.commit()
+            get_purchase_feed().publish(REMOVE, {'code': purchase_uuid})
         else:
             raise NotFound()
     except OperationalError:
         raise InternalServerError()
+
+
+def _update_stock(statement, quantities):
+    params = [{'code': code, 'quantity': quantity} for code, quantity in quantities.items()]
+    if db.engine.dialect.supports_sane_multi_rowcount:
+        return db.session.execute(statement, params).rowcount == len(params)
+    return all(db.session.execute(statement, param).rowcount == 1 for param in params)
+
+
+def withdraw_products(quantities):
+    """
+    Removes the purchased quantities from the products stock.
+    Each product is decremented by a conditional UPDATE that only matches
+    while the product is available and has enough stock, so concurrent
+    checkouts cannot oversell. The caller must roll back on failure.
+    :param quantities: dict mapping product codes to the quantity to withdraw
+    :return: True if every product has been updated, False otherwise
+    """
+    table = Product.__table__
+    statement = table.update() \
+        .where(table.c.product_code_uuid == bindparam('code')) \
+        .where(table.c.product_quantity >= bindparam('quantity')) \
+        .where(table.c.product_availability == True) \
+        .values(product_quantity=table.c.product_quantity - bindparam('quantity'))
+    return _update_stock(statement, quantities)
+
+
+def restock_products(quantities):
+    """
+    Adds back the given quantities to the products stock
+    :param quantities: dict mapping product codes to the quantity to add
+    :return: True if every product has been updated, False otherwise
+    """
+    table = Product.__table__
+    statement = table.update() \
+        .where(table.c.product_code_uuid == bindparam('code')) \
+        .values(product_quantity=table.c.product_quantity + bindparam('quantity'))
+    return _update_stock(statement, quantities)
@@ -0,0 +1,287 @@
+import datetime
+import json
+from collections import OrderedDict
+from numbers import Number
+
+from flask import current_app
+from sqlalchemy import bindparam, func, or_, select
+from werkzeug.exceptions import Gone, RequestEntityTooLarge
+
+from obar.models import db, CatalogVersion, Product, ProductChange, Site
+
+CREATE = 'create'
+UPDATE = 'update'
+RESTOCK = 'restock'
+# operations of the change log besides create and update
+DELETE = 'delete'
+STOCK = 'stock'
+
+# Product fields of the operations, with the check of their values
+PRODUCT_FIELDS = {
+    'name': ('product_name', lambda value: isinstance(value, str) and value.strip() != ''),
+    'availability': ('product_availability', lambda value: isinstance(value, bool)),
+    'discount': ('product_discount', lambda value: _is_number(value) and 0 <= value <= 100),
+    'price': ('product_price', lambda value: _is_number(value) and value >= 0),
+    'quantity': ('product_quantity', lambda value: _is_integer(value) and value >= 0),
+    'location_id': ('product_location_id', lambda value: _is_integer(value))
+}
+
+
+def _is_number(value):
+    return isinstance(value, Number) and not isinstance(value, bool)
+
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _validate(operation):
+    """
+    Returns the reason why an operation is invalid, None if it is valid
+    """
+    if not isinstance(operation, dict):
+        return 'The operation must be an object'
+    kind = operation.get('op')
+    if kind not in (CREATE, UPDATE, RESTOCK):
+        return 'Unknown operation, expected create, update or restock'
+    if kind != CREATE and not isinstance(operation.get('code'), str):
+        return 'Missing product code'
+    if kind == RESTOCK:
+        quantity = operation.get('quantity')
+        if not _is_integer(quantity) or quantity <= 0:
+            return 'The restocked quantity must be a positive integer'
+        return None
+    fields = [field for field in PRODUCT_FIELDS if field in operation]
+    if kind == CREATE and len(fields) != len(PRODUCT_FIELDS):
+        return 'Missing ' + ', '.join(field for field in PRODUCT_FIELDS if field not in operation)
+    if kind == UPDATE and not fields:
+        return 'Nothing to update'
+    for field in fields:
+        if not PRODUCT_FIELDS[field][1](operation[field]):
+            return 'Invalid ' + field
+    return None
+
+
+def apply_product_batch(operations):
+    """
+    Applies a batch of product operations in a single transaction.
+    The products are resolved with one query, keyed by the codes and the names of
+    the operations. Operations are applied in order: a restock adds its quantity
+    to the stock (quantity = quantity + n, so concurrent purchases are not
+    overwritten), unless the same batch already set the quantity of the product.
+    Invalid operations and the ones conflicting with a product or a site are
+    skipped and reported.
+    :param operations: list of dicts with the op (create, update or restock), the
+    code of the product, except for create, and the product fields to set
+    :return: the result of each operation, in order
+    """
+    limit = current_app.config.get('PRODUCT_BATCH_MAX_OPERATIONS', 400)
+    if len(operations) > limit:
+        raise RequestEntityTooLarge('A batch holds at most {} operations'.format(limit))
+
+    results = []
+    valid = []
+    for index, operation in enumerate(operations):
+        result = {'index': index}
+        results.append(result)
+        error = _validate(operation)
+        if error is not None:
+            result.update(status='invalid', message=error)
+        else:
+            result.update(op=operation['op'], code=operation.get('code') if operation['op'] != CREATE else None)
+            valid.append((result, operation))
+
+    codes = {result['code'] for result, _ in valid if result['code'] is not None}
+    names = {operation['name'] for _, operation in valid if 'name' in operation}
+    products = dict()
+    if codes or names:
+        products = {product.product_code_uuid: product for product in Product.query.filter(
+            or_(Product.product_code_uuid.in_(codes), Product.product_name.in_(names)))}
+    locations = {operation['location_id'] for _, operation in valid if 'location_id' in operation}
+    if locations:
+        locations = {row[0] for row in db.session.query(Site.site_id).filter(Site.site_id.in_(locations))}
+    # product code of each (name, location), to check the unique constraint
+    named = {(product.product_name, product.product_location_id): code for code, product in products.items()}
+
+    deltas = dict()
+    quantity_set = set()
+    # change logged for each product, a creation or update includes the stock
+    changes = OrderedDict()
+    for result, operation in valid:
+        kind = operation['op']
+        product = products.get(result['code'])
+        if kind != CREATE and product is None:
+            result.update(status='not_found', message='Product not found')
+            continue
+        if kind == RESTOCK:
+            if product.product_code_uuid in quantity_set:
+                product.product_quantity += operation['quantity']
+            else:
+                deltas[product.product_code_uuid] = deltas.get(product.product_code_uuid, 0) + operation['quantity']
+            changes.setdefault(product.product_code_uuid, STOCK)
+            result.update(status='restocked')
+            continue
+
+        if 'location_id' in operation and operation['location_id'] not in locations:
+            result.update(status='conflict', message='Location ID does not exists')
+            continue
+        key = (operation.get('name', product.product_name if product else None),
+               operation.get('location_id', product.product_location_id if product else None))
+        if named.get(key, result['code']) != result['code']:
+            result.update(status='conflict', message='Product name is not unique')
+            continue
+
+        if kind == CREATE:
+            product = Product(**{PRODUCT_FIELDS[field][0]: operation[field] for field in PRODUCT_FIELDS})
+            db.session.add(product)
+            products[product.product_code_uuid] = product
+            changes[product.product_code_uuid] = CREATE
+            result.update(code=product.product_code_uuid, status='created')
+        else:
+            named.pop((product.product_name, product.product_location_id), None)
+            for field in PRODUCT_FIELDS:
+                if field in operation:
+                    setattr(product, PRODUCT_FIELDS[field][0], operation[field])
+            if 'name' in operation or 'location_id' in operation:
+                # renames are written in order, names may be swapped within the batch
+                db.session.flush()
+            if changes.get(product.product_code_uuid) != CREATE:
+                changes[product.product_code_uuid] = UPDATE
+            result.update(status='updated')
+        named[key] = product.product_code_uuid
+        if 'quantity' in operation:
+            # the quantity set replaces the earlier restocks of the batch
+            deltas.pop(product.product_code_uuid, None)
+            quantity_set.add(product.product_code_uuid)
+
+    db.session.flush()
+    if deltas:
+        table = Product.__table__
+        db.session.execute(table.update()
+                           .where(table.c.product_code_uuid == bindparam('_code'))
+                           .values(product_quantity=table.c.product_quantity + bindparam('_delta')),
+                           [{'_code': code, '_delta': delta} for code, delta in deltas.items()])
+    record_product_changes([(change, code) for code, change in changes.items()])
+    db.session.commit()
+    return results
+
+
+def record_product_changes(changes):
+    """
+    Records changes of the products in the change log. Must be called in the
+    transaction changing the products, right before its commit. The catalog edits
+    also increment the catalog version, whose row stays locked until the commit so
+    that the edits of concurrent transactions are numbered in the order they are
+    committed. The stock movements of the checkouts do not take that lock, which
+    would serialize the purchases: on a server database, concurrent ones may be
+    committed out of sequence order.
+    The fields of the products are read back from the database, so that relative
+    stock movements are logged with the resulting quantity. A change supersedes
+    the earlier stock movements of its product, which are deleted: the log grows
+    with the catalog edits rather than with the sales.
+    :param changes: list of (operation, product code), the operation being one of
+    create, update, delete and stock
+    """
+    if not changes:
+        return
+    if any(operation != STOCK for operation, _ in changes):
+        CatalogVersion.bump()
+        db.session.flush()
+    # read by the catalog cache once the transaction is committed
+    db.session.info['catalog_changed'] = True
+    log = ProductChange.__table__
+    db.session.execute(log.delete()
+                       .where(log.c.product_change_operation == STOCK)
+                       .where(log.c.product_change_product_code_uuid.in_({code for _, code in changes})))
+    table = Product.__table__
+    codes = {code for operation, code in changes if operation != DELETE}
+    products = dict()
+    if codes:
+        products = {row.product_code_uuid: row for row in db.session.execute(
+            select([table]).where(table.c.product_code_uuid.in_(codes)))}
+    date = datetime.datetime.utcnow()
+    rows = []
+    for operation, code in changes:
+        data = None
+        if operation != DELETE:
+            product = products.get(code)
+            if product is None:
+                continue
+            if operation == STOCK:
+                data = {'quantity': product.product_quantity}
+            else:
+                data = {field: product[column] for field, (column, _) in PRODUCT_FIELDS.items()}
+        rows.append({'product_change_date': date,
+                     'product_change_product_code_uuid': code,
+                     'product_change_operation': operation,
+                     'product_change_data': json.dumps(data) if data is not None else None})
+    db.session.execute(ProductChange.__table__.insert(), rows)
+
+
+def product_changes(since=None, limit=None):
+    """
+    Returns the changes of the products following a sequence number
+    :param since: sequence number of the last change known by the client, None to
+    only return the current sequence number
+    :param limit: maximum number of changes, PRODUCT_CHANGES_PAGE_SIZE if None
+    :return: the sequence number of the last change returned, the changes and
+    whether more changes follow
+    """
+    last = ProductChange.last_sequence()
+    if since is None:
+        return {'sequence': last, 'changes': [], 'more': False}
+    purged = db.session.query(CatalogVersion.catalog_version_purged_sequence) \
+        .filter(CatalogVersion.catalog_version_id == 1) \
+        .scalar() or 0
+    # the changes following since were purged, or the client comes from another database
+    if since > last or since < purged:
+        raise Gone('The changes following {} are no longer available, reload the products'.format(since))
+
+    limit = limit or current_app.config.get('PRODUCT_CHANGES_PAGE_SIZE', 1000)
+    changes = ProductChange.query \
+        .filter(ProductChange.product_change_sequence > since) \
+        .order_by(ProductChange.product_change_sequence) \
+        .limit(limit + 1) \
+        .all()
+    more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        'sequence': changes[-1].product_change_sequence if changes else since,
+        'changes': [{
+            'sequence': change.product_change_sequence,
+            'date': change.product_change_date,
+            'code': change.product_change_product_code_uuid,
+            'operation': change.product_change_operation,
+            'product': json.loads(change.product_change_data) if change.product_change_data else None
+        } for change in changes],
+        'more': more
+    }
+
+
+def purge_product_changes(days=None):
+    """
+    Deletes the changes older than the given number of days, except the last one
+    which keeps the sequence number of the clients up to date valid. The clients
+    whose sequence number precedes the purged changes get 410 Gone.
+    :param days: days of changes to keep, PRODUCT_CHANGES_RETENTION_DAYS if None
+    :return: the number of deleted changes
+    """
+    if days is None:
+        days = current_app.config.get('PRODUCT_CHANGES_RETENTION_DAYS', 30)
+    last = db.session.query(func.max(ProductChange.product_change_sequence)).scalar()
+    if last is None:
+        return 0
+    sequence = db.session.query(func.max(ProductChange.product_change_sequence)) \
+        .filter(ProductChange.product_change_date < datetime.datetime.utcnow() - datetime.timedelta(days=days)) \
+        .filter(ProductChange.product_change_sequence < last) \
+        .scalar()
+    if sequence is None:
+        return 0
+    purged = ProductChange.query \
+        .filter(ProductChange.product_change_sequence <= sequence) \
+        .delete(synchronize_session=False)
+    CatalogVersion.query \
+        .filter(CatalogVersion.catalog_version_id == 1) \
+        .update({'catalog_version_purged_sequence': sequence}, synchronize_session=False)
+    db.session.commit()
+    return purged
@@ -0,0 +1,165 @@
+from sqlalchemy import bindparam, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from obar.models import db, Purchase, PurchaseItem, CustomerSales, ProductSales, DailySales
+
+
+def _insert_missing(table):
+    """
+    Returns an INSERT statement skipping the rows whose key already exists,
+    None if the backend has no such statement
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return None
+
+
+def _increment(model, key, rows):
+    """
+    Adds deltas to the counters of a sales model, creating the missing counters.
+    The missing counters are first inserted at zero, skipping the ones created
+    meanwhile by concurrent transactions, then every counter is updated in place
+    (counter = counter + delta) so that concurrent transactions never overwrite
+    each other's totals.
+    :param model: the sales counter model
+    :param key: name of the primary key column of the model
+    :param rows: list of dicts holding the counter key and the deltas to apply
+    """
+    if not rows:
+        return
+    table = model.__table__
+    key_column = table.c[key]
+    columns = [column for column in rows[0] if column != key]
+    zeros = [dict({column: 0 for column in columns}, **{key: row[key]}) for row in rows]
+
+    statement = _insert_missing(table)
+    if statement is not None:
+        db.session.execute(statement, zeros)
+    else:
+        existing = {row[0] for row in db.session.query(key_column)
+                    .filter(key_column.in_([row[key] for row in rows]))}
+        missing = [row for row in zeros if row[key] not in existing]
+        if missing:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(table.insert(), missing)
+            except IntegrityError:
+                # created by a concurrent transaction, insert the others one by one
+                for row in missing:
+                    try:
+                        with db.session.begin_nested():
+                            db.session.execute(table.insert(), row)
+                    except IntegrityError:
+                        pass
+
+    statement = table.update() \
+        .where(key_column == bindparam('_' + key)) \
+        .values({column: table.c[column] + bindparam('_' + column) for column in columns})
+    db.session.execute(statement, [{'_' + name: value for name, value in row.items()} for row in rows])
+
+
+def _update_counters(purchase, purchase_items, sign):
+    items = sum(item.purchase_item_quantity for item in purchase_items)
+    revenue = sum(item.purchase_item_price for item in purchase_items)
+    _increment(CustomerSales, 'customer_sales_mail_address', [{
+        'customer_sales_mail_address': purchase.purchase_customer_mail_address,
+        'customer_sales_items': sign * items
+    }])
+    _increment(ProductSales, 'product_sales_code_uuid', [{
+        'product_sales_code_uuid': item.purchase_item_product_code_uuid,
+        'product_sales_units': sign * item.purchase_item_quantity,
+        'product_sales_revenue': sign * item.purchase_item_price,
+        'product_sales_purchases': sign
+    } for item in purchase_items])
+    _increment(DailySales, 'daily_sales_day', [{
+        'daily_sales_day': purchase.purchase_date.date(),
+        'daily_sales_items': sign * items,
+        'daily_sales_revenue': sign * revenue,
+        'daily_sales_purchases': sign
+    }])
+
+
+def record_purchase(purchase, purchase_items):
+    """
+    Adds a new purchase to the sales counters.
+    Must be called in the same transaction that stores the purchase.
+    """
+    _update_counters(purchase, purchase_items, 1)
+
+
+def revert_purchase(purchase):
+    """
+    Removes a purchase from the sales counters.
+    Must be called in the same transaction that deletes the purchase.
+    """
+    _update_counters(purchase, purchase.purchase_item, -1)
+
+
+def transfer_purchase(purchase, customer_mail_address):
+    """
+    Moves the items of a purchase from its current owner to another customer.
+    Must be called in the same transaction that changes the purchase owner.
+    """
+    items = sum(item.purchase_item_quantity for item in purchase.purchase_item)
+    _increment(CustomerSales, 'customer_sales_mail_address', [{
+        'customer_sales_mail_address': purchase.purchase_customer_mail_address,
+        'customer_sales_items': -items
+    }, {
+        'customer_sales_mail_address': customer_mail_address,
+        'customer_sales_items': items
+    }])
+
+
+def counter_backfill_statements():
+    """
+    Returns the statements filling the empty sales counter tables from the
+    purchase history
+    """
+    per_customer = select([Purchase.purchase_customer_mail_address,
+                           func.sum(PurchaseItem.purchase_item_quantity)]) \
+        .select_from(Purchase.__table__.join(
+            PurchaseItem.__table__, PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid)) \
+        .group_by(Purchase.purchase_customer_mail_address)
+
+    per_product = select([PurchaseItem.purchase_item_product_code_uuid,
+                          func.sum(PurchaseItem.purchase_item_quantity),
+                          func.sum(PurchaseItem.purchase_item_price),
+                          func.count(PurchaseItem.purchase_item_uuid)]) \
+        .group_by(PurchaseItem.purchase_item_product_code_uuid)
+
+    day = func.date(Purchase.purchase_date)
+    per_day = select([day,
+                      func.sum(PurchaseItem.purchase_item_quantity),
+                      func.sum(PurchaseItem.purchase_item_price),
+                      func.count(func.distinct(Purchase.purchase_code_uuid))]) \
+        .select_from(Purchase.__table__.join(
+            PurchaseItem.__table__, PurchaseItem.purchase_item_purchase_code_uuid == Purchase.purchase_code_uuid)) \
+        .group_by(day)
+
+    return [
+        CustomerSales.__table__.insert().from_select(
+            ['customer_sales_mail_address', 'customer_sales_items'], per_customer),
+        ProductSales.__table__.insert().from_select(
+            ['product_sales_code_uuid', 'product_sales_units', 'product_sales_revenue', 'product_sales_purchases'],
+            per_product),
+        DailySales.__table__.insert().from_select(
+            ['daily_sales_day', 'daily_sales_items', 'daily_sales_revenue', 'daily_sales_purchases'], per_day)
+    ]
+
+
+def rebuild_counters():
+    """
+    Recomputes every sales counter from the purchase history.
+    """
+    db.session.query(CustomerSales).delete(synchronize_session=False)
+    db.session.query(ProductSales).delete(synchronize_session=False)
+    db.session.query(DailySales).delete(synchronize_session=False)
+    for statement in counter_backfill_statements():
+        db.session.execute(statement)
+    db.session.commit()
@@ -1,6 +1,7 @@
 from flask_restplus import Namespace, Resource, fields
 from flask import request
 from .decorator import customer_token_required, admin_token_required
+from .pagination import pagination_parser, paginate, marshal_page
 from .marshal.fields import site_fields, site_fields_post
 from obar.models import db, Site
 from sqlalchemy.exc import OperationalError, IntegrityError
@@ -18,24 +19,26 @@ site_ns = Namespace('site', description='Site related operations', authorization
 
 site_model = site_ns.model('Site', site_fields)
 site_model_post = site_ns.model('Site Post', site_fields_post)
+site_list_parser = pagination_parser(site_ns)
 
 
 @site_ns.route('')
 class SitesAPI(Resource):
 
     @site_ns.doc('get_sites')
-    @site_ns.response(200, 'Return a list of products')
+    @site_ns.response(200, 'Return a list of sites', [site_model])
     @site_ns.response(500, 'Internal server error')
-    @site_ns.marshal_list_with(site_model)
+    @site_ns.expect(site_list_parser)
     def get(self):
         """
         Get the list of sites
         """
+        args = site_list_parser.parse_args()
         try:
-            sites = Site.query.all()
+            sites, next_cursor = paginate(Site.query, [Site.site_id], args['limit'], args['after'])
         except OperationalError:
             raise InternalServerError(description='Site table does not exists.')
-        return sites, 200
+        return marshal_page(sites, site_model, args['fields'], next_cursor)
 
     @admin_token_required
     @site_ns.doc('post_site', security='JWT')
@@ -0,0 +1,149 @@
+"""
+Caches of the token revocation state.
+BlacklistToken.check_blacklist consults the cache configured on the
+application before querying the blacklist table, so that authenticating
+a request does not cost a database round trip.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class RevocationCache(ABC):
+    """Revocation cache interface
+    Remembers whether a token is revoked. Revoked tokens are kept for `ttl`
+    seconds, while tokens found valid are kept for `negative_ttl` seconds
+    since they may be revoked by another worker in the meantime.
+    """
+
+    def __init__(self, ttl=86400, negative_ttl=10):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+    @abstractmethod
+    def get(self, token):
+        """
+        :return: True if the token is revoked, False if it is valid, None if unknown
+        """
+
+    @abstractmethod
+    def set(self, token, revoked):
+        """
+        Remembers whether the token is revoked
+        """
+
+    def _ttl(self, revoked):
+        return self.ttl if revoked else self.negative_ttl
+
+
+class NullRevocationCache(RevocationCache):
+    """Revocation cache that never remembers anything"""
+
+    def get(self, token):
+        return None
+
+    def set(self, token, revoked):
+        pass
+
+
+class LocalRevocationCache(RevocationCache):
+    """In-process LRU revocation cache
+    Keeps at most `max_size` entries, evicting the least recently used ones.
+    """
+
+    def __init__(self, ttl=86400, negative_ttl=10, max_size=10000, clock=time.monotonic):
+        super(LocalRevocationCache, self).__init__(ttl, negative_ttl)
+        self.max_size = max_size
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            revoked, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return revoked
+
+    def set(self, token, revoked):
+        ttl = self._ttl(revoked)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (revoked, self._clock() + ttl)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedRevocationCache(RevocationCache):
+    """Revocation cache shared by every worker
+    Stores the entries in a Redis-compatible server.
+    :param client: any client exposing the get and setex commands of redis.Redis
+    """
+
+    def __init__(self, client, ttl=86400, negative_ttl=10, prefix='obar:revoked:'):
+        super(SharedRevocationCache, self).__init__(ttl, negative_ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, token):
+        value = self.client.get(self.prefix + token)
+        if value is None:
+            return None
+        return value in (b'1', '1')
+
+    def set(self, token, revoked):
+        ttl = int(self._ttl(revoked))
+        if ttl <= 0:
+            return
+        self.client.setex(self.prefix + token, ttl, '1' if revoked else '0')
+
+
+def init_app(app):
+    """
+    Configures the revocation cache of the application.
+    REVOCATION_CACHE selects the backend: 'local' (default), 'redis' or 'null'.
+    """
+    backend = app.config.get('REVOCATION_CACHE', 'local')
+    ttl = app.config.get('REVOCATION_CACHE_TTL', 86400)
+    negative_ttl = app.config.get('REVOCATION_CACHE_NEGATIVE_TTL', 10)
+    if backend == 'local':
+        cache = LocalRevocationCache(ttl, negative_ttl, max_size=app.config.get('REVOCATION_CACHE_SIZE', 10000))
+    elif backend == 'redis':
+        try:
+            from redis import Redis
+        except ImportError:
+            raise RuntimeError('REVOCATION_CACHE=redis requires the redis package')
+        client = Redis.from_url(app.config.get('REVOCATION_CACHE_URL', 'redis://localhost:6379/0'))
+        cache = SharedRevocationCache(client, ttl, negative_ttl)
+    elif backend == 'null':
+        cache = NullRevocationCache(ttl, negative_ttl)
+    else:
+        raise ValueError('Unknown REVOCATION_CACHE backend: ' + str(backend))
+    app.extensions['revocation_cache'] = cache
+    return cache
+
+
+_null_cache = NullRevocationCache()
+
+
+def get_revocation_cache():
+    """
+    Returns the revocation cache of the current application,
+    a cache that never remembers anything if none is configured.
+    """
+    return current_app.extensions.get('revocation_cache', _null_cache)
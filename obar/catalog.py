@@ -0,0 +1,118 @@
+"""
+Cache of the serialized product catalog.
+The transactions changing the products (edits, checkouts, undos) log their
+changes in the product change log, whose last sequence number serves as the
+catalog version. Pages of the product list are cached in memory keyed by
+that version and by their arguments, so that an
+unchanged catalog is served without querying or marshalling the products,
+and its ETag lets the kiosks revalidate it without transferring it again.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from obar.models import db, ProductChange
+
+
+class CatalogCache(object):
+    """In-process LRU cache of the product list pages
+    Keeps at most `max_size` pages. The catalog version is read from the
+    database at most once every `ttl` seconds, and again right after a
+    transaction of this process changed it; the changes committed by other
+    processes are therefore seen within `ttl` seconds.
+    """
+
+    def __init__(self, max_size=256, ttl=1.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._version = None
+        self._expires_at = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def version(self, loader=ProductChange.last_sequence):
+        """
+        Returns the catalog version, loading it when it is unknown or expired
+        :param loader: function returning the version stored in the database
+        """
+        with self._lock:
+            if self._version is not None and self._clock() < self._expires_at:
+                return self._version
+        version = loader()
+        with self._lock:
+            self._version = version
+            self._expires_at = self._clock() + self.ttl
+        return version
+
+    def invalidate(self):
+        """
+        Forgets the catalog version, the next request reads it again
+        """
+        with self._lock:
+            self._version = None
+
+    @staticmethod
+    def etag(version, key):
+        """
+        Returns the entity tag of a page: the catalog version followed by a digest of its arguments
+        """
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        return '{}-{}'.format(version, digest)
+
+    def get(self, version, key):
+        with self._lock:
+            entry = self._entries.get((version, key))
+            if entry is not None:
+                self._entries.move_to_end((version, key))
+            return entry
+
+    def set(self, version, key, page):
+        with self._lock:
+            # pages of older versions are never requested again
+            for stale in [entry for entry in self._entries if entry[0] < version]:
+                del self._entries[stale]
+            self._entries[(version, key)] = page
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._entries.clear()
+
+
+@event.listens_for(db.session, 'after_commit')
+def _catalog_committed(session):
+    if session.info.pop('catalog_changed', False) and has_app_context():
+        get_catalog_cache().invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _catalog_rolled_back(session):
+    session.info.pop('catalog_changed', None)
+
+
+def init_app(app):
+    """
+    Configures the catalog cache of the application, holding at most
+    CATALOG_CACHE_SIZE pages (256 by default) and reading the catalog version
+    at most once every CATALOG_VERSION_TTL seconds (1 by default)
+    """
+    catalog_cache = CatalogCache(max_size=app.config.get('CATALOG_CACHE_SIZE', 256),
+                                 ttl=app.config.get('CATALOG_VERSION_TTL', 1.0))
+    app.extensions['catalog_cache'] = catalog_cache
+    return catalog_cache
+
+
+def get_catalog_cache():
+    """
+    Returns the catalog cache of the current application
+    """
+    return current_app.extensions['catalog_cache']
@@ -0,0 +1,66 @@
+"""
+Flask CLI commands, registered on the application by create_app.
+"""
+
+import json
+
+import click
+from flask.cli import with_appcontext
+
+from obar.apis.service.blacklist_service import purge_blacklist
+from obar.apis.service.customer_service import import_customers, parse_customer_csv
+from obar.apis.service.image_service import generate_missing_variants
+from obar.apis.service.product_service import purge_product_changes
+from obar.apis.service.sales_service import rebuild_counters
+
+
+@click.command('rebuild-sales-counters')
+@with_appcontext
+def rebuild_sales_counters_command():
+    """Recompute the sales counters from the purchase history."""
+    rebuild_counters()
+    click.echo('Sales counters rebuilt.')
+
+
+@click.command('purge-blacklist')
+@with_appcontext
+def purge_blacklist_command():
+    """Delete the blacklisted tokens that already expired."""
+    click.echo('Purged {} expired tokens.'.format(purge_blacklist()))
+
+
+@click.command('purge-product-changes')
+@click.option('--days', type=int, help='Days of changes to keep, PRODUCT_CHANGES_RETENTION_DAYS by default.')
+@with_appcontext
+def purge_product_changes_command(days):
+    """Delete the product changes older than the retention period."""
+    click.echo('Purged {} product changes.'.format(purge_product_changes(days)))
+
+
+@click.command('generate-image-variants')
+@click.option('--all', 'regenerate', is_flag=True, help='Also replace the existing variants.')
+@with_appcontext
+def generate_image_variants_command(regenerate):
+    """Generate the resized variants of the product images lacking them."""
+    click.echo('Processed {} product images.'.format(generate_missing_variants(regenerate)))
+
+
+@click.command('import-customers')
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--batch-size', type=int, help='Customers inserted per transaction.')
+@click.option('--workers', type=int, help='Processes hashing the PINs, the number of CPUs by default.')
+@with_appcontext
+def import_customers_command(source, batch_size, workers):
+    """Create the customers of a CSV file, or of a JSON array if SOURCE ends with .json."""
+    if source.name.endswith('.json'):
+        rows = json.load(source)
+    else:
+        try:
+            rows = parse_customer_csv(source.read())
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='SOURCE')
+    report = import_customers(rows, batch_size, workers)
+    for result in report['results']:
+        if result['status'] != 'created':
+            click.echo('Row {}: {} ({})'.format(result['row'], result['message'], result['mail_address']), err=True)
+    click.echo('Imported {} of {} customers.'.format(report['created'], len(report['results'])))
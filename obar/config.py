@@ -0,0 +1,153 @@
+"""
+Configuration of the application.
+create_app loads the configuration class selected by the OBAR_CONFIG
+environment variable (development by default), then the settings given by
+the OBAR_* environment variables, then the test configuration.
+"""
+
+import os
+
+from sqlalchemy.engine.url import make_url
+
+basedir = os.getcwd()
+
+
+class Config(object):
+    SECRET_KEY = 'developing'
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'persistent', 'obar_database.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_PROFILE = 'default'
+
+    # Connection pool of the server databases, ignored for SQLite
+    DB_POOL_SIZE = None
+    DB_MAX_OVERFLOW = None
+    DB_POOL_TIMEOUT = None
+    DB_POOL_RECYCLE = None
+    DB_POOL_PRE_PING = False
+    # Milliseconds after which PostgreSQL and MySQL abort a statement, None to disable
+    DB_STATEMENT_TIMEOUT = None
+
+    # werkzeug method hashing the PINs, e.g. pbkdf2:sha256:50000; existing
+    # hashes are converted on the next successful login
+    PIN_HASH_METHOD = 'pbkdf2:sha256'
+
+    JWT_SECRET_KEY = 'DUMMY_SECRET_KEY'
+    JWT_ALGORITHM = 'HS256'
+    # Seconds
+    JWT_EXPIRATION = 86405
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+class ProductionConfig(Config):
+    # must be given through the environment
+    SECRET_KEY = None
+    JWT_SECRET_KEY = None
+    SQLITE_PROFILE = 'production'
+    DB_POOL_SIZE = 10
+    DB_MAX_OVERFLOW = 20
+    DB_POOL_RECYCLE = 1800
+    DB_POOL_PRE_PING = True
+    DB_STATEMENT_TIMEOUT = 30000
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig
+}
+
+
+def _boolean(value):
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Environment variables overriding the configuration, with their type
+ENVIRONMENT = (
+    ('OBAR_SECRET_KEY', 'SECRET_KEY', str),
+    ('OBAR_DATABASE_URI', 'SQLALCHEMY_DATABASE_URI', str),
+    ('OBAR_SQLITE_PROFILE', 'SQLITE_PROFILE', str),
+    ('OBAR_DB_POOL_SIZE', 'DB_POOL_SIZE', int),
+    ('OBAR_DB_MAX_OVERFLOW', 'DB_MAX_OVERFLOW', int),
+    ('OBAR_DB_POOL_TIMEOUT', 'DB_POOL_TIMEOUT', int),
+    ('OBAR_DB_POOL_RECYCLE', 'DB_POOL_RECYCLE', int),
+    ('OBAR_DB_POOL_PRE_PING', 'DB_POOL_PRE_PING', _boolean),
+    ('OBAR_DB_STATEMENT_TIMEOUT', 'DB_STATEMENT_TIMEOUT', int),
+    ('OBAR_PIN_HASH_METHOD', 'PIN_HASH_METHOD', str),
+    ('OBAR_JWT_SECRET_KEY', 'JWT_SECRET_KEY', str),
+    ('OBAR_JWT_EXPIRATION', 'JWT_EXPIRATION', int),
+    ('OBAR_REVOCATION_CACHE', 'REVOCATION_CACHE', str),
+    ('OBAR_REVOCATION_CACHE_URL', 'REVOCATION_CACHE_URL', str),
+    ('OBAR_INSTRUMENTATION', 'INSTRUMENTATION', _boolean),
+    ('OBAR_INSTRUMENTATION_METRICS_TOKEN', 'INSTRUMENTATION_METRICS_TOKEN', str)
+)
+
+
+def get_config(name=None):
+    """
+    Returns the configuration class with the given name, development if None
+    """
+    name = name or 'development'
+    if name not in CONFIGS:
+        raise ValueError('Unknown OBAR_CONFIG: ' + name)
+    return CONFIGS[name]
+
+
+def from_environment(config, environ=os.environ):
+    """
+    Applies the OBAR_* environment variables to the configuration
+    """
+    for variable, setting, parse in ENVIRONMENT:
+        if environ.get(variable):
+            try:
+                config[setting] = parse(environ[variable])
+            except ValueError:
+                raise ValueError('Invalid value for ' + variable + ': ' + environ[variable])
+
+
+def engine_options(config):
+    """
+    Returns the SQLALCHEMY_ENGINE_OPTIONS matching the DB_* settings,
+    the options given explicitly in SQLALCHEMY_ENGINE_OPTIONS take precedence
+    """
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    backend = make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name()
+    # SQLite connections are not kept in a QueuePool, see the SQLite profiles instead
+    if backend == 'sqlite':
+        return options
+
+    for setting, option in (('DB_POOL_SIZE', 'pool_size'),
+                            ('DB_MAX_OVERFLOW', 'max_overflow'),
+                            ('DB_POOL_TIMEOUT', 'pool_timeout'),
+                            ('DB_POOL_RECYCLE', 'pool_recycle')):
+        if config.get(setting) is not None:
+            options.setdefault(option, config[setting])
+    if config.get('DB_POOL_PRE_PING'):
+        options.setdefault('pool_pre_ping', True)
+
+    timeout = config.get('DB_STATEMENT_TIMEOUT')
+    if timeout:
+        connect_args = dict(options.get('connect_args', {}))
+        if backend == 'postgresql':
+            connect_args['options'] = (connect_args.get('options', '') +
+                                       ' -c statement_timeout={:d}'.format(timeout)).strip()
+        elif backend == 'mysql':
+            connect_args.setdefault('init_command', 'SET SESSION max_execution_time={:d}'.format(timeout))
+        options['connect_args'] = connect_args
+    return options
+
+
+def check(config):
+    """
+    Raises a RuntimeError if a required setting is missing
+    """
+    for setting in ('SECRET_KEY', 'JWT_SECRET_KEY', 'SQLALCHEMY_DATABASE_URI'):
+        if not config.get(setting):
+            raise RuntimeError(setting + ' is not configured')
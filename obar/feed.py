@@ -0,0 +1,144 @@
+"""
+Feed of the recent purchases shown by the kiosk displays.
+Checkout, gift and undo publish their changes to an in-process ring buffer
+once committed, so that the displays are served from memory, either by
+polling the snapshot or by subscribing to the server-sent events stream.
+The buffer is local to each worker process: it is reloaded from the database
+when older than a few seconds, so that it also follows the purchases, gifts
+and undos of the other workers.
+"""
+
+import datetime
+import threading
+from collections import OrderedDict, deque
+
+from flask import current_app
+
+PURCHASE = 'purchase'
+REMOVE = 'remove'
+
+
+class PurchaseFeed(object):
+    """In-process feed of the recent purchases
+    Keeps the purchases performed in the last `window` seconds and the
+    last `size` events published, numbered by an increasing sequence.
+    The purchases are reloaded when older than `ttl` seconds.
+    Purchases are dicts holding at least their code and date.
+    """
+
+    def __init__(self, window=120, size=1000, ttl=2, clock=datetime.datetime.utcnow):
+        self.window = datetime.timedelta(seconds=window)
+        self.ttl = ttl
+        self.sequence = 0
+        self.loaded_on = None
+        self._clock = clock
+        self._purchases = OrderedDict()
+        self._events = deque(maxlen=size)
+        self._condition = threading.Condition()
+        self._load_lock = threading.Lock()
+
+    def _fresh(self):
+        return self.loaded_on is not None and self._clock() - self.loaded_on < datetime.timedelta(seconds=self.ttl)
+
+    def load(self, loader):
+        """
+        Reloads the purchases from the loader if the last load is older than
+        `ttl` seconds, publishing the purchases added or withdrawn meanwhile
+        as events. A single thread loads at a time, the others keep reading
+        the previous purchases, unless nothing was loaded yet.
+        :param loader: function returning the purchases performed after the given date
+        """
+        if self._fresh():
+            return
+        if not self._load_lock.acquire(blocking=self.loaded_on is None):
+            return
+        try:
+            if self._fresh():
+                return
+            with self._condition:
+                sequence = self.sequence
+                loaded_on = self._clock()
+            # the database is queried without holding the lock of the publishers
+            purchases = OrderedDict((purchase['code'], purchase) for purchase in loader(loaded_on - self.window))
+            with self._condition:
+                # the events published during the load are more recent than the loaded purchases
+                published = {data['code'] for number, _, data in self._events if number > sequence}
+                if self.loaded_on is None:
+                    for code, purchase in purchases.items():
+                        if code not in published:
+                            self._purchases[code] = purchase
+                else:
+                    limit = loaded_on - self.window
+                    for code in [code for code, purchase in self._purchases.items()
+                                 if code not in purchases and code not in published and purchase['date'] > limit]:
+                        self._append(REMOVE, {'code': code})
+                    for code, purchase in purchases.items():
+                        if code not in self._purchases and code not in published:
+                            self._append(PURCHASE, purchase)
+                self._purchases = OrderedDict(sorted(self._purchases.items(), key=lambda entry: entry[1]['date']))
+                self.loaded_on = loaded_on
+                self._condition.notify_all()
+        finally:
+            self._load_lock.release()
+
+    def publish(self, event, data):
+        """
+        Publishes an event and wakes up the subscribers
+        :param event: PURCHASE to add a purchase, REMOVE to withdraw the purchase with the given code
+        """
+        with self._condition:
+            self._append(event, data)
+            self._condition.notify_all()
+
+    def _append(self, event, data):
+        if event == PURCHASE:
+            self._purchases[data['code']] = data
+        else:
+            self._purchases.pop(data['code'], None)
+        self.sequence += 1
+        self._events.append((self.sequence, event, data))
+
+    def snapshot(self):
+        """
+        :return: the sequence number of the last event and the purchases in the window, oldest first
+        """
+        with self._condition:
+            limit = self._clock() - self.window
+            while self._purchases and next(iter(self._purchases.values()))['date'] <= limit:
+                self._purchases.popitem(last=False)
+            return self.sequence, list(self._purchases.values())
+
+    def wait(self, after, timeout=None):
+        """
+        Waits until events are published after the given sequence number
+        :return: the (sequence, event, data) tuples published after it, an empty
+        list on timeout, None if some of them are no longer buffered
+        """
+        with self._condition:
+            if after > self.sequence:
+                return None
+            self._condition.wait_for(lambda: self.sequence > after, timeout)
+            if after < self.sequence - len(self._events):
+                return None
+            return [event for event in self._events if event[0] > after]
+
+
+def init_app(app):
+    """
+    Configures the recent purchases feed of the application, holding the
+    purchases of the last RECENT_PURCHASES_WINDOW seconds (120 by default)
+    and reloading them at most once every RECENT_PURCHASES_RELOAD seconds
+    (2 by default)
+    """
+    feed = PurchaseFeed(window=app.config.get('RECENT_PURCHASES_WINDOW', 120),
+                        size=app.config.get('RECENT_PURCHASES_FEED_SIZE', 1000),
+                        ttl=app.config.get('RECENT_PURCHASES_RELOAD', 2))
+    app.extensions['purchase_feed'] = feed
+    return feed
+
+
+def get_purchase_feed():
+    """
+    Returns the recent purchases feed of the current application
+    """
+    return current_app.extensions['purchase_feed']
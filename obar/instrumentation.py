@@ -0,0 +1,220 @@
+"""
+Opt-in instrumentation of the requests, enabled by INSTRUMENTATION.
+For each request it measures the number of SQL statements, the time spent
+in the database, in the handler and in the serialization of the response.
+The measures are sent back in the Server-Timing header and aggregated per
+endpoint in the Prometheus text format served by /metrics to the admins and
+to the scrapers presenting INSTRUMENTATION_METRICS_TOKEN. Requests
+executing the same statement INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times or
+more are logged as probable N+1 query patterns.
+The metrics are kept in memory, separately by each worker process.
+"""
+
+import hmac
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from obar.apis.decorator.auth_decorator import admin_token_required
+from obar.models import db
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestMetrics(object):
+    """Measures of the request being served, durations in seconds"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = Counter()
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+
+    @property
+    def statement_count(self):
+        return sum(self.statements.values())
+
+
+class MetricsRegistry(object):
+    """Aggregates the request measures per endpoint and method"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._requests = Counter()
+        self._endpoints = dict()
+
+    def record(self, endpoint, method, status, duration, metrics, n_plus_one):
+        with self._lock:
+            self._requests[(endpoint, method, str(status))] += 1
+            stats = self._endpoints.get((endpoint, method))
+            if stats is None:
+                stats = self._endpoints[(endpoint, method)] = {
+                    'buckets': [0] * len(self.buckets),
+                    'count': 0,
+                    'duration': 0.0,
+                    'statements': 0,
+                    'db': 0.0,
+                    'serialization': 0.0,
+                    'n_plus_one': 0
+                }
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    stats['buckets'][index] += 1
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['statements'] += metrics.statement_count
+            stats['db'] += metrics.db_time
+            stats['serialization'] += metrics.serialization_time
+            stats['n_plus_one'] += int(n_plus_one)
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            requests = sorted(self._requests.items())
+            endpoints = sorted((key, dict(stats, buckets=list(stats['buckets'])))
+                               for key, stats in self._endpoints.items())
+        lines = ['# HELP obar_requests_total Requests served',
+                 '# TYPE obar_requests_total counter']
+        for (endpoint, method, status), count in requests:
+            lines.append('obar_requests_total{{{}}} {}'.format(
+                _labels(endpoint=endpoint, method=method, status=status), count))
+
+        lines += ['# HELP obar_request_duration_seconds Time spent serving the requests',
+                  '# TYPE obar_request_duration_seconds histogram']
+        for (endpoint, method), stats in endpoints:
+            for bound, count in zip(self.buckets, stats['buckets']):
+                lines.append('obar_request_duration_seconds_bucket{{{}}} {}'.format(
+                    _labels(endpoint=endpoint, method=method, le=repr(bound)), count))
+            lines.append('obar_request_duration_seconds_bucket{{{}}} {}'.format(
+                _labels(endpoint=endpoint, method=method, le='+Inf'), stats['count']))
+            labels = _labels(endpoint=endpoint, method=method)
+            lines.append('obar_request_duration_seconds_sum{{{}}} {!r}'.format(labels, stats['duration']))
+            lines.append('obar_request_duration_seconds_count{{{}}} {}'.format(labels, stats['count']))
+
+        for name, key, kind, description in (
+                ('obar_db_statements_total', 'statements', 'counter', 'SQL statements executed'),
+                ('obar_db_duration_seconds_total', 'db', 'counter', 'Time spent executing SQL statements'),
+                ('obar_serialization_duration_seconds_total', 'serialization', 'counter',
+                 'Time spent serializing the responses'),
+                ('obar_n_plus_one_total', 'n_plus_one', 'counter', 'Requests flagged as probable N+1 patterns')):
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} {}'.format(name, kind)]
+            for (endpoint, method), stats in endpoints:
+                lines.append('{}{{{}}} {!r}'.format(name, _labels(endpoint=endpoint, method=method), stats[key]))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                     .replace('\n', '\\n'))
+                    for name, value in sorted(labels.items()))
+
+
+def _current_metrics():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # the start time lives and dies with the execution, failed statements leave nothing behind
+    if context is not None:
+        context._query_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_start_time', None)
+    metrics = _current_metrics()
+    if metrics is not None and started is not None:
+        metrics.db_time += time.perf_counter() - started
+        metrics.statements[statement] += 1
+
+
+def _timed_representation(representation):
+    @wraps(representation)
+    def represent(data, code, headers=None):
+        metrics = _current_metrics()
+        started = time.perf_counter()
+        try:
+            return representation(data, code, headers)
+        finally:
+            if metrics is not None:
+                metrics.serialization_time += time.perf_counter() - started
+    return represent
+
+
+def _start_request():
+    g.request_metrics = RequestMetrics()
+
+
+def _finish_request(response):
+    metrics = g.get('request_metrics')
+    if metrics is None:
+        return response
+    duration = time.perf_counter() - metrics.started
+    endpoint = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+
+    threshold = current_app.config.get('INSTRUMENTATION_N_PLUS_ONE_THRESHOLD', 10)
+    repeated = [(statement, count) for statement, count in metrics.statements.items() if count >= threshold]
+    for statement, count in repeated:
+        current_app.logger.warning('Probable N+1 queries on %s %s, statement executed %d times: %s',
+                                   request.method, endpoint, count, statement)
+
+    response.headers.add('Server-Timing', 'db;dur={:.3f};desc="{} statements"'.format(
+        metrics.db_time * 1000, metrics.statement_count))
+    response.headers.add('Server-Timing', 'handler;dur={:.3f}'.format(
+        (duration - metrics.serialization_time) * 1000))
+    response.headers.add('Server-Timing', 'serialize;dur={:.3f}'.format(metrics.serialization_time * 1000))
+    response.headers.add('Server-Timing', 'total;dur={:.3f}'.format(duration * 1000))
+    current_app.extensions['instrumentation'].record(endpoint, request.method, response.status_code,
+                                                     duration, metrics, bool(repeated))
+    return response
+
+
+def _render_metrics():
+    return Response(current_app.extensions['instrumentation'].render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+_admin_metrics = admin_token_required(_render_metrics)
+
+
+def _metrics():
+    """Serves the metrics to the scrapers sending the bearer token of the configuration, or to the admins"""
+    token = current_app.config.get('INSTRUMENTATION_METRICS_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                     'Bearer {}'.format(token).encode()):
+        return _render_metrics()
+    return _admin_metrics()
+
+
+def init_app(app, api=None):
+    """
+    Instruments the application if INSTRUMENTATION is set.
+    :param api: the flask-restplus Api, whose representations are timed as serialization
+    :return: the metrics registry, None if the instrumentation is disabled
+    """
+    if not app.config.get('INSTRUMENTATION', False):
+        return None
+    registry = MetricsRegistry(app.config.get('INSTRUMENTATION_BUCKETS', DEFAULT_BUCKETS))
+    app.extensions['instrumentation'] = registry
+
+    with app.app_context():
+        engine = db.get_engine(app)
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    if api is not None:
+        for mediatype, representation in list(api.representations.items()):
+            api.representations[mediatype] = _timed_representation(representation)
+    if app.config.get('INSTRUMENTATION_METRICS_ENDPOINT', True):
+        app.add_url_rule('/metrics', 'metrics', _metrics)
+    return registry
@@ -9,5 +9,11 @@ from .models import Purchase
 from .models import PurchaseItem
 from .models import Product
 from .models import ProductImage
+from .models import ProductImageVariant
 from .models import BlacklistToken
-from .models import Site
\ No newline at end of file
+from .models import Site
+from .models import CustomerSales
+from .models import ProductSales
+from .models import DailySales
+from .models import CatalogVersion
+from .models import ProductChange
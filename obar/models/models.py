@@ -1,13 +1,15 @@
 import datetime
+import hashlib
 import jwt
 import uuid
+from flask import current_app, has_app_context
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import check_password_hash, generate_password_hash, DEFAULT_PBKDF2_ITERATIONS
 
-db = SQLAlchemy()
+from obar.cache import get_revocation_cache
+from obar.storage import get_image_storage
 
-# FIXME: This key should be put either in Config file or in some environment variable
-key = 'DUMMY_SECRET_KEY'
+db = SQLAlchemy()
 
 
 class Purchase(db.Model):
@@ -21,6 +23,10 @@ class Purchase(db.Model):
     purchase_gifted = db.Column(db.Boolean(), default=False)
     purchase_customer_mail_address = db.Column(db.String(), db.ForeignKey('customer.customer_mail_address'))
     purchase_item = db.relationship('PurchaseItem', backref='Purchase')
+    # time windows (recent purchases, reports) and pages ordered by date
+    db.Index('ix_purchase_date', purchase_date, purchase_code_uuid)
+    # purchases of a customer, ordered by date
+    db.Index('ix_purchase_customer_date', purchase_customer_mail_address, purchase_date, purchase_code_uuid)
 
     def __repr__(self):
         return '<Purchase {}{} >'.format(self.purchase_code_uuid, self.purchase_customer_mail_address)
@@ -47,12 +53,35 @@ class Customer(db.Model):
 
     def __init__(self, customer_mail_address, customer_pin_hash, customer_first_name, customer_last_name):
         self.customer_mail_address = customer_mail_address
-        self.customer_pin_hash = generate_password_hash(customer_pin_hash)
+        self.customer_pin_hash = Customer.hash_pin(customer_pin_hash)
         self.customer_last_name = customer_last_name
         self.customer_first_name = customer_first_name
 
+    @staticmethod
+    def pin_hash_method():
+        """
+        Returns the PIN hashing method configured by PIN_HASH_METHOD, as stored
+        at the beginning of the hashes (e.g. pbkdf2:sha256:150000)
+        """
+        method = 'pbkdf2:sha256'
+        if has_app_context():
+            method = current_app.config.get('PIN_HASH_METHOD', method)
+        if method.startswith('pbkdf2:') and method.count(':') == 1:
+            method += ':{:d}'.format(DEFAULT_PBKDF2_ITERATIONS)
+        return method
+
+    @staticmethod
+    def hash_pin(pin):
+        return generate_password_hash(pin, method=Customer.pin_hash_method())
+
     def set_password(self, passwd):
-        self.customer_pin_hash = generate_password_hash(passwd)
+        self.customer_pin_hash = Customer.hash_pin(passwd)
+
+    def needs_rehash(self):
+        """
+        :return boolean: True if the PIN hash was computed with another method than the configured one
+        """
+        return self.customer_pin_hash.split('$', 1)[0] != Customer.pin_hash_method()
 
     def check_password(self, pin):
         """Hash comparator
@@ -68,8 +97,9 @@ class Customer(db.Model):
     def encode_auth_token(self):
         try:
             payload = {
-                'exp': datetime.datetime.utcnow() + datetime.timedelta(days=1, seconds=5),
+                'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=current_app.config['JWT_EXPIRATION']),
                 'iat': datetime.datetime.utcnow(),
+                'jti': uuid.uuid4().hex,
                 'sub': self.customer_mail_address,
                 'firstName': self.customer_first_name,
                 'lastName': self.customer_last_name,
@@ -78,8 +108,8 @@ class Customer(db.Model):
 
             return jwt.encode(
                 payload,
-                key,
-                algorithm='HS256'
+                current_app.config['JWT_SECRET_KEY'],
+                algorithm=current_app.config['JWT_ALGORITHM']
             )
         except Exception as e:
             return e
@@ -92,8 +122,10 @@ class Customer(db.Model):
         :return: integer|string
         """
         try:
-            payload = jwt.decode(auth_token, key, algorithms='HS256')
-            is_blacklist_token = BlacklistToken.check_blacklist(auth_token)
+            payload = jwt.decode(auth_token, current_app.config['JWT_SECRET_KEY'],
+                                 algorithms=[current_app.config['JWT_ALGORITHM']])
+            token_digest = BlacklistToken.digest(auth_token, payload)
+            is_blacklist_token = BlacklistToken.check_blacklist(token_digest)
             if is_blacklist_token:
                 return {
                     'status': 'fail',
@@ -103,7 +135,9 @@ class Customer(db.Model):
                 return {
                     'status': 'success',
                     'customer': payload['sub'],
-                    'admin': payload['admin']
+                    'admin': payload['admin'],
+                    'token_digest': token_digest,
+                    'expires_on': datetime.datetime.utcfromtimestamp(payload['exp'])
                 }
         except jwt.ExpiredSignatureError:
             return {
@@ -133,6 +167,8 @@ class Product(db.Model):
     purchaseItem = db.relationship('PurchaseItem', backref='Product')
     productImage = db.relationship('ProductImage', backref='Product', uselist=False)
     db.UniqueConstraint(product_name, product_location_id, name='unq_product')
+    # products of a site, ordered by code
+    db.Index('ix_product_location', product_location_id, product_code_uuid)
 
     def __init__(self,
                  product_name, product_availability, product_discount,
@@ -161,14 +197,20 @@ class PurchaseItem(db.Model):
     purchase_item_price = db.Column(db.Float())
     purchase_item_product_code_uuid = db.Column(db.String(), db.ForeignKey('product.product_code_uuid'))
     purchase_item_purchase_code_uuid = db.Column(db.String(), db.ForeignKey('purchase.purchase_code_uuid'))
+    db.Index('ix_purchase_item_purchase', purchase_item_purchase_code_uuid)
+    db.Index('ix_purchase_item_product', purchase_item_product_code_uuid)
 
-    def __init__(self, purchase_item_quantity, purchase_item_product_code_uuid, purchase_item_purchase_code_uuid):
+    def __init__(self, purchase_item_quantity, purchase_item_product_code_uuid, purchase_item_purchase_code_uuid,
+                 product=None):
         # Generates a UUID for the Purchase Item
         self.purchase_item_uuid = uuid.uuid4().hex
         self.purchase_item_purchase_code_uuid = purchase_item_purchase_code_uuid
         self.purchase_item_product_code_uuid = purchase_item_product_code_uuid
         self.purchase_item_quantity = purchase_item_quantity
-        product = Product.query.filter_by(product_code_uuid=purchase_item_product_code_uuid).first()
+        # The product can be passed by callers that already loaded it,
+        # sparing a query to compute the price
+        if product is None:
+            product = Product.query.filter_by(product_code_uuid=purchase_item_product_code_uuid).first()
         self.purchase_item_price = (1 - product.product_discount/100) * product.product_price * purchase_item_quantity
 
     def __repr__(self):
@@ -177,42 +219,125 @@ class PurchaseItem(db.Model):
 
 class ProductImage(db.Model):
     """Product Image model
-    Represents the relative path of images stored for each product
+    Represents the metadata of the image of a product, whose binary
+    is kept in the image storage under its SHA-256 digest
     """
     __tablename__ = 'product_image'
 
-    product_image_binary = db.Column(db.LargeBinary())
     product_image_filename = db.Column(db.String(), primary_key=True)
+    product_image_digest = db.Column(db.String(64))
+    product_image_updated_on = db.Column(db.DateTime())
     product_image_product_code_uuid = db.Column(db.String(), db.ForeignKey('product.product_code_uuid'))
     product = db.relationship('Product', backref='ProductImage')
 
     def __repr__(self):
         return '<ProductImage {}>'.format(self.product_image_filename)
 
+    def set_binary(self, binary):
+        """
+        Stores the image binary in the image storage, keeping its digest,
+        also used as ETag by the image endpoints
+        """
+        self.product_image_digest = ProductImage.save_binary(binary)
+        self.product_image_updated_on = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def get_binary(self):
+        return get_image_storage().read(self.product_image_digest)
+
+    @staticmethod
+    def save_binary(binary):
+        """
+        Stores a binary in the image storage, remembering its digest in the
+        session so that it is released again if the transaction fails
+        :return: the SHA-256 digest of the binary
+        """
+        digest = get_image_storage().save(binary)
+        db.session.info.setdefault('saved_image_digests', set()).add(digest)
+        return digest
+
+    @staticmethod
+    def release_binary(digest):
+        """
+        Deletes a binary from the image storage if no image or image variant
+        references it anymore.
+        Must be called after committing the removal of the reference.
+        """
+        if digest is None:
+            return
+        if ProductImage.query.filter_by(product_image_digest=digest).first() is not None:
+            return
+        if ProductImageVariant.query.filter_by(product_image_variant_digest=digest).first() is not None:
+            return
+        get_image_storage().delete(digest)
+
+
+class ProductImageVariant(db.Model):
+    """Product Image Variant model
+    Represents a resized copy of the image of a product, kept in the
+    image storage under its SHA-256 digest
+    """
+    __tablename__ = 'product_image_variant'
+
+    product_image_variant_product_code_uuid = db.Column(db.String(), db.ForeignKey('product.product_code_uuid'),
+                                                        primary_key=True)
+    product_image_variant_size = db.Column(db.String(), primary_key=True)
+    product_image_variant_digest = db.Column(db.String(64))
+    product_image_variant_mimetype = db.Column(db.String())
+    product_image_variant_width = db.Column(db.Integer())
+    product_image_variant_height = db.Column(db.Integer())
+
+    def __repr__(self):
+        return '<ProductImageVariant {} {}>'.format(self.product_image_variant_product_code_uuid,
+                                                    self.product_image_variant_size)
+
 
 class BlacklistToken(db.Model):
     """Blacklist of JWT tokens
-    Token model of JNW expired tokens
+    Stores a fixed-size digest of the revoked tokens until they expire
     """
 
     id = db.Column(db.Integer(), primary_key=True, autoincrement=True)
-    token = db.Column(db.String(500), unique=True, nullable=False)
+    token_digest = db.Column(db.String(64), unique=True, nullable=False)
+    expires_on = db.Column(db.DateTime, nullable=False, index=True)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
 
-    def __init__(self, token):
-        self.token = token
+    def __init__(self, token_digest, expires_on):
+        self.token_digest = token_digest
+        self.expires_on = expires_on
         self.blacklisted_on = datetime.datetime.now()
 
     def __repr__(self):
-        return '<id: token: {}>'.format(self.token)
+        return '<id: token: {}>'.format(self.token_digest)
 
     @staticmethod
-    def check_blacklist(auth_token):
-        res = BlacklistToken.query.filter_by(token=str(auth_token)).first()
-        if res:
-            return True
-        else:
-            return False
+    def digest(auth_token, payload):
+        """
+        Returns the blacklist key of a token: the SHA-256 digest of its jti,
+        or of the whole token for the tokens issued without a jti
+        """
+        token_id = payload['jti'] if 'jti' in payload else str(auth_token)
+        return hashlib.sha256(token_id.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def check_blacklist(token_digest):
+        cache = get_revocation_cache()
+        cached = cache.get(token_digest)
+        if cached is not None:
+            return cached
+        res = BlacklistToken.query.filter_by(token_digest=token_digest).first() is not None
+        cache.set(token_digest, res)
+        return res
+
+    @staticmethod
+    def purge_expired():
+        """
+        Deletes the entries of the tokens already expired, which are
+        rejected by their signature check anyway
+        :return: the number of deleted entries
+        """
+        return BlacklistToken.query \
+            .filter(BlacklistToken.expires_on < datetime.datetime.utcnow()) \
+            .delete(synchronize_session=False)
 
 
 class Site(db.Model):
@@ -228,3 +353,118 @@ class Site(db.Model):
     site_country = db.Column(db.String())
     db.UniqueConstraint(site_address, site_city, name='unq_site')
     product = db.relationship('Product', backref='Site')
+
+
+class CustomerSales(db.Model):
+    """Customer sales counter
+    Running total of the items purchased by a customer, maintained together
+    with purchases so that the leaderboard does not scan the purchase history
+    """
+    __tablename__ = 'customer_sales'
+
+    customer_sales_mail_address = db.Column(db.String(), primary_key=True)
+    customer_sales_items = db.Column(db.Integer(), nullable=False, default=0)
+
+    def __repr__(self):
+        return '<CustomerSales {} {}>'.format(self.customer_sales_mail_address, self.customer_sales_items)
+
+
+class ProductSales(db.Model):
+    """Product sales counter
+    Running totals of units, revenue and purchases of a product
+    """
+    __tablename__ = 'product_sales'
+
+    product_sales_code_uuid = db.Column(db.String(), primary_key=True)
+    product_sales_units = db.Column(db.Integer(), nullable=False, default=0)
+    product_sales_revenue = db.Column(db.Float(), nullable=False, default=0)
+    product_sales_purchases = db.Column(db.Integer(), nullable=False, default=0)
+
+    def __repr__(self):
+        return '<ProductSales {} {}>'.format(self.product_sales_code_uuid, self.product_sales_units)
+
+
+class DailySales(db.Model):
+    """Daily sales counter
+    Running totals of items, revenue and purchases of a single day
+    """
+    __tablename__ = 'daily_sales'
+
+    daily_sales_day = db.Column(db.Date(), primary_key=True)
+    daily_sales_items = db.Column(db.Integer(), nullable=False, default=0)
+    daily_sales_revenue = db.Column(db.Float(), nullable=False, default=0)
+    daily_sales_purchases = db.Column(db.Integer(), nullable=False, default=0)
+
+    def __repr__(self):
+        return '<DailySales {} {}>'.format(self.daily_sales_day, self.daily_sales_items)
+
+
+class CatalogVersion(db.Model):
+    """Catalog version
+    Single row counting the catalog edits, incremented by the transactions
+    creating, updating or deleting products so that their changes are logged
+    in commit order. The stock movements do not increment it.
+    """
+    __tablename__ = 'catalog_version'
+
+    catalog_version_id = db.Column(db.Integer(), primary_key=True)
+    catalog_version_number = db.Column(db.Integer(), nullable=False, default=0)
+    # sequence number of the last product change purged from the log
+    catalog_version_purged_sequence = db.Column(db.Integer(), nullable=False, default=0)
+
+    def __repr__(self):
+        return '<CatalogVersion {}>'.format(self.catalog_version_number)
+
+    @staticmethod
+    def current():
+        """
+        :return: the number of catalog edits, 0 if the catalog was never edited
+        """
+        return db.session.query(CatalogVersion.catalog_version_number) \
+            .filter(CatalogVersion.catalog_version_id == 1) \
+            .scalar() or 0
+
+    @staticmethod
+    def bump():
+        """
+        Increments the version of the catalog.
+        Must be called in the transaction editing the products, preferably right
+        before its commit since the row stays locked until then.
+        """
+        table = CatalogVersion.__table__
+        updated = db.session.execute(table.update()
+                                     .where(table.c.catalog_version_id == 1)
+                                     .values(catalog_version_number=table.c.catalog_version_number + 1))
+        if updated.rowcount == 0:
+            db.session.execute(table.insert().values(catalog_version_id=1, catalog_version_number=1,
+                                                     catalog_version_purged_sequence=0))
+
+
+class ProductChange(db.Model):
+    """Product change log
+    Records the creations, updates, deletions and stock movements of the
+    products, numbered by an increasing sequence, so that the kiosks can
+    fetch the changes since the last one they applied. Only the last stock
+    movement of each product is kept.
+    """
+    __tablename__ = 'product_change'
+    # the sequence numbers of deleted rows are never reused
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    product_change_sequence = db.Column(db.Integer(), primary_key=True, autoincrement=True)
+    product_change_date = db.Column(db.DateTime(), nullable=False)
+    product_change_product_code_uuid = db.Column(db.String(), nullable=False)
+    product_change_operation = db.Column(db.String(), nullable=False)
+    # JSON of the product fields after the change, null for deletions
+    product_change_data = db.Column(db.Text())
+
+    def __repr__(self):
+        return '<ProductChange {} {} {}>'.format(self.product_change_sequence, self.product_change_operation,
+                                                 self.product_change_product_code_uuid)
+
+    @staticmethod
+    def last_sequence():
+        """
+        :return: the sequence number of the last change, 0 if no change was logged
+        """
+        return db.session.query(db.func.max(ProductChange.product_change_sequence)).scalar() or 0
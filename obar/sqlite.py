@@ -0,0 +1,86 @@
+"""
+SQLite connection profiles.
+The pragmas of the profile selected by SQLITE_PROFILE are executed on every
+new SQLite connection, followed by the ones given in SQLITE_PRAGMAS.
+The production profile switches the database to write-ahead logging, so
+that readers and the writer no longer block each other, and waits for locks
+instead of failing with `database is locked`.
+"""
+
+from collections import OrderedDict
+from sqlite3 import Connection as SQLite3Connection
+
+from sqlalchemy import event
+
+from obar.models import db
+
+SQLITE_PROFILES = {
+    # rollback journal, the SQLite defaults
+    'default': OrderedDict([
+        ('foreign_keys', 'ON')
+    ]),
+    'production': OrderedDict([
+        ('foreign_keys', 'ON'),
+        # the journal mode is stored in the database file, it must be set first
+        ('journal_mode', 'WAL'),
+        # milliseconds waited for a lock before failing
+        ('busy_timeout', 5000),
+        # durable across application crashes, a power loss may lose the last commits
+        ('synchronous', 'NORMAL'),
+        # negative sizes are in KiB
+        ('cache_size', -20000),
+        ('mmap_size', 268435456),
+        ('temp_store', 'MEMORY')
+    ])
+}
+
+
+def sqlite_pragmas(config):
+    """
+    Returns the pragmas to execute on each connection, in order
+    """
+    profile = config.get('SQLITE_PROFILE', 'default')
+    if profile not in SQLITE_PROFILES:
+        raise ValueError('Unknown SQLITE_PROFILE: ' + str(profile))
+    pragmas = OrderedDict(SQLITE_PROFILES[profile])
+    pragmas.update(config.get('SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def migration_pragmas(config):
+    """
+    Returns the pragmas to execute on the connections of the migrations: the
+    performance pragmas of the profile, without the journal mode switch and
+    with the foreign key checks off, since the batch operations rebuild the
+    tables by copying, dropping and renaming them
+    """
+    pragmas = OrderedDict([('foreign_keys', 'OFF')])
+    pragmas.update((name, value) for name, value in sqlite_pragmas(config).items()
+                   if name not in ('foreign_keys', 'journal_mode'))
+    return pragmas
+
+
+def apply_profile(engine, pragmas, logger):
+    """
+    Executes the pragmas on every new SQLite connection of an engine,
+    e.g. the one built by the migrations
+    """
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, SQLite3Connection):
+            logger.info('Setting PRAGMA %s', ', '.join('{}={}'.format(*pragma) for pragma in pragmas.items()))
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA {}={};'.format(name, value))
+            cursor.close()
+
+
+def init_app(app):
+    """
+    Applies the SQLite profile of the application to the connections of its engine
+    """
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        engine = db.get_engine(app)
+    apply_profile(engine, pragmas, app.logger)
+    return pragmas
@@ -0,0 +1,97 @@
+"""
+Storage of the product image files.
+Images are content-addressed: each file is named after the SHA-256 digest
+of its content, so identical uploads share the same file and the database
+only keeps the digest.
+"""
+
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+from flask import current_app
+
+
+class ImageStorage(ABC):
+    """Image storage interface"""
+
+    @abstractmethod
+    def save(self, binary):
+        """
+        Stores the binary if not already present
+        :return: the SHA-256 digest identifying the binary
+        """
+
+    @abstractmethod
+    def read(self, digest):
+        """
+        :return: the binary identified by the digest
+        """
+
+    def path(self, digest):
+        """
+        :return: the path of the file on the local filesystem, None if the
+        storage does not keep local files
+        """
+        return None
+
+    @abstractmethod
+    def delete(self, digest):
+        """
+        Deletes the binary identified by the digest, if present
+        """
+
+
+class LocalImageStorage(ImageStorage):
+    """Image storage on a local directory
+    Files are spread over sub-directories named after the first two
+    characters of the digest.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def save(self, binary):
+        digest = hashlib.sha256(binary).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Writes to a temporary file first, so that readers never see partial files
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(binary)
+            os.replace(temp_path, path)
+        return digest
+
+    def read(self, digest):
+        with open(self.path(digest), 'rb') as image_file:
+            return image_file.read()
+
+    def delete(self, digest):
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def init_app(app, basedir):
+    """
+    Configures the image storage of the application, stored under
+    PRODUCT_IMAGE_STORAGE_DIR (persistent/images by default)
+    """
+    root = app.config.get('PRODUCT_IMAGE_STORAGE_DIR', os.path.join(basedir, 'persistent', 'images'))
+    storage = LocalImageStorage(root)
+    app.extensions['image_storage'] = storage
+    return storage
+
+
+def get_image_storage():
+    """
+    Returns the image storage of the current application
+    """
+    return current_app.extensions['image_storage']
@@ -0,0 +1,95 @@
+import datetime
+import unittest
+from unittest import mock
+from flask import g
+from flask_testing import TestCase
+
+import jwt
+
+from obar import create_app
+from obar.models import db, Customer
+
+
+class TestAuthDecorator(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        self.customer = Customer('foo@test.com', '12345', 'foo', 'bar')
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add_all([self.customer, admin])
+        db.session.commit()
+        self.token = self.customer.encode_auth_token().decode()
+        self.admin_token = admin.encode_auth_token().decode()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def get_customer(self, token):
+        headers = {'Authorization': token} if token is not None else {}
+        return self.client.get('/customer/foo@test.com', headers=headers)
+
+    def test_identity_is_decoded_once_per_request(self):
+        decode = Customer.decode_auth_token
+        with mock.patch.object(Customer, 'decode_auth_token', side_effect=decode) as decoded:
+            self.assert200(self.get_customer(self.token))
+            self.assertEqual(decoded.call_count, 1)
+            self.assertEqual(g.identity.mail_address, 'foo@test.com')
+            self.assertFalse(g.identity.admin)
+            self.assertEqual(g.identity.token, self.token)
+
+            self.assert200(self.get_customer(self.admin_token))
+            self.assertEqual(decoded.call_count, 2)
+            self.assertEqual(g.identity.mail_address, 'admin@test.com')
+            self.assertTrue(g.identity.admin)
+
+    def test_missing_token(self):
+        response = self.get_customer(None)
+        self.assert401(response)
+        self.assertEqual(response.json, {'message': 'Token is missing'})
+
+    def test_expired_token(self):
+        payload = {
+            'exp': datetime.datetime.utcnow() - datetime.timedelta(seconds=1),
+            'iat': datetime.datetime.utcnow() - datetime.timedelta(seconds=10),
+            'sub': 'foo@test.com',
+            'admin': False
+        }
+        token = jwt.encode(payload, self.app.config['JWT_SECRET_KEY'],
+                           algorithm=self.app.config['JWT_ALGORITHM']).decode()
+        response = self.get_customer(token)
+        self.assert401(response)
+        self.assertEqual(response.json, {'status': 'fail', 'message': 'Signature expired. Please log in again'})
+
+    def test_revoked_token(self):
+        self.assert200(self.client.post('/auth/logout', headers={'Authorization': self.token}))
+        response = self.get_customer(self.token)
+        self.assert401(response)
+        self.assertEqual(response.json, {'status': 'fail', 'message': 'Token blacklisted. Please log in again'})
+
+    def test_malformed_token(self):
+        for token in ('garbage', self.token[:-4]):
+            response = self.get_customer(token)
+            self.assert401(response)
+            self.assertEqual(response.json, {'status': 'fail', 'message': 'Invalid token. Please log in again'})
+
+    def test_admin_token_required(self):
+        response = self.client.delete('/customer/foo@test.com', headers={'Authorization': self.token})
+        self.assert401(response)
+        self.assertEqual(response.json,
+                         {'message': 'Admin token required, please login with an admin account'})
+        self.assert401(self.client.delete('/customer/foo@test.com', headers={'Authorization': 'garbage'}))
+        self.assertEqual(self.client.delete('/customer/foo@test.com',
+                                            headers={'Authorization': self.admin_token}).status_code, 204)
+
+
+if __name__ == '__main__':
+    unittest.main()
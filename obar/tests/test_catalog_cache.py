@@ -0,0 +1,117 @@
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+
+from obar import create_app
+from obar.catalog import CatalogCache
+from obar.models import db, CatalogVersion, Customer, Product, ProductChange, Site
+
+
+class TestCatalogCache(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        db.session.add(Site(site_id=2, site_address='b', site_city='b'))
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add(admin)
+        self.water = Product('water', True, 0, 1.0, 10, 1)
+        db.session.add(self.water)
+        db.session.add(Product('soda', True, 0, 2.0, 5, 2))
+        db.session.commit()
+        self.water_code = self.water.product_code_uuid
+        self.headers = {'Authorization': admin.encode_auth_token().decode()}
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+        db.session.remove()
+        db.drop_all()
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def get_products(self, etag=None, **args):
+        headers = dict(self.headers)
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        return self.client.get('/product', query_string=args, headers=headers)
+
+    def test_unchanged_catalog_costs_no_sql(self):
+        response = self.get_products(location_id=1)
+        self.assert200(response)
+        self.assertEqual([product['name'] for product in response.json], ['water'])
+        etag = response.headers['ETag']
+
+        del self.statements[:]
+        self.assertEqual(self.get_products(etag, location_id=1).status_code, 304)
+        cached = self.get_products(location_id=1)
+        self.assertEqual(cached.json, response.json)
+        self.assertEqual(cached.headers['ETag'], etag)
+        self.assertEqual(self.statements, [])
+
+        # each site has its own page
+        self.assertEqual([product['name'] for product in self.get_products(etag, location_id=2).json], ['soda'])
+
+    def test_product_changes_bump_the_version(self):
+        etag = self.get_products().headers['ETag']
+        response = self.client.put('/product/' + self.water_code, json={'quantity': 3}, headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(CatalogVersion.current(), 1)
+        self.assertEqual(ProductChange.last_sequence(), 1)
+
+        response = self.get_products(etag)
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual({product['name']: product['quantity'] for product in response.json},
+                         {'water': 3, 'soda': 5})
+        etag = response.headers['ETag']
+
+        response = self.client.post('/operation/purchaseProducts',
+                                    json={'purchase_details': [{'product_code': self.water_code,
+                                                                'purchase_quantity': 1}]},
+                                    headers=self.headers)
+        self.assert200(response)
+        # the checkouts change the catalog without locking the catalog version
+        self.assertEqual(CatalogVersion.current(), 1)
+        self.assertEqual(ProductChange.last_sequence(), 2)
+        response = self.get_products(etag)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual({product['name']: product['quantity'] for product in response.json},
+                         {'water': 2, 'soda': 5})
+
+    def test_version_is_read_once_per_ttl(self):
+        now = [0]
+        catalog_cache = CatalogCache(ttl=1, clock=lambda: now[0])
+        loads = []
+
+        def loader():
+            loads.append(now[0])
+            return len(loads)
+
+        self.assertEqual(catalog_cache.version(loader), 1)
+        now[0] = 0.5
+        self.assertEqual(catalog_cache.version(loader), 1)
+        now[0] = 1
+        self.assertEqual(catalog_cache.version(loader), 2)
+        catalog_cache.invalidate()
+        self.assertEqual(catalog_cache.version(loader), 3)
+        self.assertEqual(loads, [0, 1, 1])
+
+        catalog_cache.set(2, 'page', 'old')
+        catalog_cache.set(3, 'page', 'new')
+        self.assertIsNone(catalog_cache.get(2, 'page'))
+        self.assertEqual(catalog_cache.get(3, 'page'), 'new')
+
+
+if __name__ == '__main__':
+    unittest.main()
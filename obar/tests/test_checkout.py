@@ -0,0 +1,70 @@
+import unittest
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.models import db, Customer, Product, Purchase, PurchaseItem, Site
+
+
+class TestCheckout(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        customer = Customer('foo@test.com', '12345', 'foo', 'bar')
+        db.session.add(customer)
+        self.water = Product('water', True, 0, 1.0, 10, 1)
+        self.coffee = Product('coffee', True, 50, 2.0, 5, 1)
+        db.session.add_all([self.water, self.coffee])
+        db.session.commit()
+        self.water_code = self.water.product_code_uuid
+        self.coffee_code = self.coffee.product_code_uuid
+        self.headers = {'Authorization': customer.encode_auth_token().decode()}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def checkout(self, *details):
+        return self.client.post('/operation/purchaseProducts', headers=self.headers, json={
+            'purchase_details': [{'product_code': code, 'purchase_quantity': quantity} for code, quantity in details]
+        })
+
+    def quantities(self):
+        db.session.expire_all()
+        return Product.query.get(self.water_code).product_quantity, Product.query.get(self.coffee_code).product_quantity
+
+    def test_checkout_of_several_products(self):
+        response = self.checkout((self.water_code, 3), (self.coffee_code, 2))
+        self.assert200(response)
+        self.assertEqual(self.quantities(), (7, 3))
+        purchase = Purchase.query.get(response.json['purchase_uuid'])
+        self.assertEqual(purchase.purchase_customer_mail_address, 'foo@test.com')
+        items = {item.purchase_item_product_code_uuid: (item.purchase_item_quantity, item.purchase_item_price)
+                 for item in PurchaseItem.query.all()}
+        self.assertEqual(items, {self.water_code: (3, 3.0), self.coffee_code: (2, 2.0)})
+
+    def test_unknown_product_fails_the_whole_checkout(self):
+        response = self.checkout((self.water_code, 3), ('unknown', 1))
+        self.assert404(response)
+        self.assertIn('unknown', response.json['message'])
+        self.assertEqual(self.quantities(), (10, 5))
+        self.assertEqual(Purchase.query.count(), 0)
+        self.assertEqual(PurchaseItem.query.count(), 0)
+
+    def test_invalid_checkouts(self):
+        self.assertEqual(self.checkout((self.water_code, 1), (self.water_code, 2)).status_code, 422)
+        self.assertEqual(self.checkout((self.water_code, 1), (self.coffee_code, 6)).status_code, 422)
+        self.assertEqual(self.checkout((self.water_code, 0)).status_code, 422)
+        self.assertEqual(self.quantities(), (10, 5))
+        self.assertEqual(Purchase.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+from obar import create_app
+from obar.config import ProductionConfig, engine_options, from_environment
+from obar.models import Customer
+
+
+class TestConfig(unittest.TestCase):
+
+    def test_environment_overrides(self):
+        config = {'DB_POOL_SIZE': None, 'DB_POOL_PRE_PING': False}
+        from_environment(config, {'OBAR_DATABASE_URI': 'postgresql://obar@db/obar',
+                                  'OBAR_DB_POOL_SIZE': '5',
+                                  'OBAR_DB_POOL_PRE_PING': 'true',
+                                  'OBAR_JWT_SECRET_KEY': ''})
+        self.assertEqual(config, {'SQLALCHEMY_DATABASE_URI': 'postgresql://obar@db/obar',
+                                  'DB_POOL_SIZE': 5,
+                                  'DB_POOL_PRE_PING': True})
+        with self.assertRaises(ValueError):
+            from_environment(config, {'OBAR_DB_POOL_SIZE': 'ten'})
+
+    def test_engine_options(self):
+        config = {key: getattr(ProductionConfig, key) for key in dir(ProductionConfig) if key.isupper()}
+        config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://obar@db/obar'
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 4}
+        self.assertEqual(engine_options(config), {
+            'pool_size': 4,
+            'max_overflow': 20,
+            'pool_recycle': 1800,
+            'pool_pre_ping': True,
+            'connect_args': {'options': '-c statement_timeout=30000'}
+        })
+        config['SQLALCHEMY_DATABASE_URI'] = 'mysql://obar@db/obar'
+        self.assertEqual(engine_options(config)['connect_args'],
+                         {'init_command': 'SET SESSION max_execution_time=30000'})
+        # SQLite connections are not pooled
+        config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///obar.db'
+        self.assertEqual(engine_options(config), {'pool_size': 4})
+
+    def test_production_requires_the_secret_keys(self):
+        with mock.patch.dict('os.environ', {'OBAR_CONFIG': 'production'}):
+            with self.assertRaises(RuntimeError):
+                create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+            app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                              'SECRET_KEY': 'secret',
+                              'JWT_SECRET_KEY': 'jwt secret'})
+        self.assertEqual(app.config['SQLITE_PROFILE'], 'production')
+
+    def test_tokens_are_signed_with_the_configured_key(self):
+        customer = Customer('foo@test.com', '12345', 'foo', 'bar')
+        with create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'JWT_SECRET_KEY': 'first'}).app_context():
+            token = customer.encode_auth_token()
+        with create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'JWT_SECRET_KEY': 'second'}).app_context():
+            self.assertEqual(Customer.decode_auth_token(token)['status'], 'fail')
+
+
+if __name__ == '__main__':
+    unittest.main()
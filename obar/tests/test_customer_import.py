@@ -0,0 +1,128 @@
+import unittest
+from unittest import mock
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.commands import import_customers_command
+from obar.models import db, Customer
+from obar.apis.service import customer_service
+from obar.apis.service.customer_service import import_customers, hash_pins
+
+
+class TestCustomerImport(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'PIN_HASH_METHOD': 'pbkdf2:sha256:1000'
+        })
+
+    def setUp(self):
+        db.create_all()
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add(admin)
+        db.session.commit()
+        self.token = admin.encode_auth_token().decode()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_rows_are_validated_and_checked_for_conflicts(self):
+        report = import_customers([
+            {'mail_address': 'foo@test.com', 'pin': 12345, 'first_name': 'foo', 'last_name': 'bar'},
+            {'mail_address': 'admin@test.com', 'pin': 12345, 'first_name': 'foo', 'last_name': 'bar'},
+            {'mail_address': 'foo@test.com', 'pin': 54321, 'first_name': 'foo', 'last_name': 'baz'},
+            {'mail_address': 'bar@test.com', 'pin': 123456, 'first_name': 'bar', 'last_name': 'baz'},
+            {'mail_address': 'baz', 'pin': 1, 'first_name': 'baz', 'last_name': 'baz'},
+            {'mail_address': 'qux@test.com', 'pin': '00042', 'first_name': 'qux', 'last_name': ''},
+            {'mail_address': 'quux@test.com', 'pin': '00042', 'first_name': 'quux', 'last_name': 'quux'}
+        ], batch_size=1)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([result['status'] for result in report['results']],
+                         ['created', 'conflict', 'conflict', 'invalid', 'invalid', 'invalid', 'created'])
+        self.assertEqual(report['results'][2]['message'], 'Duplicate of row 0')
+        self.assertEqual(Customer.query.count(), 3)
+        customer = Customer.query.get('quux@test.com')
+        self.assertTrue(customer.check_password('42'))
+        self.assertFalse(customer.needs_rehash())
+
+    def test_pins_must_be_integers_or_5_digits(self):
+        pins = [12345, 0, '01234', True, 12.9, '  123 ', '1234', '123456', '１２３４５', None, -1]
+        report = import_customers([{'mail_address': 'c{}@test.com'.format(index), 'pin': pin,
+                                    'first_name': 'c', 'last_name': 'c'} for index, pin in enumerate(pins)])
+        self.assertEqual([result['status'] for result in report['results']],
+                         ['created'] * 3 + ['invalid'] * 8)
+        self.assertEqual(report['results'][3]['message'], 'The PIN must be a number')
+        self.assertEqual(report['results'][5]['message'], 'The PIN must be of 5 digits')
+        self.assertTrue(Customer.query.get('c2@test.com').check_password('1234'))
+
+    def test_customers_created_during_the_import_are_conflicts(self):
+        db.session.add_all([Customer('a@test.com', '12345', 'a', 'a'), Customer('b@test.com', '12345', 'b', 'b')])
+        db.session.commit()
+        lookup = customer_service._existing_mail_addresses
+        # the customers are created by other requests after each lookup
+        lookups = iter([set(), {'a@test.com'}])
+
+        def existing(mail_addresses):
+            return next(lookups, None) or lookup(mail_addresses)
+
+        rows = [{'mail_address': '{}@test.com'.format(name), 'pin': 12345, 'first_name': name, 'last_name': name}
+                for name in 'abcd']
+        with mock.patch.object(customer_service, '_existing_mail_addresses', side_effect=existing):
+            report = import_customers(rows, batch_size=10)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([result['status'] for result in report['results']],
+                         ['conflict', 'conflict', 'created', 'created'])
+        self.assertEqual(Customer.query.count(), 5)
+
+    def test_rejected_batches_are_inserted_row_by_row(self):
+        db.session.add(Customer('a@test.com', '12345', 'a', 'a'))
+        db.session.commit()
+        rows = [{'mail_address': '{}@test.com'.format(name), 'pin': 12345, 'first_name': name, 'last_name': name}
+                for name in 'abc']
+        with mock.patch.object(customer_service, '_existing_mail_addresses', return_value=set()):
+            report = import_customers(rows, batch_size=10)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([result['status'] for result in report['results']], ['conflict', 'created', 'created'])
+        self.assertTrue(report['results'][0]['message'].startswith('Rejected by the database'))
+
+    def test_pins_are_hashed_in_worker_processes(self):
+        pins = [str(pin) for pin in range(60)]
+        pin_hashes = hash_pins(pins, workers=2)
+        self.assertEqual(len(pin_hashes), len(pins))
+        self.assertTrue(all(pin_hash.startswith('pbkdf2:sha256:1000$') for pin_hash in pin_hashes))
+        customer = Customer.query.get('admin@test.com')
+        customer.customer_pin_hash = pin_hashes[42]
+        self.assertTrue(customer.check_password('42'))
+
+    def test_csv_upload(self):
+        body = 'mail_address,pin,first_name,last_name\nfoo@test.com,12345,foo,bar\nadmin@test.com,11111,a,b\n'
+        response = self.client.post('/customer/import', data=body, content_type='text/csv',
+                                    headers={'Authorization': self.token})
+        self.assert200(response)
+        self.assertEqual(response.json['created'], 1)
+        self.assertEqual(response.json['results'][1], {'row': 1, 'mail_address': 'admin@test.com',
+                                                        'status': 'conflict',
+                                                        'message': 'The customer already exists'})
+        response = self.client.post('/customer/import', data='mail_address,pin\n', content_type='text/csv',
+                                    headers={'Authorization': self.token})
+        self.assert400(response)
+
+    def test_command(self):
+        runner = self.app.test_cli_runner()
+        with runner.isolated_filesystem():
+            with open('customers.json', 'w') as customers:
+                customers.write('[{"mail_address": "foo@test.com", "pin": 12345, '
+                                '"first_name": "foo", "last_name": "bar"}]')
+            result = runner.invoke(import_customers_command, ['customers.json'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 1 of 1 customers.', result.output)
+        self.assertIsNotNone(Customer.query.get('foo@test.com'))
+
+
+if __name__ == '__main__':
+    unittest.main()
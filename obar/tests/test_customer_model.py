@@ -1,8 +1,8 @@
 import unittest
-import os
 from flask import Flask
 from flask_testing import TestCase
 
+from obar.config import Config
 from obar.models import db, Customer
 
 
@@ -11,10 +11,9 @@ class TestUserAuth(TestCase):
 
     def create_app(self):
         app = Flask(__name__)
+        app.config.from_object(Config)
         app.config['TESTING'] = self.TESTING
-        # If unable to open the db file, check that the working directory is correct s.t. it must be the same of your
-        # application: /path/to/application/obar_backend/
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(os.getcwd(), r'obar\tests\test.db')
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
         db.init_app(app)
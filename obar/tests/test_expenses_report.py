@@ -0,0 +1,86 @@
+import csv
+import datetime
+import io
+import json
+import unittest
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.models import db, Customer, Product, Purchase, PurchaseItem, Site
+
+
+class TestExpensesReport(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add_all([admin, Customer('foo@test.com', '12345', 'foo', 'foo')])
+        water = Product('water', True, 0, 1.5, 10, 1)
+        db.session.add(water)
+        self.purchases = []
+        for day, customer, quantity in ((1, 'foo@test.com', 2), (2, 'foo@test.com', 1), (2, 'admin@test.com', 4)):
+            purchase = Purchase(datetime.datetime(2026, 1, day, 12), customer)
+            db.session.add(purchase)
+            db.session.add(PurchaseItem(quantity, water.product_code_uuid, purchase.purchase_code_uuid, water))
+            self.purchases.append(purchase.purchase_code_uuid)
+        db.session.commit()
+        self.headers = {'Authorization': admin.encode_auth_token().decode()}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def report(self, **args):
+        return self.client.post('/operation/produceExpensesReport', query_string=args, headers=self.headers)
+
+    def test_ndjson(self):
+        response = self.report(format='ndjson')
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertTrue(response.data.endswith(b'\n'))
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(lines, [
+            {'customer': 'admin@test.com', 'total_expenses': 6.0, 'purchases': [
+                {'date': '2026-01-02', 'code': self.purchases[2], 'cost': 6.0}]},
+            {'customer': 'foo@test.com', 'total_expenses': 4.5, 'purchases': [
+                {'date': '2026-01-01', 'code': self.purchases[0], 'cost': 3.0},
+                {'date': '2026-01-02', 'code': self.purchases[1], 'cost': 1.5}]}
+        ])
+
+        response = self.report(format='ndjson', since='2026-01-02T00:00:00', until='2026-01-02T00:00:01')
+        self.assertEqual(response.data, b'')
+
+    def test_csv(self):
+        response = self.report(format='csv', since='2026-01-02T00:00:00')
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename=expenses.csv')
+        self.assertEqual(list(csv.reader(io.StringIO(response.data.decode()))), [
+            ['customer', 'code', 'date', 'cost'],
+            ['admin@test.com', self.purchases[2], '2026-01-02', '6.0'],
+            ['foo@test.com', self.purchases[1], '2026-01-02', '1.5']
+        ])
+
+        # the header is sent even without purchases
+        response = self.report(format='csv', until='2026-01-01T00:00:00')
+        self.assertEqual(response.data.decode().splitlines(), ['customer,code,date,cost'])
+
+    def test_json_stays_the_default(self):
+        response = self.report()
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'application/json')
+        self.assertEqual([review['total_expenses'] for review in response.json], [6.0, 4.5])
+        self.assert400(self.report(format='xml'))
+
+
+if __name__ == '__main__':
+    unittest.main()
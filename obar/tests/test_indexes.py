@@ -0,0 +1,93 @@
+import datetime
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+
+from obar import create_app
+from obar.models import db, Customer, Product, Purchase, PurchaseItem, Site
+from obar.apis.pagination import paginate
+from obar.apis.service.operation_service import purchase_leaderboard, undo_purchase, _load_recent_purchases
+
+
+class TestQueryPlans(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        db.session.add(Customer(customer_mail_address='foo@test.com',
+                                customer_pin_hash='12345',
+                                customer_first_name='foo',
+                                customer_last_name='bar'))
+        product = Product('water', True, 0, 1.0, 100, 1)
+        db.session.add(product)
+        self.purchase = Purchase(purchase_date=datetime.datetime.utcnow(),
+                                 purchase_customer_mail_address='foo@test.com')
+        db.session.add(self.purchase)
+        db.session.add(PurchaseItem(purchase_item_quantity=2,
+                                    purchase_item_product_code_uuid=product.product_code_uuid,
+                                    purchase_item_purchase_code_uuid=self.purchase.purchase_code_uuid))
+        db.session.commit()
+        self.since = datetime.datetime.utcnow() - datetime.timedelta(minutes=2)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def query_plan(self, function, *args):
+        """
+        Calls the function and returns the query plan of the SELECT statements it executed
+        """
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            function(*args)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+        plan = []
+        for statement, parameters in statements:
+            plan.extend(row[-1] for row in db.engine.execute('EXPLAIN QUERY PLAN ' + statement, parameters))
+        return '\n'.join(plan)
+
+    def assertUsesIndexes(self, plan, *indexes):
+        for index in indexes:
+            self.assertIn(index, plan)
+        # no table is scanned without an index
+        self.assertNotRegex(plan, r'(?m)^SCAN (TABLE )?(purchase|purchase_item|product)$')
+
+    def test_recent_purchases(self):
+        plan = self.query_plan(_load_recent_purchases, self.since)
+        self.assertUsesIndexes(plan, 'ix_purchase_date', 'ix_purchase_item_purchase')
+
+    def test_leaderboard(self):
+        plan = self.query_plan(purchase_leaderboard, None, self.since)
+        self.assertUsesIndexes(plan, 'ix_purchase_item_purchase')
+        plan = self.query_plan(purchase_leaderboard, None, None, None, 1)
+        self.assertUsesIndexes(plan, 'ix_product_location', 'ix_purchase_item_product')
+
+    def test_undo_purchase(self):
+        plan = self.query_plan(undo_purchase, self.purchase.purchase_code_uuid, 'foo@test.com')
+        self.assertUsesIndexes(plan, 'ix_purchase_item_purchase')
+
+    def test_pages(self):
+        plan = self.query_plan(paginate, Product.query.filter(Product.product_location_id == 1),
+                               [Product.product_code_uuid], 10, None)
+        self.assertUsesIndexes(plan, 'ix_product_location')
+        plan = self.query_plan(paginate, Purchase.query.filter(Purchase.purchase_customer_mail_address == 'foo'),
+                               [Purchase.purchase_date, Purchase.purchase_code_uuid], 10, None)
+        self.assertUsesIndexes(plan, 'ix_purchase_customer_date')
+
+
+if __name__ == '__main__':
+    unittest.main()
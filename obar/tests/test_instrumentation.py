@@ -0,0 +1,108 @@
+import unittest
+from flask_testing import TestCase
+from sqlalchemy.exc import OperationalError
+
+from obar import create_app
+from obar.models import db, Customer, Site
+
+
+class TestInstrumentation(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        app = create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'INSTRUMENTATION': True,
+            'INSTRUMENTATION_N_PLUS_ONE_THRESHOLD': 3,
+            'INSTRUMENTATION_METRICS_TOKEN': 'scraper-secret'
+        })
+
+        @app.route('/sites/one-by-one')
+        def sites_one_by_one():
+            for site_id in range(1, 5):
+                Site.query.get(site_id)
+            return 'done'
+
+        @app.route('/sites/failing')
+        def sites_failing():
+            try:
+                db.session.execute('SELECT * FROM missing_table')
+            except OperationalError:
+                db.session.rollback()
+            Site.query.get(1)
+            return 'done'
+
+        return app
+
+    def setUp(self):
+        db.create_all()
+        for site_id in range(1, 5):
+            db.session.add(Site(site_id=site_id, site_address=str(site_id), site_city='a'))
+        customer = Customer('foo@test.com', '12345', 'foo', 'foo')
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add_all([customer, admin])
+        db.session.commit()
+        self.token = customer.encode_auth_token().decode()
+        self.admin_token = admin.encode_auth_token().decode()
+        db.session.remove()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def test_server_timing_header(self):
+        response = self.client.get('/sites/one-by-one')
+        timings = response.headers.getlist('Server-Timing')
+        self.assertEqual([timing.split(';')[0] for timing in timings], ['db', 'handler', 'serialize', 'total'])
+        self.assertIn('desc="4 statements"', timings[0])
+
+    def test_failed_statements_are_not_timed(self):
+        for _ in range(3):
+            response = self.client.get('/sites/failing')
+            self.assertIn('desc="1 statements"', response.headers.getlist('Server-Timing')[0])
+        with db.engine.connect() as connection:
+            self.assertNotIn('query_started', connection.info)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/sites/one-by-one')
+        self.client.get('/')
+        response = self.client.get('/metrics', headers={'Authorization': self.admin_token})
+        self.assertEqual(response.status_code, 200)
+        metrics = response.data.decode()
+        self.assertIn('obar_requests_total{endpoint="/sites/one-by-one",method="GET",status="200"} 1', metrics)
+        self.assertIn('obar_db_statements_total{endpoint="/sites/one-by-one",method="GET"} 4', metrics)
+        self.assertIn('obar_n_plus_one_total{endpoint="/sites/one-by-one",method="GET"} 1', metrics)
+        self.assertIn('obar_n_plus_one_total{endpoint="/",method="GET"} 0', metrics)
+        self.assertIn('obar_request_duration_seconds_count{endpoint="/",method="GET"} 1', metrics)
+
+    def test_metrics_authentication(self):
+        self.assert401(self.client.get('/metrics'))
+        self.assert401(self.client.get('/metrics', headers={'Authorization': self.token}))
+        self.assert401(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}))
+        self.assert200(self.client.get('/metrics', headers={'Authorization': 'Bearer scraper-secret'}))
+
+        # without configured token, only the admins are served
+        self.app.config['INSTRUMENTATION_METRICS_TOKEN'] = None
+        self.assert401(self.client.get('/metrics', headers={'Authorization': 'Bearer '}))
+        self.assert200(self.client.get('/metrics', headers={'Authorization': self.admin_token}))
+
+
+class TestInstrumentationDisabled(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def test_no_instrumentation_by_default(self):
+        response = self.client.get('/')
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
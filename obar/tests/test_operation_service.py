@@ -0,0 +1,123 @@
+import unittest
+import datetime
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.models import db, Customer, Product, Purchase, PurchaseItem, Site, DailySales
+from obar.apis.service.operation_service import purchase_leaderboard, best_selling_product, undo_purchase, \
+    produce_expenses
+from obar.apis.service.sales_service import record_purchase, rebuild_counters
+
+
+class TestPurchaseLeaderboard(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        db.session.add(Site(site_id=2, site_address='b', site_city='b'))
+        for mail in ('foo@test.com', 'bar@test.com', 'baz@test.com'):
+            db.session.add(Customer(customer_mail_address=mail,
+                                    customer_pin_hash='12345',
+                                    customer_first_name='foo',
+                                    customer_last_name='bar'))
+        self.first_site_product = Product('water', True, 0, 1.0, 100, 1)
+        self.second_site_product = Product('coffee', True, 0, 1.0, 100, 2)
+        db.session.add(self.first_site_product)
+        db.session.add(self.second_site_product)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def add_purchase(self, mail_address, product, quantity, date):
+        purchase = Purchase(purchase_date=date, purchase_customer_mail_address=mail_address)
+        purchase_item = PurchaseItem(purchase_item_quantity=quantity,
+                                     purchase_item_product_code_uuid=product.product_code_uuid,
+                                     purchase_item_purchase_code_uuid=purchase.purchase_code_uuid)
+        db.session.add(purchase)
+        db.session.add(purchase_item)
+        record_purchase(purchase, [purchase_item])
+        db.session.commit()
+        return purchase
+
+    def test_leaderboard_sums_items_per_customer(self):
+        now = datetime.datetime.utcnow()
+        self.add_purchase('foo@test.com', self.first_site_product, 2, now)
+        self.add_purchase('foo@test.com', self.second_site_product, 3, now)
+        self.add_purchase('bar@test.com', self.first_site_product, 7, now)
+
+        leaderboard = purchase_leaderboard()
+        self.assertEqual([(entry['customer'], entry['purchases']) for entry in leaderboard],
+                         [('bar@test.com', 7), ('foo@test.com', 5), ('baz@test.com', 0)])
+
+    def test_leaderboard_filters(self):
+        now = datetime.datetime.utcnow()
+        self.add_purchase('foo@test.com', self.first_site_product, 2, now - datetime.timedelta(days=10))
+        self.add_purchase('foo@test.com', self.second_site_product, 3, now)
+        self.add_purchase('bar@test.com', self.first_site_product, 4, now)
+
+        leaderboard = purchase_leaderboard(since=now - datetime.timedelta(days=1))
+        self.assertEqual(leaderboard[0]['customer'], 'bar@test.com')
+        self.assertEqual(leaderboard[1]['purchases'], 3)
+
+        leaderboard = purchase_leaderboard(site_id=2, limit=1)
+        self.assertEqual(len(leaderboard), 1)
+        self.assertEqual((leaderboard[0]['customer'], leaderboard[0]['purchases']), ('foo@test.com', 3))
+
+    def test_expenses_aggregate_per_customer_and_purchase(self):
+        now = datetime.datetime.utcnow()
+        first = self.add_purchase('foo@test.com', self.first_site_product, 2, now - datetime.timedelta(days=10))
+        second = self.add_purchase('foo@test.com', self.second_site_product, 3, now)
+
+        expenses, _ = produce_expenses()
+        self.assertEqual([entry['customer'] for entry in expenses],
+                         ['bar@test.com', 'baz@test.com', 'foo@test.com'])
+        self.assertEqual((expenses[0]['total_expenses'], expenses[0]['purchases']), (0, []))
+        self.assertEqual(expenses[2]['total_expenses'], 5.0)
+        self.assertEqual([(p['code'], p['cost']) for p in expenses[2]['purchases']],
+                         [(first.purchase_code_uuid, 2.0), (second.purchase_code_uuid, 3.0)])
+
+        expenses, _ = produce_expenses(since=now - datetime.timedelta(days=1))
+        self.assertEqual(expenses[2]['total_expenses'], 3.0)
+        self.assertEqual([p['code'] for p in expenses[2]['purchases']], [second.purchase_code_uuid])
+
+    def test_counters_follow_undo_and_rebuild(self):
+        now = datetime.datetime.utcnow()
+        self.add_purchase('foo@test.com', self.first_site_product, 2, now)
+        purchase = self.add_purchase('foo@test.com', self.second_site_product, 3, now)
+        self.add_purchase('bar@test.com', self.second_site_product, 1, now)
+
+        undo_purchase(purchase.purchase_code_uuid, 'foo@test.com')
+        leaderboard = purchase_leaderboard()
+        self.assertEqual((leaderboard[0]['customer'], leaderboard[0]['purchases']), ('foo@test.com', 2))
+        products, _ = best_selling_product()
+        self.assertEqual([product['purchases'] for product in products], [1, 1])
+
+        expected = (leaderboard, products, DailySales.query.one().daily_sales_items)
+        rebuild_counters()
+        self.assertEqual((purchase_leaderboard(), best_selling_product()[0], DailySales.query.one().daily_sales_items),
+                         expected)
+
+    def test_counters_created_concurrently_are_incremented(self):
+        now = datetime.datetime.utcnow()
+        # committed by another transaction after this one started
+        db.session.add(DailySales(daily_sales_day=now.date(), daily_sales_items=4,
+                                  daily_sales_revenue=4.0, daily_sales_purchases=2))
+        db.session.commit()
+        self.add_purchase('foo@test.com', self.first_site_product, 2, now)
+        self.add_purchase('bar@test.com', self.first_site_product, 1, now)
+        day = DailySales.query.one()
+        self.assertEqual((day.daily_sales_items, day.daily_sales_purchases), (7, 4))
+        self.assertEqual([row['purchases'] for row in purchase_leaderboard()], [2, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import base64
+import datetime
+import unittest
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.models import db, Customer, Product, Purchase, Site
+
+
+class TestPagination(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'PAGINATION_DEFAULT_LIMIT': 2
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add_all([Site(site_id=1, site_address='a', site_city='a'),
+                            Site(site_id=2, site_address='b', site_city='b')])
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add(admin)
+        db.session.add_all([Customer('c{}@test.com'.format(i), '12345', 'c', 'c') for i in range(4)])
+        db.session.add_all([Product('p{}'.format(i), i % 2 == 0, 0, 1.0, 10, 1 + i % 2) for i in range(5)])
+        # purchases sharing a date are ordered by code
+        start = datetime.datetime(2026, 1, 1)
+        for i in range(6):
+            db.session.add(Purchase(start + datetime.timedelta(days=i // 2), 'c{}@test.com'.format(i % 2)))
+        db.session.commit()
+        self.headers = {'Authorization': admin.encode_auth_token().decode()}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def get(self, url, **args):
+        return self.client.get(url, query_string=args, headers=self.headers)
+
+    def get_pages(self, url, **args):
+        items = []
+        pages = 0
+        while True:
+            response = self.get(url, **args)
+            self.assert200(response)
+            items.extend(response.json)
+            pages += 1
+            if 'X-Next-Cursor' not in response.headers:
+                return items, pages
+            self.assertIn('rel="next"', response.headers['Link'])
+            args['after'] = response.headers['X-Next-Cursor']
+
+    def test_unpaginated_requests_return_every_item(self):
+        for url, count in (('/customer', 5), ('/product', 5), ('/purchase', 6)):
+            response = self.get(url)
+            self.assert200(response)
+            self.assertEqual(len(response.json), count)
+            self.assertNotIn('X-Next-Cursor', response.headers)
+
+    def test_keyset_cursors(self):
+        customers, pages = self.get_pages('/customer', limit=2)
+        self.assertEqual(pages, 3)
+        self.assertEqual([customer['mail_address'] for customer in customers],
+                         [customer['mail_address'] for customer in self.get('/customer').json])
+
+        purchases, pages = self.get_pages('/purchase', limit=4)
+        self.assertEqual(pages, 2)
+        expected = Purchase.query.order_by(Purchase.purchase_date, Purchase.purchase_code_uuid).all()
+        self.assertEqual([purchase['code'] for purchase in purchases],
+                         [purchase.purchase_code_uuid for purchase in expected])
+
+        # a cursor without limit uses the default limit
+        response = self.get('/customer', limit=1)
+        response = self.get('/customer', after=response.headers['X-Next-Cursor'])
+        self.assertEqual(len(response.json), 2)
+        self.assertIn('X-Next-Cursor', response.headers)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', base64.urlsafe_b64encode(b'[1, 2, 3]').decode('ascii'),
+                       base64.urlsafe_b64encode(b'["not a date", "x"]').decode('ascii')):
+            response = self.get('/purchase', after=cursor)
+            self.assert400(response)
+            self.assertIn('Invalid cursor', response.json['message'])
+
+    def test_fields(self):
+        response = self.get('/customer', limit=2, fields='mail_address')
+        self.assertEqual(response.json, [{'mail_address': 'admin@test.com'}, {'mail_address': 'c0@test.com'}])
+        response = self.get('/purchase', fields='code,date')
+        self.assertEqual(set(response.json[0]), {'code', 'date'})
+        response = self.get('/customer', fields='mail_address{')
+        self.assert400(response)
+        self.assertIn('Invalid fields', response.json['message'])
+
+    def test_filters(self):
+        products, _ = self.get_pages('/product', limit=1, location_id=1)
+        self.assertEqual(sorted(product['name'] for product in products), ['p0', 'p2', 'p4'])
+        products = self.get('/product', availability='false').json
+        self.assertEqual(sorted(product['name'] for product in products), ['p1', 'p3'])
+
+        purchases, _ = self.get_pages('/purchase', limit=1, customer='c1@test.com')
+        self.assertEqual(len(purchases), 3)
+        self.assertEqual({purchase['mail_address'] for purchase in purchases}, {'c1@test.com'})
+        purchases = self.get('/purchase', since='2026-01-02T00:00:00', until='2026-01-03T00:00:00').json
+        self.assertEqual([purchase['date'][:10] for purchase in purchases], ['2026-01-02'] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from flask_testing import TestCase
+from werkzeug.security import generate_password_hash
+
+from obar import create_app
+from obar.models import db, Customer
+from obar.apis.service.auth_service import login_customer
+
+
+class TestPinHashing(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'PIN_HASH_METHOD': 'pbkdf2:sha256:1000'
+        })
+
+    def setUp(self):
+        db.create_all()
+        customer = Customer('foo@test.com', '12345', 'foo', 'bar')
+        # hashed before the method was changed
+        customer.customer_pin_hash = generate_password_hash('12345', method='pbkdf2:sha256:2000')
+        db.session.add(customer)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def pin_hash(self):
+        return Customer.query.get('foo@test.com').customer_pin_hash
+
+    def test_new_hashes_use_the_configured_method(self):
+        self.assertTrue(Customer('bar@test.com', '12345', 'bar', 'baz').customer_pin_hash
+                        .startswith('pbkdf2:sha256:1000$'))
+        self.app.config['PIN_HASH_METHOD'] = 'pbkdf2:sha256'
+        self.assertEqual(Customer.pin_hash_method(), 'pbkdf2:sha256:150000')
+
+    def test_hash_is_converted_on_login(self):
+        old_hash = self.pin_hash()
+        _, status = login_customer({'mail_address': 'foo@test.com', 'pin': 54321})
+        self.assertEqual(status, 401)
+        self.assertEqual(self.pin_hash(), old_hash)
+
+        _, status = login_customer({'mail_address': 'foo@test.com', 'pin': 12345})
+        self.assertEqual(status, 200)
+        new_hash = self.pin_hash()
+        self.assertTrue(new_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(Customer.query.get('foo@test.com').check_password('12345'))
+
+        login_customer({'mail_address': 'foo@test.com', 'pin': 12345})
+        self.assertEqual(self.pin_hash(), new_hash)
+
+
+if __name__ == '__main__':
+    unittest.main()
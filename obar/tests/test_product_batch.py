@@ -0,0 +1,93 @@
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+
+from obar import create_app
+from obar.models import db, Customer, Product, Site
+
+
+class TestProductBatch(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add(admin)
+        self.water = Product('water', True, 0, 1.0, 10, 1)
+        self.soda = Product('soda', True, 0, 2.0, 5, 1)
+        db.session.add_all([self.water, self.soda])
+        db.session.commit()
+        self.water_code = self.water.product_code_uuid
+        self.soda_code = self.soda.product_code_uuid
+        self.token = admin.encode_auth_token().decode()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def post_batch(self, operations):
+        return self.client.post('/product/batch', json=operations, headers={'Authorization': self.token})
+
+    def test_operations_are_applied_in_order(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.post_batch([
+                {'op': 'restock', 'code': self.water_code, 'quantity': 5},
+                {'op': 'restock', 'code': self.soda_code, 'quantity': 1},
+                {'op': 'restock', 'code': self.water_code, 'quantity': 2},
+                {'op': 'update', 'code': self.soda_code, 'quantity': 20, 'price': 2.5},
+                {'op': 'restock', 'code': self.soda_code, 'quantity': 3},
+                {'op': 'create', 'name': 'juice', 'availability': True, 'discount': 0, 'price': 3.0,
+                 'quantity': 8, 'location_id': 1},
+                {'op': 'restock', 'code': 'missing', 'quantity': 1},
+                {'op': 'create', 'name': 'water', 'availability': True, 'discount': 0, 'price': 1.0,
+                 'quantity': 1, 'location_id': 1},
+                {'op': 'update', 'code': self.water_code, 'location_id': 2},
+                {'op': 'update', 'code': self.water_code, 'discount': 120},
+                {'op': 'restock', 'code': self.water_code, 'quantity': -1}
+            ])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assert200(response)
+        self.assertEqual([result['status'] for result in response.json],
+                         ['restocked', 'restocked', 'restocked', 'updated', 'restocked', 'created',
+                          'not_found', 'conflict', 'conflict', 'invalid', 'invalid'])
+        # the products and the sites are looked up with one query each, and the
+        # changed products are read back once for the change log
+        self.assertEqual(len([statement for statement in statements if statement.startswith('SELECT')]), 4)
+
+        db.session.expire_all()
+        self.assertEqual(Product.query.get(self.water_code).product_quantity, 17)
+        soda = Product.query.get(self.soda_code)
+        self.assertEqual((soda.product_quantity, soda.product_price), (23, 2.5))
+        juice = Product.query.get(response.json[5]['code'])
+        self.assertEqual((juice.product_name, juice.product_quantity), ('juice', 8))
+
+    def test_names_can_be_swapped(self):
+        response = self.post_batch([
+            {'op': 'update', 'code': self.water_code, 'name': 'tmp'},
+            {'op': 'update', 'code': self.soda_code, 'name': 'water'},
+            {'op': 'update', 'code': self.water_code, 'name': 'soda'}
+        ])
+        self.assert200(response)
+        self.assertEqual([result['status'] for result in response.json], ['updated'] * 3)
+
+    def test_body_must_be_a_list(self):
+        self.assert400(self.post_batch({'op': 'restock', 'code': self.water_code, 'quantity': 1}))
+
+
+if __name__ == '__main__':
+    unittest.main()
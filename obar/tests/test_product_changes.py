@@ -0,0 +1,117 @@
+import datetime
+import unittest
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.models import db, Customer, Product, ProductChange, Site
+from obar.apis.service.product_service import purge_product_changes
+from obar.commands import purge_product_changes_command
+
+
+class TestProductChanges(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add(admin)
+        self.water = Product('water', True, 0, 1.0, 10, 1)
+        db.session.add(self.water)
+        db.session.commit()
+        self.water_code = self.water.product_code_uuid
+        self.headers = {'Authorization': admin.encode_auth_token().decode()}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    def get_changes(self, **args):
+        return self.client.get('/product/changes', query_string=args, headers=self.headers)
+
+    def test_changes_are_logged_in_order(self):
+        self.assertEqual(self.get_changes().json, {'sequence': 0, 'changes': [], 'more': False})
+
+        response = self.client.post('/product', headers=self.headers,
+                                    json={'name': 'soda', 'availability': True, 'discount': 0, 'price': 2.0,
+                                          'quantity': 5, 'location_id': 1})
+        soda_code = response.json['product_code']
+        self.client.put('/product/' + self.water_code, json={'price': 1.5}, headers=self.headers)
+        response = self.client.post('/operation/purchaseProducts',
+                                    json={'purchase_details': [{'product_code': self.water_code,
+                                                                'purchase_quantity': 3}]},
+                                    headers=self.headers)
+        self.client.post('/operation/undoPurchase/' + response.json['purchase_uuid'], headers=self.headers)
+        self.client.post('/product/batch', json=[{'op': 'restock', 'code': self.water_code, 'quantity': 4}],
+                         headers=self.headers)
+        self.client.delete('/product/' + soda_code, headers=self.headers)
+
+        response = self.get_changes(since=0)
+        self.assert200(response)
+        changes = response.json['changes']
+        # only the last stock movement of water is kept
+        self.assertEqual([(change['operation'], change['code'], change['product']) for change in changes], [
+            ('create', soda_code, {'name': 'soda', 'availability': True, 'discount': 0, 'price': 2.0,
+                                   'quantity': 5, 'location_id': 1}),
+            ('update', self.water_code, {'name': 'water', 'availability': True, 'discount': 0, 'price': 1.5,
+                                         'quantity': 10, 'location_id': 1}),
+            ('stock', self.water_code, {'quantity': 14}),
+            ('delete', soda_code, None)
+        ])
+        self.assertEqual([change['sequence'] for change in changes], [1, 2, 5, 6])
+        self.assertEqual(response.json['sequence'], 6)
+
+        response = self.get_changes(since=1, limit=2)
+        self.assertEqual([change['sequence'] for change in response.json['changes']], [2, 5])
+        self.assertEqual((response.json['sequence'], response.json['more']), (5, True))
+        # a client which saw a superseded stock movement gets the last one
+        self.assertEqual([change['sequence'] for change in self.get_changes(since=3).json['changes']], [5, 6])
+        self.assertEqual(self.get_changes(since=6).json, {'sequence': 6, 'changes': [], 'more': False})
+
+    def test_sales_do_not_grow_the_log(self):
+        for _ in range(5):
+            self.client.post('/operation/purchaseProducts',
+                             json={'purchase_details': [{'product_code': self.water_code, 'purchase_quantity': 1}]},
+                             headers=self.headers)
+        self.assertEqual(ProductChange.query.count(), 1)
+        self.assertEqual(self.get_changes(since=0).json['changes'][0]['product'], {'quantity': 5})
+        self.client.put('/product/' + self.water_code, json={'price': 1.5}, headers=self.headers)
+        self.assertEqual([change.product_change_operation for change in ProductChange.query], ['update'])
+
+    def test_purged_changes_are_gone(self):
+        for price in (1.1, 1.2, 1.3):
+            self.client.put('/product/' + self.water_code, json={'price': price}, headers=self.headers)
+        ProductChange.query.update({'product_change_date': datetime.datetime.utcnow() - datetime.timedelta(days=60)})
+        db.session.commit()
+
+        # the last change is kept so that up to date clients keep syncing
+        self.assertEqual(purge_product_changes(30), 2)
+        self.assertEqual(self.get_changes(since=0).status_code, 410)
+        self.assertEqual(self.get_changes(since=2).json['changes'][0]['product']['price'], 1.3)
+        self.assertEqual(self.get_changes(since=3).json['changes'], [])
+        self.assertEqual(self.get_changes(since=4).status_code, 410)
+
+    def test_retention(self):
+        self.app.config['PRODUCT_CHANGES_RETENTION_DAYS'] = 7
+        for price in (1.1, 1.2, 1.3):
+            self.client.put('/product/' + self.water_code, json={'price': price}, headers=self.headers)
+        ProductChange.query.filter(ProductChange.product_change_sequence == 1) \
+            .update({'product_change_date': datetime.datetime.utcnow() - datetime.timedelta(days=8)})
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(purge_product_changes_command, [])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Purged 1 product changes.', result.output)
+        self.assertEqual(self.get_changes(since=0).status_code, 410)
+        self.assertEqual(len(self.get_changes(since=1).json['changes']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
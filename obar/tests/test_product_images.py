@@ -0,0 +1,234 @@
+import base64
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from flask_testing import TestCase
+from PIL import Image
+
+from obar import create_app
+from obar.models import db, Customer, Product, ProductImage, ProductImageVariant, Site
+from obar.apis.service.image_service import generate_missing_variants
+from obar.storage import ImageStorage
+
+
+def make_png(width=16, height=16, color=(255, 0, 0)):
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+class ProductImageTestCase(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        self.storage_dir = tempfile.mkdtemp()
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            'PRODUCT_IMAGE_STORAGE_DIR': self.storage_dir
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        admin = Customer('admin@test.com', '12345', 'admin', 'admin')
+        admin.customer_is_admin = True
+        db.session.add(admin)
+        self.water = Product('water', True, 0, 1.0, 10, 1)
+        self.soda = Product('soda', True, 0, 2.0, 5, 1)
+        db.session.add_all([self.water, self.soda])
+        db.session.commit()
+        self.water_code = self.water.product_code_uuid
+        self.soda_code = self.soda.product_code_uuid
+        self.headers = {'Authorization': admin.encode_auth_token().decode()}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def post_image(self, code, filename, binary):
+        return self.client.post('/product/{}/img'.format(code), headers=self.headers, json={
+            'filename': filename,
+            'file_base64': base64.b64encode(binary).decode('ascii')
+        })
+
+    def stored(self, binary):
+        digest = hashlib.sha256(binary).hexdigest()
+        return os.path.exists(os.path.join(self.storage_dir, digest[:2], digest[2:]))
+
+    def stored_count(self):
+        return sum(len(files) for _, _, files in os.walk(self.storage_dir))
+
+    def get_raw(self, code, headers=None, **args):
+        return self.client.get('/product/{}/img/raw'.format(code), query_string=args,
+                               headers=dict(self.headers, **(headers or {})))
+
+
+class TestProductImageRaw(ProductImageTestCase):
+
+    def test_image_is_served_as_binary(self):
+        binary = make_png()
+        self.assertEqual(self.post_image(self.water_code, 'water.png', binary).status_code, 201)
+        response = self.get_raw(self.water_code)
+        self.assert200(response)
+        self.assertEqual(response.data, binary)
+        self.assertEqual(response.mimetype, 'image/png')
+        self.assertIsNotNone(response.headers.get('ETag'))
+        self.assertIsNotNone(response.last_modified)
+        self.assertIn('private', response.headers['Cache-Control'])
+
+        # the base64 endpoint serves the same binary
+        response = self.client.get('/product/{}/img'.format(self.water_code), headers=self.headers)
+        self.assertEqual(base64.b64decode(response.json['file_base64']), binary)
+
+    def test_conditional_requests(self):
+        self.post_image(self.water_code, 'water.png', make_png())
+        response = self.get_raw(self.water_code)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        response = self.get_raw(self.water_code, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        response = self.get_raw(self.water_code, headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+        self.assert200(self.get_raw(self.water_code, headers={'If-None-Match': '"other"'}))
+        self.assert200(self.get_raw(self.water_code, headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'}))
+
+        # a new image changes the ETag
+        self.client.put('/product/{}/img'.format(self.water_code), headers=self.headers,
+                        json={'file_base64': base64.b64encode(make_png(color=(0, 0, 255))).decode('ascii')})
+        response = self.get_raw(self.water_code, headers={'If-None-Match': etag})
+        self.assert200(response)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_missing_image(self):
+        response = self.get_raw(self.water_code)
+        self.assert404(response)
+        self.assertTrue(response.json['message'].startswith('Image not found'))
+        response = self.get_raw('unknown')
+        self.assert404(response)
+        self.assertTrue(response.json['message'].startswith('Product not found'))
+
+
+class TestImageStorage(ProductImageTestCase):
+
+    def test_incomplete_backends_cannot_be_created(self):
+        class ReadOnlyStorage(ImageStorage):
+            def read(self, digest):
+                return b''
+
+        with self.assertRaises(TypeError):
+            ReadOnlyStorage()
+
+    def test_identical_images_share_a_file(self):
+        binary = make_png()
+        self.post_image(self.water_code, 'water.png', binary)
+        self.post_image(self.soda_code, 'soda.png', binary)
+        self.assertEqual(self.stored_count(), 1)
+        self.assertEqual(len({image.product_image_digest for image in ProductImage.query}), 1)
+
+        # the file is deleted with the last image referencing it
+        self.assertEqual(self.client.delete('/product/{}/img'.format(self.water_code),
+                                            headers=self.headers).status_code, 204)
+        self.assertTrue(self.stored(binary))
+        self.assertEqual(self.get_raw(self.soda_code).data, binary)
+        self.client.delete('/product/{}/img'.format(self.soda_code), headers=self.headers)
+        self.assertFalse(self.stored(binary))
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_replaced_file_is_deleted(self):
+        old, new = make_png(), make_png(color=(0, 255, 0))
+        self.post_image(self.water_code, 'water.png', old)
+        response = self.client.put('/product/{}/img'.format(self.water_code), headers=self.headers,
+                                   json={'file_base64': base64.b64encode(new).decode('ascii')})
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(self.stored(old))
+        self.assertTrue(self.stored(new))
+        self.assertEqual(self.get_raw(self.water_code).data, new)
+
+    def test_failed_upload_leaves_no_file(self):
+        shared, other = make_png(), make_png(color=(0, 255, 0))
+        self.post_image(self.water_code, 'water.png', shared)
+        # the filename is already used: the commit fails after the binary is stored
+        self.assertEqual(self.post_image(self.soda_code, 'water.png', other).status_code, 409)
+        self.assertFalse(self.stored(other))
+        # a binary also referenced by a committed image is kept
+        self.assertEqual(self.post_image(self.soda_code, 'water.png', shared).status_code, 409)
+        self.assertTrue(self.stored(shared))
+        self.assertEqual(self.stored_count(), 1)
+
+
+class TestImageVariants(ProductImageTestCase):
+
+    def variants(self, code):
+        return {variant.product_image_variant_size: (variant.product_image_variant_width,
+                                                     variant.product_image_variant_height)
+                for variant in ProductImageVariant.query.filter_by(product_image_variant_product_code_uuid=code)}
+
+    def test_variants_are_generated_and_served(self):
+        binary = make_png(1000, 500)
+        self.post_image(self.water_code, 'water.png', binary)
+        self.assertEqual(self.variants(self.water_code), {'small': (128, 64), 'medium': (512, 256)})
+
+        etags = set()
+        for size, width in (('small', 128), ('medium', 512)):
+            response = self.get_raw(self.water_code, size=size)
+            self.assert200(response)
+            self.assertEqual(response.mimetype, 'image/jpeg')
+            self.assertEqual(Image.open(io.BytesIO(response.data)).size[0], width)
+            etags.add(response.headers['ETag'])
+            self.assertEqual(self.get_raw(self.water_code, headers={'If-None-Match': response.headers['ETag']},
+                                          size=size).status_code, 304)
+        response = self.get_raw(self.water_code, size='original')
+        self.assertEqual(response.data, binary)
+        etags.add(response.headers['ETag'])
+        self.assertEqual(len(etags), 3)
+        response = self.client.get('/product/{}/img'.format(self.water_code), query_string={'size': 'small'},
+                                   headers=self.headers)
+        self.assertEqual(Image.open(io.BytesIO(base64.b64decode(response.json['file_base64']))).size, (128, 64))
+        self.assert400(self.get_raw(self.water_code, size='huge'))
+
+    def test_small_images_are_served_as_original(self):
+        binary = make_png(200, 100)
+        self.post_image(self.water_code, 'water.png', binary)
+        self.assertEqual(self.variants(self.water_code), {'small': (128, 64)})
+        self.assertEqual(self.get_raw(self.water_code, size='medium').data, binary)
+
+    def test_variants_are_replaced_and_deleted_with_the_image(self):
+        self.post_image(self.water_code, 'water.png', make_png(1000, 500))
+        small = self.get_raw(self.water_code, size='small').data
+        self.client.put('/product/{}/img'.format(self.water_code), headers=self.headers,
+                        json={'file_base64': base64.b64encode(make_png(300, 600, (0, 0, 255))).decode('ascii')})
+        self.assertEqual(self.variants(self.water_code), {'small': (64, 128), 'medium': (256, 512)})
+        self.assertFalse(self.stored(small))
+        response = self.get_raw(self.water_code, size='small')
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (64, 128))
+        self.assertEqual(self.stored_count(), 3)
+
+        self.client.delete('/product/{}/img'.format(self.water_code), headers=self.headers)
+        self.assertEqual(self.variants(self.water_code), {})
+        self.assertEqual(self.stored_count(), 0)
+
+    def test_missing_variants_are_generated(self):
+        self.post_image(self.water_code, 'water.png', make_png(1000, 500))
+        self.post_image(self.soda_code, 'soda.png', make_png(600, 600, (0, 255, 0)))
+        ProductImageVariant.query.filter_by(product_image_variant_product_code_uuid=self.water_code).delete()
+        db.session.commit()
+
+        self.assertEqual(generate_missing_variants(), 1)
+        self.assertEqual(self.variants(self.water_code), {'small': (128, 64), 'medium': (512, 256)})
+        self.assertEqual(generate_missing_variants(), 0)
+        self.app.config['PRODUCT_IMAGE_VARIANTS'] = {'small': 128}
+        self.assertEqual(generate_missing_variants(regenerate=True), 2)
+        self.assertEqual(self.variants(self.soda_code), {'small': (128, 128)})
+        self.assertEqual(self.stored_count(), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from flask_testing import TestCase
+
+from obar import create_app
+from obar.models import db, Customer, Product, PurchaseItem, Site
+
+
+class TestConcurrentPurchases(TestCase):
+    TESTING = True
+    WORKERS = 12
+    STOCK = 5
+
+    def create_app(self):
+        # A file database is needed for the connections of the workers to share data
+        self.db_dir = tempfile.mkdtemp()
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.db_dir, 'test.db')
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1))
+        self.tokens = []
+        for i in range(self.WORKERS):
+            customer = Customer(customer_mail_address='customer{}@test.com'.format(i),
+                                customer_pin_hash='12345',
+                                customer_first_name='foo',
+                                customer_last_name='bar')
+            db.session.add(customer)
+            self.tokens.append(customer.encode_auth_token().decode())
+        self.product = Product('water', True, 0, 1.0, self.STOCK, 1)
+        db.session.add(self.product)
+        db.session.commit()
+        self.product_code = self.product.product_code_uuid
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        shutil.rmtree(self.db_dir)
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        barrier = threading.Barrier(self.WORKERS)
+        status_codes = []
+
+        def checkout(token):
+            client = self.app.test_client()
+            barrier.wait()
+            response = client.post('/operation/purchaseProducts',
+                                   json={'purchase_details': [{'product_code': self.product_code,
+                                                               'purchase_quantity': 1}]},
+                                   headers={'Authorization': token})
+            status_codes.append(response.status_code)
+
+        workers = [threading.Thread(target=checkout, args=(token,)) for token in self.tokens]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        db.session.expire_all()
+        self.assertEqual(status_codes.count(200), self.STOCK)
+        self.assertEqual(status_codes.count(422), self.WORKERS - self.STOCK)
+        self.assertEqual(Product.query.get(self.product_code).product_quantity, 0)
+        self.assertEqual(PurchaseItem.query.count(), self.STOCK)
+
+
+if __name__ == '__main__':
+    unittest.main()
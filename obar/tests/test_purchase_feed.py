@@ -0,0 +1,195 @@
+import datetime
+import threading
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+
+from obar import create_app
+from obar.feed import PurchaseFeed, PURCHASE, REMOVE, get_purchase_feed
+from obar.models import db, Customer, Product, Purchase, PurchaseItem, Site
+from obar.apis.service.operation_service import recent_purchases, undo_purchase, stream_recent_purchases, \
+    check_purchase, _load_recent_purchases
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = datetime.datetime(2020, 1, 1)
+
+    def __call__(self):
+        return self.now
+
+
+def purchase(code, date):
+    return {'code': code, 'date': date, 'product': [], 'first_name': 'foo', 'last_name': 'bar'}
+
+
+class TestPurchaseFeed(unittest.TestCase):
+
+    def test_snapshot_keeps_the_window(self):
+        clock = FakeClock()
+        feed = PurchaseFeed(window=120, clock=clock)
+        feed.load(lambda since: [purchase('old', clock.now - datetime.timedelta(seconds=60))])
+        feed.publish(PURCHASE, purchase('new', clock.now))
+        feed.publish(PURCHASE, purchase('undone', clock.now))
+        feed.publish(REMOVE, {'code': 'undone'})
+        sequence, purchases = feed.snapshot()
+        self.assertEqual(sequence, 3)
+        self.assertEqual([entry['code'] for entry in purchases], ['old', 'new'])
+        clock.now += datetime.timedelta(seconds=90)
+        self.assertEqual([entry['code'] for entry in feed.snapshot()[1]], ['new'])
+
+    def test_reload_publishes_the_changes_of_other_workers(self):
+        clock = FakeClock()
+        feed = PurchaseFeed(window=120, ttl=2, clock=clock)
+        stored = [purchase('kept', clock.now), purchase('undone', clock.now)]
+        feed.load(lambda since: list(stored))
+        feed.load(lambda since: self.fail('the feed is fresh'))
+
+        # another worker undid a purchase and performed a new one
+        stored = [purchase('kept', clock.now), purchase('other', clock.now)]
+        clock.now += datetime.timedelta(seconds=2)
+        feed.load(lambda since: list(stored))
+        self.assertEqual([(sequence, event, data['code']) for sequence, event, data in feed.wait(0, 0)],
+                         [(1, REMOVE, 'undone'), (2, PURCHASE, 'other')])
+        self.assertEqual([entry['code'] for entry in feed.snapshot()[1]], ['kept', 'other'])
+
+    def test_events_published_during_a_reload_are_kept(self):
+        clock = FakeClock()
+        feed = PurchaseFeed(window=120, ttl=2, clock=clock)
+        feed.load(lambda since: [purchase('kept', clock.now)])
+
+        def loader(since):
+            # committed by this worker while the database was queried
+            feed.publish(PURCHASE, purchase('local', clock.now))
+            feed.publish(REMOVE, {'code': 'kept'})
+            return [purchase('kept', clock.now)]
+
+        clock.now += datetime.timedelta(seconds=2)
+        feed.load(loader)
+        self.assertEqual(feed.sequence, 2)
+        self.assertEqual([entry['code'] for entry in feed.snapshot()[1]], ['local'])
+
+    def test_wait_returns_the_published_events(self):
+        feed = PurchaseFeed(size=2)
+        feed.publish(PURCHASE, purchase('first', datetime.datetime.utcnow()))
+        publisher = threading.Timer(0.05, feed.publish, (REMOVE, {'code': 'first'}))
+        publisher.start()
+        events = feed.wait(1, timeout=5)
+        publisher.join()
+        self.assertEqual([(sequence, event) for sequence, event, _ in events], [(2, REMOVE)])
+        self.assertEqual(feed.wait(2, timeout=0), [])
+        feed.publish(PURCHASE, purchase('second', datetime.datetime.utcnow()))
+        # the first event is no longer buffered
+        self.assertIsNone(feed.wait(0, timeout=0))
+        self.assertIsNone(feed.wait(10, timeout=0))
+
+
+class TestRecentPurchases(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        db.session.add(Site(site_id=1, site_address='a', site_city='a'))
+        db.session.add(Customer(customer_mail_address='foo@test.com',
+                                customer_pin_hash='12345',
+                                customer_first_name='foo',
+                                customer_last_name='bar'))
+        self.product = Product('water', True, 0, 1.0, 100, 1)
+        db.session.add(self.product)
+        self.purchase = self.add_purchase('foo@test.com')
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        db.session.remove()
+        db.drop_all()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def add_purchase(self, mail_address):
+        purchase = Purchase(purchase_date=datetime.datetime.utcnow(),
+                            purchase_customer_mail_address=mail_address)
+        db.session.add(purchase)
+        db.session.add(PurchaseItem(purchase_item_quantity=2,
+                                    purchase_item_product_code_uuid=self.product.product_code_uuid,
+                                    purchase_item_purchase_code_uuid=purchase.purchase_code_uuid))
+        db.session.commit()
+        return purchase
+
+    def count_statements(self, function, *args):
+        self.statements = []
+        function(*args)
+        return len(self.statements)
+
+    def test_statements_do_not_grow_with_purchases(self):
+        since = datetime.datetime.utcnow() - datetime.timedelta(minutes=2)
+        code = self.purchase.purchase_code_uuid
+        loading = self.count_statements(_load_recent_purchases, since)
+        checking = self.count_statements(check_purchase, code)
+        for index in range(10):
+            mail_address = 'customer{}@test.com'.format(index)
+            db.session.add(Customer(customer_mail_address=mail_address,
+                                    customer_pin_hash='12345',
+                                    customer_first_name='foo',
+                                    customer_last_name=str(index)))
+            self.add_purchase(mail_address)
+
+        self.assertEqual(len(_load_recent_purchases(since)), 11)
+        self.assertEqual(self.count_statements(_load_recent_purchases, since), loading)
+        self.assertEqual(self.count_statements(check_purchase, code), checking)
+        self.assertEqual(loading, 1)
+        self.assertEqual(checking, 1)
+
+    def test_feed_is_loaded_from_the_database_and_follows_undo(self):
+        code = self.purchase.purchase_code_uuid
+        self.assertEqual(recent_purchases(), {
+            code: {
+                'product': [{'product': 'water', 'quantity': 2, 'price': 2.0}],
+                'first_name': 'foo',
+                'last_name': 'bar'
+            }
+        })
+        events = stream_recent_purchases(duration=0)
+        self.assertIn('event: snapshot', next(events))
+
+        undo_purchase(code, 'foo@test.com')
+        self.assertEqual(recent_purchases(), {})
+        events = list(stream_recent_purchases(last_event_id=0, duration=0))
+        self.assertEqual(events, ['id: 1\nevent: remove\ndata: {"code": "' + code + '"}\n\n'])
+
+    def test_feed_follows_the_database(self):
+        code = self.purchase.purchase_code_uuid
+        feed = get_purchase_feed()
+        feed.ttl = 0
+        self.assertEqual(list(recent_purchases()), [code])
+        sequence = feed.sequence
+
+        # purchases, gifts and undos of another worker are read back from the database
+        other = self.add_purchase('foo@test.com')
+        self.purchase.purchase_gifted = True
+        db.session.commit()
+        self.assertEqual(list(recent_purchases()), [other.purchase_code_uuid])
+        events = list(stream_recent_purchases(last_event_id=sequence, duration=0))
+        self.assertEqual([event.split('\n')[1] for event in events], ['event: remove', 'event: purchase'])
+
+    def test_stream_reloads_the_feed(self):
+        get_purchase_feed().ttl = 0
+        events = stream_recent_purchases(duration=5)
+        self.assertIn('event: snapshot', next(events))
+        code = self.add_purchase('foo@test.com').purchase_code_uuid
+        event = next(events)
+        self.assertIn('event: purchase', event)
+        self.assertIn(code, event)
+
+
+if __name__ == '__main__':
+    unittest.main()
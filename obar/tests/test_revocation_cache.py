@@ -0,0 +1,126 @@
+import datetime
+import unittest
+from flask_testing import TestCase
+from sqlalchemy import event
+
+from obar import create_app
+from obar.cache import LocalRevocationCache, RevocationCache, SharedRevocationCache, get_revocation_cache
+from obar.models import db, BlacklistToken, Customer
+from obar.apis.service.blacklist_service import save_token, purge_blacklist
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis(object):
+    """Minimal Redis stand-in implementing get and setex"""
+
+    def __init__(self):
+        self.values = dict()
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def setex(self, key, ttl, value):
+        self.values[key] = value.encode()
+
+
+class TestLocalRevocationCache(unittest.TestCase):
+
+    def test_base_class_is_abstract(self):
+        with self.assertRaises(TypeError):
+            RevocationCache()
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        cache = LocalRevocationCache(ttl=100, negative_ttl=10, clock=clock)
+        cache.set('revoked', True)
+        cache.set('valid', False)
+        self.assertTrue(cache.get('revoked'))
+        self.assertFalse(cache.get('valid'))
+        clock.now = 10
+        self.assertIsNone(cache.get('valid'))
+        self.assertTrue(cache.get('revoked'))
+        clock.now = 100
+        self.assertIsNone(cache.get('revoked'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = LocalRevocationCache(max_size=2)
+        cache.set('first', True)
+        cache.set('second', True)
+        cache.get('first')
+        cache.set('third', True)
+        self.assertIsNone(cache.get('second'))
+        self.assertTrue(cache.get('first'))
+        self.assertTrue(cache.get('third'))
+
+    def test_shared_cache(self):
+        cache = SharedRevocationCache(FakeRedis())
+        self.assertIsNone(cache.get('token'))
+        cache.set('token', True)
+        self.assertTrue(cache.get('token'))
+        cache.set('token', False)
+        self.assertFalse(cache.get('token'))
+
+
+class TestBlacklistCache(TestCase):
+    TESTING = True
+
+    def create_app(self):
+        return create_app({
+            'TESTING': self.TESTING,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://'
+        })
+
+    def setUp(self):
+        db.create_all()
+        customer = Customer(customer_mail_address='test@test.com',
+                            customer_pin_hash='12345',
+                            customer_first_name='foo',
+                            customer_last_name='bar')
+        db.session.add(customer)
+        db.session.commit()
+        self.token = customer.encode_auth_token().decode()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        get_revocation_cache().clear()
+        db.session.remove()
+        db.drop_all()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def test_lookups_are_cached(self):
+        self.assertEqual(Customer.decode_auth_token(self.token)['status'], 'success')
+        self.assertEqual(Customer.decode_auth_token(self.token)['status'], 'success')
+        self.assertEqual(len(self.statements), 1)
+
+    def test_revoked_token_is_cached_on_save(self):
+        data = Customer.decode_auth_token(self.token)
+        self.assertEqual(data['status'], 'success')
+        save_token(data['token_digest'], data['expires_on'])
+        del self.statements[:]
+        self.assertEqual(Customer.decode_auth_token(self.token)['status'], 'fail')
+        self.assertEqual(len(self.statements), 0)
+        self.assertTrue(BlacklistToken.check_blacklist(data['token_digest']))
+
+    def test_expired_tokens_are_purged(self):
+        data = Customer.decode_auth_token(self.token)
+        save_token(data['token_digest'], data['expires_on'])
+        db.session.add(BlacklistToken('expired', datetime.datetime.utcnow() - datetime.timedelta(seconds=1)))
+        db.session.commit()
+        self.assertEqual(purge_blacklist(), 1)
+        self.assertEqual(BlacklistToken.query.one().token_digest, data['token_digest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
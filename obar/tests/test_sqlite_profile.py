@@ -0,0 +1,104 @@
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+from obar import create_app
+from obar.models import db, Site
+from obar.sqlite import apply_profile, migration_pragmas, sqlite_pragmas
+
+
+class TestSQLiteProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_app(self, profile):
+        app = create_app({
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.directory, profile + '.db'),
+            'SQLITE_PROFILE': profile,
+            # fails fast instead of waiting for the lock
+            'SQLITE_PRAGMAS': {'busy_timeout': 100}
+        })
+        with app.app_context():
+            db.create_all()
+            for site_id in range(1, 4):
+                db.session.add(Site(site_id=site_id, site_address=str(site_id), site_city='a'))
+            db.session.commit()
+            db.session.remove()
+        return app
+
+    def commit_while_reading(self, app):
+        """
+        Commits an update while another connection is reading the same table
+        :return: the value read by the reader after the commit
+        """
+        with app.app_context():
+            engine = db.get_engine(app)
+            reader = engine.connect()
+            writer = engine.connect()
+            try:
+                rows = reader.execute('SELECT site_city FROM site ORDER BY site_id')
+                rows.fetchone()
+                with writer.begin():
+                    writer.execute("UPDATE site SET site_city = 'b'")
+                return rows.fetchone()[0]
+            finally:
+                reader.close()
+                writer.close()
+                engine.dispose()
+
+    def test_production_profile_pragmas(self):
+        app = self.create_app('production')
+        with app.app_context():
+            connection = db.get_engine(app).connect()
+            pragma = lambda name: connection.execute('PRAGMA ' + name).scalar()
+            self.assertEqual(pragma('journal_mode'), 'wal')
+            self.assertEqual(pragma('foreign_keys'), 1)
+            self.assertEqual(pragma('synchronous'), 1)
+            self.assertEqual(pragma('busy_timeout'), 100)
+            self.assertEqual(pragma('temp_store'), 2)
+            connection.close()
+
+    def test_readers_do_not_block_the_writer_in_wal_mode(self):
+        # the reader keeps reading its snapshot, taken before the commit
+        self.assertEqual(self.commit_while_reading(self.create_app('production')), 'a')
+
+    def test_readers_block_the_writer_with_the_rollback_journal(self):
+        with self.assertRaises(OperationalError):
+            self.commit_while_reading(self.create_app('default'))
+
+    def test_profile_applies_to_other_engines(self):
+        # e.g. the engine built by the migrations
+        engine = create_engine('sqlite:///' + os.path.join(self.directory, 'migrations.db'))
+        apply_profile(engine, sqlite_pragmas({'SQLITE_PROFILE': 'production'}), logging.getLogger(__name__))
+        with engine.connect() as connection:
+            self.assertEqual(connection.execute('PRAGMA journal_mode').scalar(), 'wal')
+            self.assertEqual(connection.execute('PRAGMA foreign_keys').scalar(), 1)
+        engine.dispose()
+
+    def test_migration_pragmas(self):
+        engine = create_engine('sqlite:///' + os.path.join(self.directory, 'migrations.db'))
+        apply_profile(engine, migration_pragmas({'SQLITE_PROFILE': 'production', 'SQLITE_PRAGMAS': {'busy_timeout': 100}}),
+                      logging.getLogger(__name__))
+        with engine.connect() as connection:
+            self.assertEqual(connection.execute('PRAGMA foreign_keys').scalar(), 0)
+            self.assertEqual(connection.execute('PRAGMA journal_mode').scalar(), 'delete')
+            self.assertEqual(connection.execute('PRAGMA busy_timeout').scalar(), 100)
+        engine.dispose()
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'SQLITE_PROFILE': 'fast'})
+
+
+if __name__ == '__main__':
+    unittest.main()